@@ -0,0 +1,274 @@
+import numpy as np
+
+# Largo mínimo de una racha de autos para considerarla atasco
+JAM_MIN_LENGTH = 2
+
+
+def _dense(lane):
+    """Carril como arreglo de un byte por celda (desempaqueta PackedLane)."""
+    if hasattr(lane, "to_array"):
+        return lane.to_array(np.uint8)
+    return np.asarray(lane, dtype=np.uint8)
+
+
+class JamIndex:
+    """Atascos de un carril: rachas máximas de autos consecutivos, con su inicio, largo y edad.
+
+    Cada atasco tiene un identificador estable y cada celda guarda el del
+    atasco al que pertenece (-1 si ninguno); inicio, largo y generación de
+    nacimiento viven en arreglos indexados por identificador. En la Regla
+    184 solo se mueven los extremos de los atascos, así que update() revisa
+    únicamente las celdas que cambiaron, sus vecinas y los atascos que las
+    tocan; un auto suelto que avanza no toca el índice. Un atasco conserva
+    su identificador (y su edad) en el atasco nuevo con el que más celdas
+    comparte; si no tiene sucesor se guarda su duración en self.lifetimes.
+
+    El inicio de un atasco es su celda de menor índice (en toroide puede
+    dar la vuelta: el atasco ocupa start, start + 1, ... módulo el largo).
+    """
+
+    def __init__(self, lane, boundary_mode="toroid", direction="left_to_right",
+                 min_length=JAM_MIN_LENGTH, generation=0):
+        self.cells = _dense(lane).copy()
+        self.num_cells = len(self.cells)
+        self.circular = boundary_mode == "toroid"
+        self.direction = direction
+        self.min_length = min_length
+        self.generation = generation
+
+        self.label = np.full(self.num_cells, -1, dtype=np.int64)
+        self.start = np.zeros(0, dtype=np.int64)
+        self.length = np.zeros(0, dtype=np.int64)
+        self.born = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        self._free = []  # Identificadores libres (se toman del final)
+        self.lifetimes = []  # Duración (generaciones) de los atascos que ya terminaron
+
+        starts, lengths = self._runs_in(np.arange(self.num_cells))
+        ids = self._allocate(len(starts))
+        self._store(ids, starts, lengths)
+        self.born[ids] = generation
+
+    def _allocate(self, count):
+        """Identificadores libres para count atascos nuevos (crece los arreglos si faltan)."""
+        if len(self._free) < count:
+            old = len(self.start)
+            size = max(2 * old, old + count, 16)
+            for name in ("start", "length", "born", "alive"):
+                array = getattr(self, name)
+                setattr(self, name, np.concatenate([array, np.zeros(size - old, dtype=array.dtype)]))
+            self._free.extend(range(size - 1, old - 1, -1))
+        ids = np.array(self._free[len(self._free) - count:], dtype=np.int64)
+        del self._free[len(self._free) - count:]
+        return ids
+
+    def _store(self, ids, starts, lengths):
+        self.start[ids] = starts
+        self.length[ids] = lengths
+        self.alive[ids] = True
+        cells, owner = self._spans(starts, lengths)
+        self.label[cells] = ids[owner]
+
+    def _spans(self, starts, lengths):
+        """Celdas de varios atascos y, para cada celda, la posición de su atasco."""
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        cells = (np.repeat(starts, lengths) + offsets) % max(self.num_cells, 1)
+        return cells, np.repeat(np.arange(len(starts)), lengths)
+
+    def _runs_in(self, region):
+        """Rachas de autos (inicios, largos) dentro de region, un arreglo ordenado de celdas."""
+        occupied = region[self.cells[region] == 1]
+        if len(occupied) == self.num_cells and len(occupied) > 0:
+            starts, lengths = np.array([0]), np.array([self.num_cells])
+        else:
+            breaks = np.flatnonzero(np.diff(occupied) != 1) + 1
+            first = np.concatenate([[0], breaks]) if len(occupied) else breaks
+            last = np.concatenate([breaks, [len(occupied)]]) if len(occupied) else breaks
+            starts, lengths = occupied[first], last - first
+            # En toroide, la racha que toca la última celda sigue en la primera
+            if (self.circular and len(starts) > 1
+                    and occupied[0] == 0 and occupied[-1] == self.num_cells - 1):
+                starts = np.concatenate([[starts[-1]], starts[1:-1]])
+                lengths = np.concatenate([[lengths[-1] + lengths[0]], lengths[1:-1]])
+        keep = lengths >= self.min_length
+        return starts[keep].astype(np.int64), lengths[keep].astype(np.int64)
+
+    def _heirs(self, starts, lengths):
+        """Identificador anterior que hereda cada atasco nuevo (-1 si es nuevo).
+
+        Gana el par (atasco nuevo, anterior) que comparte más celdas y, a
+        igualdad, el del atasco nuevo más largo; cada identificador se
+        hereda una sola vez.
+        """
+        heirs = np.full(len(starts), -1, dtype=np.int64)
+        cells, owner = self._spans(starts, lengths)
+        labels = self.label[cells]
+        keep = labels >= 0
+        size = len(self.start)
+        pairs, shared = np.unique(owner[keep] * size + labels[keep], return_counts=True)
+        new, old = pairs // size, pairs % size
+        while len(new):
+            order = np.lexsort((-lengths[new], -shared))
+            new, old, shared = new[order], old[order], shared[order]
+            _, best = np.unique(new, return_index=True)
+            best.sort()
+            _, winners = np.unique(old[best], return_index=True)
+            winners = best[winners]
+            heirs[new[winners]] = old[winners]
+            pending = ~np.isin(new, new[winners]) & ~np.isin(old, old[winners])
+            new, old, shared = new[pending], old[pending], shared[pending]
+        return heirs
+
+    def _around(self, cells, reach):
+        """Celdas dadas y reach celdas a cada lado, ordenadas y sin repetir."""
+        reach = min(reach, self.num_cells - 1)
+        around = (cells[:, None] + np.arange(-reach, reach + 1)).ravel()
+        if self.circular:
+            around %= self.num_cells
+        else:
+            around = around[(around >= 0) & (around < self.num_cells)]
+        return np.unique(around)
+
+    def _arrivals_adjacent(self, arrived):
+        """¿Algún auto que llegó (índices de celdas) quedó junto a otro auto?"""
+        neighbours = np.concatenate([arrived - 1, arrived + 1])
+        if self.circular:
+            neighbours %= self.num_cells
+        else:
+            neighbours = neighbours[(neighbours >= 0) & (neighbours < self.num_cells)]
+        return bool(np.any(self.cells[neighbours] == 1))
+
+    def update(self, lane, generation=None, changed=None):
+        """Llevar el índice al nuevo estado del carril.
+
+        changed son los índices de las celdas que cambiaron (los que deja el
+        simulador en self.changes); con ellos solo se leen esas celdas del
+        carril, sin desempaquetar PackedLane. Si no se dan, se compara el
+        carril completo.
+        """
+        self.generation = self.generation + 1 if generation is None else generation
+        if changed is None:
+            lane = _dense(lane)
+            changed = np.flatnonzero(lane != self.cells)
+        if len(changed) == 0:
+            return
+        changed = np.asarray(changed, dtype=np.intp)
+        values = np.asarray(lane[changed], dtype=np.uint8)
+        self.cells[changed] = values
+
+        # Celdas a revisar: las que cambiaron, sus vecinas y los atascos que
+        # las tocan. Fuera de esta región ningún atasco puede haber cambiado.
+        # Las rachas más cortas que min_length no están en el índice, así que
+        # un cambio puede alargar una racha de hasta min_length - 1 autos; y
+        # siempre hay que mirar al menos una vecina, porque un auto que llega
+        # puede unir dos atascos
+        region = self._around(changed, max(1, self.min_length - 1))
+        labels = self.label[region]
+        dirty = np.unique(labels[labels >= 0])
+        if len(dirty) == 0 and self.min_length > 1 and not self._arrivals_adjacent(changed[values == 1]):
+            # Ningún atasco cambió y ningún auto que llegó quedó junto a
+            # otro: los autos sueltos que avanzan no forman atascos (salvo
+            # con min_length = 1)
+            return
+        dirty_cells, _ = self._spans(self.start[dirty], self.length[dirty])
+        starts, lengths = self._runs_in(np.union1d(region, dirty_cells))
+        heirs = self._heirs(starts, lengths)
+
+        # Los atascos anteriores sin sucesor terminan
+        dead = dirty[~np.isin(dirty, heirs)]
+        self.lifetimes.extend((self.generation - self.born[dead]).tolist())
+        self.alive[dead] = False
+        self._free.extend(dead.tolist())
+        self.label[dirty_cells] = -1
+
+        newborn = heirs < 0
+        heirs[newborn] = self._allocate(int(np.count_nonzero(newborn)))
+        self.born[heirs[newborn]] = self.generation
+        self._store(heirs, starts, lengths)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.alive))
+
+    def jams(self):
+        """Lista de atascos (inicio, largo, edad) ordenada por inicio."""
+        ids = np.flatnonzero(self.alive)
+        ids = ids[np.argsort(self.start[ids])]
+        return [(int(self.start[i]), int(self.length[i]), int(self.generation - self.born[i])) for i in ids]
+
+    def largest(self):
+        """Atasco más largo (inicio, largo, edad) o None."""
+        ids = np.flatnonzero(self.alive)
+        if len(ids) == 0:
+            return None
+        i = ids[np.argmax(self.length[ids])]
+        return int(self.start[i]), int(self.length[i]), int(self.generation - self.born[i])
+
+    def jam_at(self, cell):
+        """Atasco (inicio, largo, edad) que ocupa la celda, o None."""
+        i = self.label[cell]
+        if i < 0:
+            return None
+        return int(self.start[i]), int(self.length[i]), int(self.generation - self.born[i])
+
+    def queued_behind(self, broken):
+        """Autos atorados detrás de cada auto descompuesto: diccionario celda -> autos.
+
+        Un auto descompuesto bloquea a todo su atasco detrás de él; el
+        primero de la cola es el que tiene al descompuesto justo adelante.
+        """
+        cells = np.flatnonzero(np.asarray(broken) > 0)
+        ids = self.label[cells]
+        inside = ids >= 0
+        # Fuera de un atasco no hay nadie atorado detrás
+        queued = np.zeros(len(cells), dtype=np.int64)
+        ids = ids[inside]
+        offset = (cells[inside] - self.start[ids]) % self.num_cells
+        if self.direction != "left_to_right":
+            offset = self.length[ids] - 1 - offset
+        queued[inside] = offset
+        return {int(cell): int(count) for cell, count in zip(cells, queued)}
+
+    def lifetime_histogram(self, bins=10):
+        """Histograma de la duración de los atascos terminados (np.histogram)."""
+        return np.histogram(self.lifetimes, bins=bins)
+
+
+class JamTracker:
+    """Un JamIndex por carril del simulador, alimentado por su update()."""
+
+    def __init__(self, simulator, min_length=JAM_MIN_LENGTH):
+        self.indexes = {name: JamIndex(getattr(simulator, name), simulator.boundary_mode, direction,
+                                       min_length, simulator.generation)
+                        for name, _, direction in simulator.LANES}
+        self.broken_names = {name: broken_name for name, broken_name, _ in simulator.LANES}
+
+    @classmethod
+    def attach(cls, simulator, min_length=JAM_MIN_LENGTH):
+        """Crear los índices y conectarlos al update() del simulador."""
+        simulator.jams = cls(simulator, min_length)
+        return simulator.jams
+
+    def observe(self, simulator):
+        # El simulador deja en changes las celdas que cambiaron en cada carril
+        changes = getattr(simulator, "changes", None)
+        for name, index in self.indexes.items():
+            changed = changes[name].changed if changes is not None else None
+            index.update(getattr(simulator, name), simulator.generation, changed)
+
+    def count(self):
+        """Número de atascos en todos los carriles."""
+        return sum(len(index) for index in self.indexes.values())
+
+    def largest(self):
+        """Atasco más largo de todos los carriles: (carril, inicio, largo, edad) o None."""
+        jams = [(name,) + index.largest() for name, index in self.indexes.items() if len(index)]
+        return max(jams, key=lambda jam: jam[2], default=None)
+
+    def lifetimes(self):
+        """Duraciones de todos los atascos terminados."""
+        return np.array([life for index in self.indexes.values() for life in index.lifetimes], dtype=int)
+
+    def queued_behind(self, simulator):
+        """Autos atorados detrás de cada auto descompuesto, por carril."""
+        return {name: index.queued_behind(getattr(simulator, self.broken_names[name]))
+                for name, index in self.indexes.items()}
@@ -0,0 +1,160 @@
+import argparse
+import csv
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+# Evitar que el mensaje de bienvenida de pygame se mezcle con la tabla
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import carril
+import doble_carril
+from fases import check_density
+from regla184 import RULE_184, moving_cars
+
+# Modelos que se pueden barrer: módulo y clase del simulador. Ambos avanzan
+# con RULE_OUTPUT (izquierda XOR derecha), no con la Regla 184: la tabla no
+# conserva los autos y cualquier densidad inicial tiende a cerca de 0.5, así
+# que el barrido no da un diagrama flujo-densidad. Para eso están
+# ciudad.speed_by_density y red, que sí avanzan con la Regla 184
+MODELS = {
+    "carril": (carril, "TrafficSimulator"),
+    "doble_carril": (doble_carril, "DoubleRoadTrafficSimulator"),
+}
+
+# Constantes de módulo que se pueden barrer
+SWEPT_CONSTANTS = ("CAR_BREAKDOWN_PROB", "CAR_CHANGE_LANE_PROB", "CAR_INSERTION_PROB", "REPAIR_PROB")
+
+
+def run_configuration(config):
+    """Ejecutar una configuración sin ventana y medir densidad y celdas libres adelante.
+
+    Se ejecuta en un proceso del pool: las constantes del barrido se fijan
+    en el módulo del modelo dentro de ese proceso antes de crear el
+    simulador. Devuelve la configuración junto con la tabla del modelo
+    (rule), la densidad medida tras el calentamiento y los autos sanos con
+    la celda de adelante libre, por celda (free_ahead) y por auto
+    (free_ahead_share). Con la Regla 184 esos serían el flujo y la velocidad
+    media; con la tabla XOR de carril no son los autos que se mueven, y la
+    densidad medida no sigue a la pedida, así que nada de esto debe
+    graficarse contra config["density"].
+    """
+    module, class_name = MODELS[config["model"]]
+    for name in SWEPT_CONSTANTS:
+        setattr(module, name, config[name])
+
+    simulator = getattr(module, class_name)(config["boundary_mode"], density=config["density"],
+                                            seed=config["seed"])
+    for _ in range(config["warmup"]):
+        simulator.update()
+
+    total_cars = 0
+    total_moving = 0
+    total_cells = 0
+    for _ in range(config["generations"]):
+        for lane_name, broken_name, direction in simulator.LANES:
+            lane = getattr(simulator, lane_name)
+            broken = getattr(simulator, broken_name) > 0
+            moving = moving_cars(lane, simulator.boundary_mode, direction) & ~broken
+            total_cars += int(np.sum(lane))
+            total_moving += int(np.sum(moving))
+            total_cells += len(lane)
+        simulator.update()
+
+    result = dict(config)
+    result["rule"] = "rule_184" if np.array_equal(module.RULE_OUTPUT, RULE_184) else "left_xor_right"
+    result["measured_density"] = total_cars / total_cells
+    result["free_ahead"] = total_moving / total_cells
+    result["free_ahead_share"] = total_moving / total_cars if total_cars else 0.0
+    return result
+
+
+def sweep(model="carril", densities=(0.3,), breakdown_probs=(carril.CAR_BREAKDOWN_PROB,),
+          change_lane_probs=(carril.CAR_CHANGE_LANE_PROB,), insertion_probs=(carril.CAR_INSERTION_PROB,),
+          repair_probs=(carril.REPAIR_PROB,), boundary_mode="toroid", warmup=200, generations=500,
+          repetitions=1, seed=0, max_workers=None, on_result=None):
+    """Barrer una rejilla de parámetros repartiendo las ejecuciones en procesos.
+
+    Cada combinación se ejecuta `repetitions` veces con semillas distintas.
+    Los resultados se agregan a una sola tabla (lista de diccionarios) en
+    el orden en que terminan; on_result, si se da, recibe cada fila en
+    cuanto llega. Cada carril empieza con cada celda ocupada con
+    probabilidad density, así que las densidades deben estar entre 0 y 1.
+    """
+    for density in densities:
+        check_density(density)
+    configs = []
+    grid = itertools.product(densities, breakdown_probs, change_lane_probs, insertion_probs,
+                             repair_probs, range(repetitions))
+    for density, breakdown, change, insertion, repair, repetition in grid:
+        configs.append({
+            "model": model,
+            "boundary_mode": boundary_mode,
+            "density": density,
+            "CAR_BREAKDOWN_PROB": breakdown,
+            "CAR_CHANGE_LANE_PROB": change,
+            "CAR_INSERTION_PROB": insertion,
+            "REPAIR_PROB": repair,
+            "seed": seed + len(configs),
+            "warmup": warmup,
+            "generations": generations,
+        })
+
+    table = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_configuration, config) for config in configs]
+        for future in as_completed(futures):
+            row = future.result()
+            table.append(row)
+            if on_result is not None:
+                on_result(row)
+    return table
+
+
+def _float_list(text):
+    return [float(value) for value in text.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Barrido de parámetros de carril y doble_carril (tabla XOR: no es un diagrama flujo-densidad)")
+    parser.add_argument("--model", choices=sorted(MODELS), default="carril")
+    parser.add_argument("--boundary-mode", choices=("toroid", "null"), default="toroid")
+    parser.add_argument("--densities", type=_float_list, default=[0.3])
+    parser.add_argument("--breakdown-probs", type=_float_list, default=[carril.CAR_BREAKDOWN_PROB])
+    parser.add_argument("--change-lane-probs", type=_float_list, default=[carril.CAR_CHANGE_LANE_PROB])
+    parser.add_argument("--insertion-probs", type=_float_list, default=[carril.CAR_INSERTION_PROB])
+    parser.add_argument("--repair-probs", type=_float_list, default=[carril.REPAIR_PROB])
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--generations", type=int, default=500)
+    parser.add_argument("--repetitions", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--csv", help="Archivo CSV de salida (por defecto, salida estándar)")
+    args = parser.parse_args()
+
+    output = open(args.csv, "w", newline="") if args.csv else sys.stdout
+    writer = None
+
+    def write_row(row):
+        # Escribir cada fila en cuanto llega
+        nonlocal writer
+        if writer is None:
+            writer = csv.DictWriter(output, fieldnames=list(row))
+            writer.writeheader()
+        writer.writerow(row)
+        output.flush()
+
+    sweep(args.model, args.densities, args.breakdown_probs, args.change_lane_probs,
+          args.insertion_probs, args.repair_probs, args.boundary_mode, args.warmup,
+          args.generations, args.repetitions, args.seed, args.workers, write_row)
+
+    if args.csv:
+        output.close()
+
+
+if __name__ == "__main__":
+    main()
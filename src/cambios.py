@@ -0,0 +1,69 @@
+import numpy as np
+
+# Índices vacíos, para los sucesos que no ocurrieron en una generación
+NO_CELLS = np.zeros(0, dtype=np.intp)
+
+
+def changed_cells(before, after):
+    """Índices de las celdas distintas entre dos estados de un carril.
+
+    Con PackedLane se comparan las palabras y solo se desempaquetan las que
+    difieren, así que el costo depende de los cambios y no del largo.
+    """
+    if hasattr(after, "changed_cells"):
+        return after.changed_cells(before)
+    return np.flatnonzero(np.asarray(before) != np.asarray(after))
+
+
+def _cells(cells):
+    """Índices ordenados y sin repetir."""
+    return np.unique(np.asarray(cells, dtype=np.intp))
+
+
+class LaneChanges:
+    """Lo que pasó en un carril durante una generación, como índices de celdas.
+
+    changed son las celdas con un estado distinto al de la generación
+    anterior; towed, las que vació la grúa antes del paso de la regla; left,
+    las celdas de las que un auto salió del carril después de la regla
+    (cambio de carril, giro o retiro por el límite de autos); entered, las
+    que recibieron un auto que no venía de la celda de atrás (cambio de
+    carril, giro o inserción), y broken, las celdas donde empezó o terminó
+    una avería. Todos son arreglos ordenados.
+
+    Los simuladores dejan un LaneChanges por carril en self.changes al
+    final de update(), y con eso TrafficMetrics y JamTracker se actualizan
+    revisando solo esas celdas.
+    """
+
+    def __init__(self, changed, towed=NO_CELLS, left=NO_CELLS, entered=NO_CELLS, broken=NO_CELLS):
+        self.changed = _cells(changed)
+        self.towed = _cells(towed)
+        self.left = _cells(left)
+        self.entered = _cells(entered)
+        self.broken = _cells(broken)
+
+    @classmethod
+    def between(cls, before, after, towed=NO_CELLS, ended=NO_CELLS, started=NO_CELLS,
+                left=NO_CELLS, entered=NO_CELLS):
+        """Cambios de un carril entre before (ya sin los autos remolcados) y after.
+
+        ended son las averías que terminaron en tick_breakdowns (reparadas o
+        remolcadas) y started las nuevas.
+        """
+        towed = _cells(towed)
+        # Una celda remolcada cambió si nadie llegó a ocuparla después
+        changed = np.setxor1d(changed_cells(before, after), towed, assume_unique=True)
+        broken = np.setxor1d(_cells(ended), _cells(started), assume_unique=True)
+        return cls(changed, towed, left, entered, broken)
+
+    @classmethod
+    def concatenate(cls, parts, offsets):
+        """Unir los cambios de tramos contiguos del carril; offsets es la primera celda de cada tramo."""
+        fields = ("changed", "towed", "left", "entered", "broken")
+        return cls(*(np.concatenate([getattr(part, field) + offset for part, offset in zip(parts, offsets)])
+                     for field in fields))
+
+    def touched(self):
+        """Celdas que cambiaron o en las que ocurrió algún suceso."""
+        return np.union1d(np.union1d(self.changed, self.towed), np.union1d(self.left, self.entered))
@@ -1,11 +1,16 @@
 import pygame
 import numpy as np
-import random
-import os
 import math
+import sys
 
-# Inicializar pygame
-pygame.init()
+import repeticion
+import visor
+from cambios import LaneChanges
+from empaquetado import PackedLane
+from fases import (apply_lane_changes, lane_change_cells, pin_broken_cars, random_lane, spawn_streams,
+                   tick_breakdowns)
+from regla184 import apply_rule
+from tiempos import PhaseTimings
 
 # Constantes
 WIDTH, HEIGHT = 1500, 140
@@ -18,47 +23,115 @@ CAR_BREAKDOWN_PROB = 0.05
 CAR_INSERTION_PROB = 0.1
 REPAIR_ATTEMPTS = 20
 REPAIR_PROB = 0.5
+# Ocupación del patrón inicial espaciado, cuando no se pide una densidad
+SPACED_DENSITY = 0.3
 
 # Colores
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
 
-# Crear la ventana
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Simulador de Tráfico Regla 184")
+# Tabla de búsqueda de la regla, indexada por el patrón (izquierda, centro, derecha)
+# 111 -> 0
+# 110 -> 1
+# 101 -> 0
+# 100 -> 1
+# 011 -> 1
+# 010 -> 0
+# 001 -> 1
+# 000 -> 0
+RULE_OUTPUT = np.array([0, 1, 0, 1, 1, 0, 1, 0])
 
-# Cargar imágenes
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-road_img = pygame.image.load(os.path.join(parent_dir, "./assets/carril.png"))
-# Crear versiones mejoradas de los coches
-car_img = pygame.image.load(os.path.join(parent_dir, "./assets/1_left.png"))
-car_img = pygame.transform.scale(car_img, (CELL_SIZE, CELL_SIZE))
+# Superficies del visor. Se crean en init_viewer(), de modo que la simulación
+# puede importarse y ejecutarse sin inicializar pygame (modo headless)
+screen = None
+road_img = None
+car_img = None
+broken_car_img = None
+font = None
+shadow_img = None
+smoke_imgs = None
+hud = None
+renderer = None
 
-# Versión mejorada para autos descompuestos - copia profunda para no modificar el original
-broken_car_img = car_img.copy()
-
-# Aplicar un tinte rojo a los autos descompuestos
-red_overlay = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
-red_overlay.fill((255, 0, 0, 100))
-broken_car_img.blit(red_overlay, (0, 0))
-
-road_img = pygame.transform.scale(road_img, (WIDTH, HEIGHT))
+def init_viewer(surface=None):
+    """Crear la ventana (o usar la superficie dada) y cargar las imágenes."""
+    global screen, road_img, car_img, broken_car_img, font
+    global shadow_img, smoke_imgs, hud, renderer
+    screen = visor.open_screen(WIDTH, HEIGHT, "Simulador de Tráfico Regla 184", surface)
+    road_img = visor.load_image("carril.png", (WIDTH, HEIGHT))
+    car_img = visor.load_image("1_left.png", (CELL_SIZE, CELL_SIZE))
+    broken_car_img = visor.tint_broken(car_img)
+    font = visor.create_font(18)
+    
+    # Sombra y humo se arman una sola vez; el renderizador guarda el fondo
+    shadow_img = visor.make_shadow(CELL_SIZE)
+    smoke_imgs = visor.make_smoke_puffs()
+    hud = visor.Hud(font, BLACK)
+    renderer = visor.DirtyRenderer(screen, road_img)
 
 class TrafficSimulator:
-    def __init__(self, boundary_mode="toroid"):
+    # Carriles del simulador: (atributo del carril, atributo de averías, sentido)
+    LANES = (
+        ("upper_lane", "broken_cars_upper", "left_to_right"),
+        ("lower_lane", "broken_cars_lower", "left_to_right"),
+    )
+    
+    def __init__(self, boundary_mode="toroid", engine="dense", density=None, seed=None):
+        # Un generador por carril y por subsistema, derivados de la semilla
+        # (la semilla usada queda en self.seed para repetir la corrida)
+        self.seed, self.streams = spawn_streams(
+            seed, ("init", "insertion") + tuple(lane_name for lane_name, _, _ in self.LANES))
+        init_rng = self.streams["init"]
+        
         # Inicializar carriles (0 = vacío, 1 = auto)
+        if density is not None:
+            # Densidad pedida: cada celda ocupada con probabilidad density
+            self.upper_lane = random_lane(init_rng, NUM_CELLS, density)
+            self.lower_lane = random_lane(init_rng, NUM_CELLS, density)
+        else:
+            self._initialize_spaced(init_rng)
+        
+        # Motor de carriles: "dense" (un entero por celda) o "packed"
+        # (64 celdas por palabra, para carriles muy largos)
+        self.engine = engine
+        if engine == "packed":
+            self.upper_lane = PackedLane.from_array(self.upper_lane)
+            self.lower_lane = PackedLane.from_array(self.lower_lane)
+        
+        # Generaciones restantes de cada celda (0 = auto sano)
+        self.broken_cars_upper = np.zeros(NUM_CELLS, dtype=np.int16)
+        self.broken_cars_lower = np.zeros(NUM_CELLS, dtype=np.int16)
+        
+        self.generation = 0
+        self.boundary_mode = boundary_mode  # "toroid" o "null"
+        
+        # Añadir atributo para la velocidad de simulación
+        self.simulation_speed = 10  # Velocidad predeterminada (generaciones por segundo)
+        
+        # Métricas por generación y atascos por carril (las conectan
+        # metricas.TrafficMetrics.attach y atascos.JamTracker.attach). Con
+        # alguno conectado, update() deja en self.changes un
+        # cambios.LaneChanges por carril para que se actualicen
+        self.metrics = None
+        self.jams = None
+        self.changes = None
+        
+        # Tiempo de cada fase de update() y draw(), apagado hasta que se
+        # active (tecla P o tiempos.PhaseTimings.attach)
+        self.timings = PhaseTimings(enabled=False)
+    
+    def _initialize_spaced(self, init_rng):
+        """Patrón inicial predeterminado: autos espaciados con algo de ruido."""
         self.upper_lane = np.zeros(NUM_CELLS, dtype=int)
         self.lower_lane = np.zeros(NUM_CELLS, dtype=int)
         
         # Distribuir autos de manera más uniforme para evitar atascos
         # Esto crea un patrón más fluido desde el principio
-        density = 0.3  # 30% de ocupación
         
         # Usamos un espaciado aproximadamente uniforme
-        spacing = int(1/density)
-        offset = random.randint(0, spacing-1)
+        spacing = int(1/SPACED_DENSITY)
+        offset = int(init_rng.integers(0, spacing))
         
         for i in range(NUM_CELLS):
             # Carril superior
@@ -70,57 +143,17 @@ class TrafficSimulator:
             if (i + lower_offset) % spacing == 0:
                 self.lower_lane[i] = 1
         
-        # Añadir algo de aleatoriedad para romper patrones rígidos
-        for i in range(NUM_CELLS):
-            if random.random() < 0.1:  # 10% de probabilidad de cambiar
-                self.upper_lane[i] = 1 - self.upper_lane[i]  # Invierte el estado
-            if random.random() < 0.1:
-                self.lower_lane[i] = 1 - self.lower_lane[i]
-        
-        self.broken_cars_upper = {}  # Posición -> generaciones restantes
-        self.broken_cars_lower = {}  # Posición -> generaciones restantes
-        
-        self.generation = 0
-        self.boundary_mode = boundary_mode  # "toroid" o "null"
-        
-        # Intentar cargar una fuente que soporte Unicode
-        try:
-            self.font = pygame.font.SysFont("Arial", 18)  # Arial suele soportar más símbolos
-        except:
-            self.font = pygame.font.SysFont(None, 24)  # Fuente por defecto si no se encuentra Arial
-            
-        # Añadir atributo para la velocidad de simulación
-        self.simulation_speed = 10  # Velocidad predeterminada
+        # Añadir algo de aleatoriedad para romper patrones rígidos:
+        # cada celda se invierte con 10% de probabilidad
+        self.upper_lane ^= init_rng.random(NUM_CELLS) < 0.1
+        self.lower_lane ^= init_rng.random(NUM_CELLS) < 0.1
     
     def apply_rule_184(self, lane):
         """Aplicar Regla 184 al carril y retornar el nuevo estado."""
-        new_lane = np.zeros_like(lane)
-        
-        for i in range(len(lane)):
-            if self.boundary_mode == "toroid":
-                left = lane[(i - 1) % len(lane)]
-                center = lane[i]
-                right = lane[(i + 1) % len(lane)]
-            else:  # frontera nula
-                left = lane[i - 1] if i > 0 else 0
-                center = lane[i]
-                right = lane[i + 1] if i < len(lane) - 1 else 0
-            
-            # Tabla de búsqueda para Regla 184
-            # 111 -> 0
-            # 110 -> 1
-            # 101 -> 0
-            # 100 -> 1
-            # 011 -> 1
-            # 010 -> 0
-            # 001 -> 1
-            # 000 -> 0
-            pattern = (left << 2) | (center << 1) | right
-            rule_output = {
-                0: 0, 1: 1, 2: 0, 3: 1,
-                4: 1, 5: 0, 6: 1, 7: 0
-            }
-            new_lane[i] = rule_output[pattern]
+        if self.engine == "packed":
+            new_lane = lane.step(RULE_OUTPUT, self.boundary_mode)
+        else:
+            new_lane = apply_rule(lane, RULE_OUTPUT, self.boundary_mode)
         
         # En modo toroide, garantizamos que los coches que salen por la derecha 
         # aparecen por la izquierda manteniendo el número total de coches
@@ -133,127 +166,52 @@ class TrafficSimulator:
         return new_lane
     
     def handle_broken_cars(self):
-        # Procesar autos descompuestos en el carril superior
-        broken_cars_to_remove_upper = []
-        for pos, remaining in list(self.broken_cars_upper.items()):
-            if remaining <= 1:
-                # Intento de reparación del auto
-                if random.random() < REPAIR_PROB:
-                    # Auto reparado, permanece en el carril
-                    pass
-                else:
-                    # Auto es remolcado
-                    self.upper_lane[pos] = 0
-                broken_cars_to_remove_upper.append(pos)
-            else:
-                self.broken_cars_upper[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_upper:
-            del self.broken_cars_upper[pos]
-        
-        # Procesar autos descompuestos en el carril inferior
-        broken_cars_to_remove_lower = []
-        for pos, remaining in list(self.broken_cars_lower.items()):
-            if remaining <= 1:
-                # Intento de reparación del auto
-                if random.random() < REPAIR_PROB:
-                    # Auto reparado, permanece en el carril
-                    pass
-                else:
-                    # Auto es remolcado
-                    self.lower_lane[pos] = 0
-                broken_cars_to_remove_lower.append(pos)
-            else:
-                self.broken_cars_lower[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_lower:
-            del self.broken_cars_lower[pos]
+        # Descontar una generación a los autos descompuestos de ambos carriles;
+        # los que agotan su cuenta se reparan o son remolcados. Devuelve, por
+        # carril, las averías que terminaron y los autos remolcados
+        upper = tick_breakdowns(self.upper_lane, self.broken_cars_upper, self.streams["upper_lane"], REPAIR_PROB)
+        lower = tick_breakdowns(self.lower_lane, self.broken_cars_lower, self.streams["lower_lane"], REPAIR_PROB)
+        return upper, lower
     
     def update(self):
         self.generation += 1
+        timings = self.timings
+        timings.start()
         
         # Procesar primero los autos descompuestos
-        self.handle_broken_cars()
+        upper_lane, lower_lane = self.upper_lane, self.lower_lane
+        (ended_upper, towed_upper), (ended_lower, towed_lower) = self.handle_broken_cars()
+        timings.lap("handle_broken_cars")
         
         # Calcular nuevos carriles sin considerar cambios de carril primero
         new_upper_lane = self.apply_rule_184(self.upper_lane)
         new_lower_lane = self.apply_rule_184(self.lower_lane)
-        
-        # Ahora verificar cambios de carril y averías de autos
-        # Necesitamos almacenarlos para aplicarlos todos a la vez después de aplicar la regla
-        upper_to_lower = []  # Posiciones en carril superior que mueven al inferior
-        lower_to_upper = []  # Posiciones en carril inferior que mueven al superior
-        new_breakdowns_upper = []  # Nuevas averías en carril superior
-        new_breakdowns_lower = []  # Nuevas averías en carril inferior
-        
-        # Revisar carril superior para cambios de carril y averías
-        for i in range(NUM_CELLS):
-            if new_upper_lane[i] == 1 and i not in self.broken_cars_upper:
-                # Verificar si el coche está bloqueado por uno descompuesto adelante
-                is_blocked = False
-                if i < NUM_CELLS - 1 and i + 1 in self.broken_cars_upper:
-                    is_blocked = True
-                
-                if is_blocked:
-                    # Coche bloqueado por uno descompuesto
-                    decision = random.random()
-                    if decision < 0.2:
-                        # Decide esperar (20% probabilidad)
-                        pass
-                    elif decision < 0.7 and new_lower_lane[i] == 0:  # 50% de probabilidad de cambiar carril
-                        # Intenta cambiar de carril
-                        upper_to_lower.append(i)
-                else:
-                    # Comportamiento normal si no está bloqueado
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_lower_lane[i] == 0:
-                        upper_to_lower.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_upper.append(i)
-        
-        # Revisar carril inferior para cambios de carril y averías
-        for i in range(NUM_CELLS):
-            if new_lower_lane[i] == 1 and i not in self.broken_cars_lower:
-                # Verificar si el coche está bloqueado por uno descompuesto adelante
-                is_blocked = False
-                if i < NUM_CELLS - 1 and i + 1 in self.broken_cars_lower:
-                    is_blocked = True
-                
-                if is_blocked:
-                    # Coche bloqueado por uno descompuesto
-                    decision = random.random()
-                    if decision < 0.2:
-                        # Decide esperar (20% probabilidad)
-                        pass
-                    elif decision < 0.7 and new_upper_lane[i] == 0:  # 50% de probabilidad de cambiar carril
-                        # Intenta cambiar de carril
-                        lower_to_upper.append(i)
-                else:
-                    # Comportamiento normal si no está bloqueado
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_upper_lane[i] == 0:
-                        lower_to_upper.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_lower.append(i)
+        timings.lap("rule")
+        
+        # Ahora decidir cambios de carril y averías de todos los autos a la vez,
+        # con el estado de ambos carriles antes de aplicar cualquier cambio.
+        # Las decisiones son índices de celdas, así que el motor empaquetado
+        # nunca desempaqueta el carril completo
+        upper_to_lower, new_breakdowns_upper = lane_change_cells(
+            new_upper_lane, new_lower_lane, self.broken_cars_upper, self.streams["upper_lane"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB)
+        lower_to_upper, new_breakdowns_lower = lane_change_cells(
+            new_lower_lane, new_upper_lane, self.broken_cars_lower, self.streams["lower_lane"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB)
         
         # Aplicar cambios de carril
-        for i in upper_to_lower:
-            new_upper_lane[i] = 0
-            new_lower_lane[i] = 1
-        
-        for i in lower_to_upper:
-            new_lower_lane[i] = 0
-            new_upper_lane[i] = 1
+        apply_lane_changes(new_upper_lane, new_lower_lane, upper_to_lower, lower_to_upper)
         
         # Aplicar nuevas averías
-        for i in new_breakdowns_upper:
-            self.broken_cars_upper[i] = REPAIR_ATTEMPTS
-        
-        for i in new_breakdowns_lower:
-            self.broken_cars_lower[i] = REPAIR_ATTEMPTS
+        self.broken_cars_upper[new_breakdowns_upper] = REPAIR_ATTEMPTS
+        self.broken_cars_lower[new_breakdowns_lower] = REPAIR_ATTEMPTS
+        timings.lap("decisions")
         
         # Manejar inserciones en frontera nula si es necesario
+        entry = (new_upper_lane[0], new_lower_lane[0])
         if self.boundary_mode == "null":
             # Insertamos autos al inicio con probabilidad ajustada para mantener flujo
-            if random.random() < CAR_INSERTION_PROB:
+            if self.streams["insertion"].random() < CAR_INSERTION_PROB:
                 # Elegir el carril con menos autos para equilibrar
                 upper_count = np.sum(new_upper_lane)
                 lower_count = np.sum(new_lower_lane)
@@ -275,19 +233,44 @@ class TrafficSimulator:
                     # Si solo el carril inferior tiene espacio
                     elif new_lower_lane[0] == 0:
                         new_lower_lane[0] = 1
+        inserted = [[0] if new_lane[0] and not before else []
+                    for new_lane, before in zip((new_upper_lane, new_lower_lane), entry)]
+        timings.lap("insertion")
     
         # Asegurarnos que los autos descompuestos permanezcan en su lugar
-        for pos in self.broken_cars_upper:
-            new_upper_lane[pos] = 1
-        
-        for pos in self.broken_cars_lower:
-            new_lower_lane[pos] = 1
+        pin_broken_cars(new_upper_lane, self.broken_cars_upper)
+        pin_broken_cars(new_lower_lane, self.broken_cars_lower)
+        timings.lap("pin")
         
         self.upper_lane = new_upper_lane
         self.lower_lane = new_lower_lane
+        
+        if self.metrics is not None or self.jams is not None:
+            # Lo que cambió en cada carril; upper_lane y lower_lane son los
+            # carriles anteriores, ya sin los autos remolcados
+            self.changes = {
+                "upper_lane": LaneChanges.between(upper_lane, new_upper_lane, towed_upper, ended_upper,
+                                                  new_breakdowns_upper, upper_to_lower,
+                                                  np.concatenate([lower_to_upper, inserted[0]])),
+                "lower_lane": LaneChanges.between(lower_lane, new_lower_lane, towed_lower, ended_lower,
+                                                  new_breakdowns_lower, lower_to_upper,
+                                                  np.concatenate([upper_to_lower, inserted[1]])),
+            }
+        if self.metrics is not None:
+            self.metrics.observe(self)
+        if self.jams is not None:
+            self.jams.observe(self)
+        timings.lap("observers")
     
-    def draw(self):
-        screen.blit(road_img, (0, 0))
+    def draw(self, rate_text=None):
+        """Dibujar la escena y devolver los rectángulos de pantalla que cambiaron.
+
+        rate_text, si se da, se muestra bajo los contadores (generaciones
+        por segundo reales y tiempo de cuadro).
+        """
+        timings = self.timings
+        timings.start()
+        items = []
         
         # Obtener tiempo para efectos visuales
         current_time = pygame.time.get_ticks()
@@ -300,27 +283,17 @@ class TrafficSimulator:
                 x_pos = i * CELL_SIZE
                 y_pos = UPPER_LANE_Y + offset_y
                 
-                # Dibujar sombra debajo del auto para efecto de profundidad
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                # Sombra debajo del auto para efecto de profundidad
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_upper:
+                if self.broken_cars_upper[i] > 0:
                     # Para autos descompuestos, añadir efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                        
-                    screen.blit(broken_car_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE),
+                                                 (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_img, (x_pos, y_pos))
+                    layers.append((car_img, (x_pos, y_pos)))
+                items.append((("upper", i), layers))
         
         # Dibujar autos en el carril inferior con leve efecto de movimiento
         for i in range(NUM_CELLS):
@@ -330,74 +303,59 @@ class TrafficSimulator:
                 x_pos = i * CELL_SIZE
                 y_pos = LOWER_LANE_Y + offset_y
                 
-                # Dibujar sombra debajo del auto para efecto de profundidad
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                # Sombra debajo del auto para efecto de profundidad
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_lower:
+                if self.broken_cars_lower[i] > 0:
                     # Para autos descompuestos, añadir efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                        
-                    screen.blit(broken_car_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE),
+                                                 (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_img, (x_pos, y_pos))
+                    layers.append((car_img, (x_pos, y_pos)))
+                items.append((("lower", i), layers))
+        timings.lap("draw_cars")
         
         # Dibujar contador de generaciones con efecto de resaltado
-        gen_text = self.font.render(f"Generación: {self.generation}", True, BLACK)
-        text_bg = pygame.Surface((gen_text.get_width() + 10, gen_text.get_height() + 6))
-        text_bg.fill((220, 220, 220))
-        text_bg.set_alpha(180)
-        screen.blit(text_bg, (5, 2))
-        screen.blit(gen_text, (10, 5))
+        items.append(("generation", hud.label("generation", f"Generación: {self.generation}", (5, 2))))
+        
+        # Velocidad real de la simulación
+        if rate_text is not None:
+            items.append(("rate", hud.label("rate", rate_text, (5, 34))))
         
         # Dibujar modo de frontera
-        mode_text = self.font.render(f"Modo: {self.boundary_mode.capitalize()}", True, BLACK)
-        mode_bg = pygame.Surface((mode_text.get_width() + 10, mode_text.get_height() + 6))
-        mode_bg.fill((220, 220, 220))
-        mode_bg.set_alpha(180)
-        screen.blit(mode_bg, (WIDTH - mode_text.get_width() - 15, 2))
-        screen.blit(mode_text, (WIDTH - mode_text.get_width() - 10, 5))
-
+        items.append(("mode", hud.label("mode", f"Modo: {self.boundary_mode.capitalize()}", (WIDTH - 5, 2), "right")))
+        
         # Instrucciones - mostradas horizontalmente con fondo semi-transparente
         instructions = [
             "Espacio: Pausar/Reanudar",
             "T: Toroide",
             "N: Frontera nula",
             "R: Reiniciar",
+            "P: Tiempos",
             f"↑/↓: Vel({self.simulation_speed})"
         ]
+        items.append(("instructions", hud.bar("instructions", instructions, (200, 2))))
+        
+        # Tiempos por fase (tecla P)
+        items += visor.timing_items(hud, timings, (5, 66), per_line=5)
+        timings.lap("draw_hud")
         
-        # Crear un fondo semi-transparente para todas las instrucciones
-        total_width = 0
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)  # Usar self.font en lugar de simulator.font
-            total_width += text.get_width() + 20
-        
-        instruction_bg = pygame.Surface((total_width, 30))
-        instruction_bg.fill((240, 240, 240))
-        instruction_bg.set_alpha(180)
-        screen.blit(instruction_bg, (200, 2))
-        
-        # Mostrar instrucciones en línea horizontal
-        x_offset = 210  # Posición inicial después del contador de generaciones
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)  # Usar self.font en lugar de simulator.font
-            screen.blit(text, (x_offset, 8))
-            x_offset += text.get_width() + 20  # Espacio entre instrucciones
+        # Fondo y autos en las zonas que cambiaron
+        dirty = renderer.render(items)
+        timings.lap("draw_render")
+        return dirty
 
 def main():
+    # python carril.py --replay <grabación> reproduce una corrida grabada
+    if len(sys.argv) == 3 and sys.argv[1] == "--replay":
+        repeticion.replay(sys.argv[2], sys.modules[__name__], "TrafficSimulator")
+        return
+    init_viewer()
     simulator = TrafficSimulator(boundary_mode="toroid")  # Modo predeterminado
     clock = pygame.time.Clock()
+    pacer = visor.GenerationPacer()
+    timings = PhaseTimings(enabled=False)
     running = True
     paused = False
     
@@ -405,6 +363,8 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     paused = not paused
@@ -413,21 +373,28 @@ def main():
                 elif event.key == pygame.K_n:
                     simulator = TrafficSimulator(boundary_mode="null")
                 elif event.key == pygame.K_r:
-                    simulator = TrafficSimulator(simulator.boundary_mode)
+                    simulator = TrafficSimulator(simulator.boundary_mode, simulator.engine)
+                elif event.key == pygame.K_p:
+                    # Mostrar u ocultar los tiempos por fase (y medirlos)
+                    timings.enabled = not timings.enabled
+                    timings.reset()
                 elif event.key == pygame.K_UP:
                     # Aumentar la velocidad de simulación
-                    simulator.simulation_speed = min(simulator.simulation_speed + 2, 30)
+                    simulator.simulation_speed = visor.speed_up(simulator.simulation_speed)
                 elif event.key == pygame.K_DOWN:
                     # Disminuir la velocidad de simulación
-                    simulator.simulation_speed = max(simulator.simulation_speed - 2, 1)
+                    simulator.simulation_speed = visor.slow_down(simulator.simulation_speed)
         
-        if not paused:
-            simulator.update()
+        # Las mediciones pasan al simulador nuevo al reiniciar
+        simulator.timings = timings
         
-        simulator.draw()
+        # Ejecutar las generaciones que tocan en este cuadro según la
+        # velocidad (generaciones por segundo), sin atarla a los cuadros
+        pacer.run(simulator.update, simulator.simulation_speed, paused)
         
-        pygame.display.flip()
-        clock.tick(simulator.simulation_speed)  # Usar simulator.simulation_speed
+        # Enviar a la pantalla solo las zonas que cambiaron
+        pygame.display.update(simulator.draw(pacer.hud_text()))
+        clock.tick(visor.FRAME_RATE)
     
     pygame.quit()
 
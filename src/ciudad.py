@@ -0,0 +1,483 @@
+import pygame
+import numpy as np
+
+import visor
+from fases import insert_cars, spawn_streams, tick_breakdowns
+from regla184 import RULE_184, neighbours
+from tiempos import PhaseTimings
+
+# Ciudad en cuadrícula
+GRID_ROWS = 20         # Carreteras horizontales
+GRID_COLUMNS = 20      # Carreteras verticales
+BLOCK_CELLS = 10       # Celdas de un cruce al siguiente
+INITIAL_DENSITY = 0.3  # Fracción de celdas con auto al empezar
+DENSITY_STEP = 0.05    # Cambio de densidad con las teclas +/-
+
+# Visor
+CELL_PIXELS = 3   # Pixeles por celda del mapa
+HUD_HEIGHT = 90   # Franja superior para el HUD
+
+# Probabilidades (las mismas del simulador de cruce)
+CAR_BREAKDOWN_PROB = 0.02
+CAR_INSERTION_PROB = 0.05
+CAR_TURN_PROB = 0.2
+REPAIR_ATTEMPTS = 20
+REPAIR_PROB = 0.5
+# En frontera nula solo entran autos a carreteras con menos densidad que esta
+MAX_INSERT_DENSITY = 0.3
+
+# Generaciones seguidas sin que avance ni gire ningún auto para considerar
+# la ciudad bloqueada (más que lo que dura cualquier avería)
+GRIDLOCK_GENERATIONS = 2 * REPAIR_ATTEMPTS
+
+# Colores del mapa
+BACKGROUND = (230, 230, 230)
+BLOCK_COLOR = (70, 110, 70)
+ROAD_COLOR = (90, 90, 90)
+HORIZONTAL_CAR = (230, 70, 60)
+VERTICAL_CAR = (70, 140, 240)
+BROKEN_CAR = (255, 220, 0)
+
+# Variables del visor, se crean en init_viewer()
+screen = None
+font = None
+hud = None
+renderer = None
+
+def init_viewer(surface=None):
+    """Crear la ventana (o usar la superficie dada) para una ciudad del tamaño predeterminado."""
+    global screen, font, hud, renderer
+    width = GRID_COLUMNS * BLOCK_CELLS * CELL_PIXELS
+    height = GRID_ROWS * BLOCK_CELLS * CELL_PIXELS + HUD_HEIGHT
+    screen = visor.open_screen(width, height, "Simulador de Tráfico en Ciudad - Regla 184", surface)
+    font = visor.create_font(13)
+    hud = visor.Hud(font)
+    background = pygame.Surface(screen.get_size())
+    background.fill(BACKGROUND)
+    renderer = visor.DirtyRenderer(screen, background)
+
+
+def _by_road(cells):
+    """Juntar los dos carriles de cada carretera: ¿hay auto en alguno?"""
+    return cells.reshape(-1, 2, cells.shape[-1]).any(axis=1)
+
+
+def _select(index, mask):
+    """Índices (renglones, celdas) de los elementos marcados en mask."""
+    return tuple(axis[mask] for axis in index)
+
+
+class TrafficCitySimulator:
+    """Ciudad de rows x columns cruces: el cruce de cruce.py repetido en una cuadrícula.
+
+    Hay rows carreteras horizontales y columns verticales, todas de dos
+    carriles, y la carretera r se cruza con la c en el cruce (r, c). Como en
+    cruce.py, las carreteras alternan sentido: las horizontales pares van
+    de derecha a izquierda (como la carretera 1) y las impares de izquierda
+    a derecha (como la 2); las verticales pares de arriba a abajo (como la
+    3) y las impares de abajo a arriba (como la 4). Los carriles viven
+    apilados en dos arreglos, self.horizontal (2 * rows, celdas) y
+    self.vertical (2 * columns, celdas), con los dos carriles de cada
+    carretera en renglones seguidos, y cada generación aplica la Regla 184
+    y los giros a todos los cruces a la vez.
+
+    Cada cruce junta una carretera de cada orientación, así que de los
+    cuatro giros de TrafficCrossSimulator.update aplica el único que
+    corresponde a sus sentidos (lower_1 -> right_4, lower_2 -> left_3,
+    left_3 -> upper_1 o right_4 -> upper_2), con CAR_TURN_PROB y solo si la
+    celda destino está libre. Con exclusive_junctions, además, el cruce es
+    de una sola orientación a la vez desde el llenado inicial, como en el
+    modelo de Biham-Middleton-Levine: no entra ningún auto mientras haya uno
+    de la otra orientación en el cruce, y si llegan autos de ambas, pasa la
+    horizontal en generaciones impares y la vertical en las pares. Los autos
+    descompuestos no se mueven y bloquean a los de atrás, como en red.py.
+    """
+
+    def __init__(self, rows=GRID_ROWS, columns=GRID_COLUMNS, block_cells=BLOCK_CELLS,
+                 density=INITIAL_DENSITY, boundary_mode="toroid", seed=None, exclusive_junctions=True,
+                 breakdown_prob=None):
+        if block_cells < 3:
+            raise ValueError("cada cuadra necesita al menos 3 celdas")
+        self.rows = rows
+        self.columns = columns
+        self.block_cells = block_cells
+        self.density = density
+        self.boundary_mode = boundary_mode  # "toroid" o "null"
+        self.exclusive_junctions = exclusive_junctions
+        # Probabilidad de avería (None = CAR_BREAKDOWN_PROB); con averías la
+        # grúa retira autos y en toroide la densidad baja con el tiempo
+        self.breakdown_prob = breakdown_prob
+
+        # Un generador por orientación (averías y reparaciones) y por
+        # subsistema, derivados de la semilla
+        self.seed, self.streams = spawn_streams(seed, ("initial", "horizontal", "vertical", "turns", "insertion"))
+
+        # Sentido de cada carril (dos renglones seguidos por carretera); en
+        # los verticales los índices crecen hacia abajo
+        self.horizontal_directions = np.repeat(
+            np.where(np.arange(rows) % 2 == 0, "right_to_left", "left_to_right"), 2)
+        self.vertical_directions = np.repeat(
+            np.where(np.arange(columns) % 2 == 0, "left_to_right", "right_to_left"), 2)
+
+        # El cruce (r, c) está a mitad de cuadra: en la celda junction_x[c] de
+        # los carriles horizontales y en la junction_y[r] de los verticales
+        self.junction_x = np.arange(columns) * block_cells + block_cells // 2
+        self.junction_y = np.arange(rows) * block_cells + block_cells // 2
+
+        # Autos al azar con la densidad inicial (0 = vacío, 1 = auto)
+        initial = self.streams["initial"]
+        self.horizontal = (initial.random((2 * rows, columns * block_cells)) < density).astype(np.int8)
+        self.vertical = (initial.random((2 * columns, rows * block_cells)) < density).astype(np.int8)
+        if exclusive_junctions:
+            # El cruce es de una sola orientación desde la generación 0: si el
+            # llenado dejó autos de ambas en un cruce, se quitan los verticales
+            crowded = (_by_road(self.horizontal[:, self.junction_x])
+                       & _by_road(self.vertical[:, self.junction_y]).T)
+            crowded_r, crowded_c = np.nonzero(crowded)
+            for lane in range(2):
+                self.vertical[2 * crowded_c + lane, self.junction_y[crowded_r]] = 0
+        # Autos descompuestos: generaciones restantes de cada celda (0 = auto sano)
+        self.broken_horizontal = np.zeros(self.horizontal.shape, dtype=np.int16)
+        self.broken_vertical = np.zeros(self.vertical.shape, dtype=np.int16)
+
+        self._build_junctions()
+
+        self.generation = 0
+        self.turn_count = 0  # Contador de giros realizados
+        self.moved = 0       # Autos que avanzaron en la última generación
+        self.stalled = 0     # Generaciones seguidas sin movimiento
+
+        self.simulation_speed = 10  # Velocidad predeterminada (generaciones por segundo)
+
+        # Tiempo de cada fase de update() y draw(), apagado hasta que se
+        # active (tecla P o tiempos.PhaseTimings.attach)
+        self.timings = PhaseTimings(enabled=False)
+
+    def _build_junctions(self):
+        """Precalcular las celdas de espera y los giros de todos los cruces."""
+        # Celda anterior al cruce en cada carril, por donde llegan los autos
+        step = np.where(self.horizontal_directions == "left_to_right", 1, -1)[:, None]
+        self._horizontal_waiting = (np.arange(2 * self.rows)[:, None],
+                                    (self.junction_x - step) % self.horizontal.shape[1])
+        step = np.where(self.vertical_directions == "left_to_right", 1, -1)[:, None]
+        self._vertical_waiting = (np.arange(2 * self.columns)[:, None],
+                                  (self.junction_y - step) % self.vertical.shape[1])
+
+        # Carreteras de cada cruce, numerados por renglones (r * columns + c)
+        road_r, road_c = np.divmod(np.arange(self.rows * self.columns), self.columns)
+        backward = road_r % 2 == 0  # Horizontal de derecha a izquierda (carretera 1)
+        downward = road_c % 2 == 0  # Vertical de arriba a abajo (carretera 3)
+        x = self.junction_x[road_c]
+        y = self.junction_y[road_r]
+
+        # lower_1 -> right_4 y lower_2 -> left_3: del carril inferior de la
+        # horizontal al carril de la vertical que corresponde
+        to_vertical = backward != downward
+        j = np.flatnonzero(to_vertical)
+        self._to_vertical = (j, (2 * road_r[j] + 1, x[j]), (2 * road_c[j] + backward[j], y[j]))
+        # left_3 -> upper_1 y right_4 -> upper_2: al carril superior de la horizontal
+        j = np.flatnonzero(~to_vertical)
+        self._to_horizontal = (j, (2 * road_c[j] + ~downward[j], y[j]), (2 * road_r[j], x[j]))
+
+    @property
+    def num_cars(self):
+        return int(np.count_nonzero(self.horizontal) + np.count_nonzero(self.vertical))
+
+    @property
+    def current_density(self):
+        """Fracción de celdas con auto ahora (density es la inicial)."""
+        return self.num_cars / (self.horizontal.size + self.vertical.size)
+
+    @property
+    def mean_speed(self):
+        """Fracción de los autos que avanzaron en la última generación (NaN sin autos)."""
+        num_cars = self.num_cars
+        return self.moved / num_cars if num_cars else float("nan")
+
+    @property
+    def gridlocked(self):
+        return self.stalled >= GRIDLOCK_GENERATIONS
+
+    def closed_junctions(self):
+        """Celdas de cruce por las que no puede entrar ningún auto en esta generación.
+
+        Devuelve una máscara para los carriles horizontales y otra para los
+        verticales. Sin exclusive_junctions ningún cruce se cierra.
+        """
+        closed_horizontal = np.zeros(self.horizontal.shape, dtype=bool)
+        closed_vertical = np.zeros(self.vertical.shape, dtype=bool)
+        if not self.exclusive_junctions:
+            return closed_horizontal, closed_vertical
+
+        # Por cruce (r, c): autos dentro y autos sanos esperando para entrar
+        horizontal_inside = _by_road(self.horizontal[:, self.junction_x])
+        vertical_inside = _by_road(self.vertical[:, self.junction_y]).T
+        horizontal_waiting = _by_road((self.horizontal[self._horizontal_waiting] == 1)
+                                      & (self.broken_horizontal[self._horizontal_waiting] == 0))
+        vertical_waiting = _by_road((self.vertical[self._vertical_waiting] == 1)
+                                    & (self.broken_vertical[self._vertical_waiting] == 0)).T
+
+        # Se cierra a una orientación si la otra está dentro o si la otra
+        # también espera y le toca el paso
+        horizontal_first = self.generation % 2 == 1
+        closed_for_horizontal = vertical_inside | (vertical_waiting & ~horizontal_first)
+        closed_for_vertical = horizontal_inside | (horizontal_waiting & horizontal_first)
+        closed_horizontal[:, self.junction_x] = np.repeat(closed_for_horizontal, 2, axis=0)
+        closed_vertical[:, self.junction_y] = np.repeat(closed_for_vertical.T, 2, axis=0)
+        return closed_horizontal, closed_vertical
+
+    def apply_rule_184(self, lanes, broken, closed, directions):
+        """Aplicar la Regla 184 a todos los carriles de una orientación.
+
+        Los autos descompuestos no se mueven y a una celda cerrada no entra
+        nadie: para la regla, su celda de adelante cuenta como ocupada y,
+        para la celda que tienen adelante, su celda de atrás cuenta como vacía.
+        """
+        stuck = broken > 0
+        behind, ahead = neighbours(lanes, self.boundary_mode, directions)
+        stuck_behind, _ = neighbours(stuck, self.boundary_mode, directions)
+        _, closed_ahead = neighbours(closed, self.boundary_mode, directions)
+
+        behind_cells = behind & ~stuck_behind & ~closed
+        ahead_cells = ahead | stuck | closed_ahead
+        pattern = (behind_cells << 2) | (lanes << 1) | ahead_cells
+        return RULE_184.astype(lanes.dtype)[pattern]
+
+    def apply_turns(self):
+        """Giros en todos los cruces a la vez; devuelve cuántos autos giraron.
+
+        Un número aleatorio por cruce. Como en cruce.py, primero se deciden
+        todos los giros sobre el estado tras la regla y después se aplican.
+        """
+        rolls = self.streams["turns"].random(self.rows * self.columns) < CAR_TURN_PROB
+        horizontal, vertical = self.horizontal, self.vertical
+
+        junctions, source, target = self._to_vertical
+        to_vertical = (rolls[junctions] & (horizontal[source] == 1)
+                       & (self.broken_horizontal[source] == 0) & (vertical[target] == 0))
+        if self.exclusive_junctions:
+            # Solo si el cruce queda de una sola orientación: el otro carril
+            # de la carretera de origen está libre en el cruce
+            to_vertical &= horizontal[source[0] ^ 1, source[1]] == 0
+        vertical_moves = (_select(source, to_vertical), _select(target, to_vertical))
+
+        junctions, source, target = self._to_horizontal
+        to_horizontal = (rolls[junctions] & (vertical[source] == 1)
+                         & (self.broken_vertical[source] == 0) & (horizontal[target] == 0))
+        if self.exclusive_junctions:
+            to_horizontal &= vertical[source[0] ^ 1, source[1]] == 0
+        horizontal_moves = (_select(source, to_horizontal), _select(target, to_horizontal))
+
+        horizontal[vertical_moves[0]] = 0
+        vertical[vertical_moves[1]] = 1
+        vertical[horizontal_moves[0]] = 0
+        horizontal[horizontal_moves[1]] = 1
+        return int(np.count_nonzero(to_vertical) + np.count_nonzero(to_horizontal))
+
+    def _insert_cars(self):
+        """Frontera nula: entrar autos por el extremo de cada carretera."""
+        rng = self.streams["insertion"]
+        for lanes, directions in ((self.horizontal, self.horizontal_directions),
+                                  (self.vertical, self.vertical_directions)):
+            roads = lanes.reshape(-1, 2, lanes.shape[-1])
+            # Las carreteras pares y las impares entran por extremos opuestos
+            for parity in (0, 1):
+                group = roads[parity::2]
+                if len(group) == 0:
+                    continue
+                entry = 0 if directions[2 * parity] == "left_to_right" else -1
+                insert_cars(group[:, 0], group[:, 1], rng, CAR_INSERTION_PROB, entry, MAX_INSERT_DENSITY)
+
+    def update(self):
+        self.generation += 1
+        timings = self.timings
+        timings.start()
+
+        # Procesar primero los autos descompuestos
+        tick_breakdowns(self.horizontal, self.broken_horizontal, self.streams["horizontal"], REPAIR_PROB)
+        tick_breakdowns(self.vertical, self.broken_vertical, self.streams["vertical"], REPAIR_PROB)
+        timings.lap("handle_broken_cars")
+
+        # Cruces cerrados según el estado anterior
+        closed_horizontal, closed_vertical = self.closed_junctions()
+        timings.lap("junctions")
+
+        # Aplicar la Regla 184 a todos los carriles de cada orientación
+        new_horizontal = self.apply_rule_184(self.horizontal, self.broken_horizontal,
+                                             closed_horizontal, self.horizontal_directions)
+        new_vertical = self.apply_rule_184(self.vertical, self.broken_vertical,
+                                           closed_vertical, self.vertical_directions)
+        # Cada auto que avanza deja vacía su celda (o sale de la ciudad)
+        self.moved = int(np.count_nonzero(self.horizontal > new_horizontal)
+                         + np.count_nonzero(self.vertical > new_vertical))
+        self.horizontal = new_horizontal
+        self.vertical = new_vertical
+        timings.lap("rule")
+
+        turned = self.apply_turns()
+        self.turn_count += turned
+        timings.lap("turns")
+
+        # Nuevas averías
+        breakdown_prob = CAR_BREAKDOWN_PROB if self.breakdown_prob is None else self.breakdown_prob
+        for lanes, broken, name in ((self.horizontal, self.broken_horizontal, "horizontal"),
+                                    (self.vertical, self.broken_vertical, "vertical")):
+            new_breakdowns = (lanes == 1) & (broken == 0) & (self.streams[name].random(lanes.shape) < breakdown_prob)
+            broken[new_breakdowns] = REPAIR_ATTEMPTS
+        timings.lap("decisions")
+
+        if self.boundary_mode == "null":
+            self._insert_cars()
+        timings.lap("insertion")
+
+        if self.moved + turned == 0 and self.num_cars:
+            self.stalled += 1
+        else:
+            self.stalled = 0
+
+    def map_image(self):
+        """Mapa de la ciudad como arreglo RGB (alto, ancho, 3), un pixel por celda.
+
+        Los dos carriles de cada carretera ocupan dos renglones (o columnas)
+        seguidos a partir de la celda del cruce.
+        """
+        height, width = self.vertical.shape[1], self.horizontal.shape[1]
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[:] = BLOCK_COLOR
+
+        # Color de cada celda: carretera, auto o auto descompuesto
+        horizontal_palette = np.array([ROAD_COLOR, HORIZONTAL_CAR, BROKEN_CAR], dtype=np.uint8)
+        vertical_palette = np.array([ROAD_COLOR, VERTICAL_CAR, BROKEN_CAR], dtype=np.uint8)
+        horizontal_rows = (self.junction_y[:, None] + np.arange(2)).ravel()
+        vertical_columns = (self.junction_x[:, None] + np.arange(2)).ravel()
+        image[horizontal_rows] = horizontal_palette[self.horizontal + (self.broken_horizontal > 0)]
+        image[:, vertical_columns] = vertical_palette[self.vertical + (self.broken_vertical > 0)].transpose(1, 0, 2)
+        return image
+
+    def draw(self, rate_text=None):
+        """Dibujar el mapa y el HUD; devuelve los rectángulos que cambiaron."""
+        timings = self.timings
+        timings.start()
+        width = screen.get_width()
+        items = []
+
+        # El mapa cambia en cada generación: se arma completo y se escala
+        image = self.map_image()
+        surface = pygame.surfarray.make_surface(image.transpose(1, 0, 2))
+        surface = pygame.transform.scale(surface, (image.shape[1] * CELL_PIXELS, image.shape[0] * CELL_PIXELS))
+        items.append(("map", [(surface, (0, HUD_HEIGHT))]))
+        timings.lap("draw_map")
+
+        items.append(("generation", hud.label("generation", f"Generación: {self.generation}", (5, 2))))
+        items.append(("mode", hud.label("mode", f"Modo: {self.boundary_mode.capitalize()}", (width - 5, 2), "right")))
+        if rate_text is not None:
+            items.append(("rate", hud.label("rate", rate_text, (5, 58))))
+
+        # Estado de la ciudad
+        status = "BLOQUEADA" if self.gridlocked else f"Velocidad: {self.mean_speed:.2f}"
+        stats_text = f"Coches: {self.num_cars} | Densidad: {self.current_density:.2f} | Giros: {self.turn_count} | {status}"
+        items.append(("stats", hud.label("stats", stats_text, (width - 5, 58), "right")))
+
+        instructions = [
+            "Espacio: Pausar",
+            "T: Toroide",
+            "N: Nula",
+            "R: Reiniciar",
+            "+/-: Densidad",
+            "P: Tiempos",
+            f"Arriba/Abajo: Vel({self.simulation_speed})"
+        ]
+        items.append(("instructions", hud.bar("instructions", instructions, (5, 28))))
+
+        # Tiempos por fase (tecla P), sobre el mapa
+        items += visor.timing_items(hud, timings, (5, HUD_HEIGHT + 5), per_line=3)
+        timings.lap("draw_hud")
+
+        dirty = renderer.render(items)
+        timings.lap("draw_render")
+        return dirty
+
+
+def speed_by_density(densities, generations=1000, seed=None, breakdown_prob=0.0, **options):
+    """Densidad medida y velocidad media de la ciudad para cada densidad inicial: la curva del bloqueo.
+
+    Para cada densidad corre una ciudad nueva (options pasa a
+    TrafficCitySimulator) y promedia current_density y mean_speed en la
+    última décima de las generaciones. Por defecto sin averías, como el
+    modelo original: la grúa retira autos y la ciudad se iría vaciando. Si
+    la ciudad se vacía la velocidad es NaN; cerca de 0 quedó bloqueada.
+    Devuelve dos arreglos: densidades medidas y velocidades.
+    """
+    measured, speeds = [], []
+    for k, density in enumerate(densities):
+        city = TrafficCitySimulator(density=density, seed=None if seed is None else seed + k,
+                                    breakdown_prob=breakdown_prob, **options)
+        tail_density, tail_speed = [], []
+        for generation in range(generations):
+            city.update()
+            if generation >= generations - max(generations // 10, 1):
+                tail_density.append(city.current_density)
+                tail_speed.append(city.mean_speed)
+        measured.append(np.mean(tail_density))
+        # Sin autos en toda la cola no hay velocidad que promediar
+        speeds.append(np.nan if np.isnan(tail_speed).all() else np.nanmean(tail_speed))
+    return np.array(measured), np.array(speeds)
+
+
+def main():
+    init_viewer()
+    density = INITIAL_DENSITY
+    simulator = TrafficCitySimulator(density=density)
+    clock = pygame.time.Clock()
+    pacer = visor.GenerationPacer()
+    timings = PhaseTimings(enabled=False)
+    running = True
+    paused = False
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
+            elif event.type == pygame.KEYDOWN:
+                speed = simulator.simulation_speed
+                if event.key == pygame.K_SPACE:
+                    paused = not paused
+                elif event.key == pygame.K_t:
+                    simulator = TrafficCitySimulator(density=density, boundary_mode="toroid")
+                elif event.key == pygame.K_n:
+                    simulator = TrafficCitySimulator(density=density, boundary_mode="null")
+                elif event.key == pygame.K_r:
+                    simulator = TrafficCitySimulator(density=density, boundary_mode=simulator.boundary_mode)
+                elif event.key in (pygame.K_PLUS, pygame.K_EQUALS, pygame.K_KP_PLUS, pygame.K_MINUS, pygame.K_KP_MINUS):
+                    # Reiniciar con más o menos autos
+                    step = -DENSITY_STEP if event.key in (pygame.K_MINUS, pygame.K_KP_MINUS) else DENSITY_STEP
+                    density = round(min(max(density + step, 0.0), 1.0), 2)
+                    simulator = TrafficCitySimulator(density=density, boundary_mode=simulator.boundary_mode)
+                elif event.key == pygame.K_p:
+                    # Mostrar u ocultar los tiempos por fase (y medirlos)
+                    timings.enabled = not timings.enabled
+                    timings.reset()
+                elif event.key == pygame.K_UP:
+                    speed = visor.speed_up(speed)
+                elif event.key == pygame.K_DOWN:
+                    speed = visor.slow_down(speed)
+                # La velocidad se conserva al reiniciar
+                simulator.simulation_speed = speed
+
+        # Las mediciones pasan al simulador nuevo al reiniciar
+        simulator.timings = timings
+
+        # Ejecutar las generaciones que tocan en este cuadro según la
+        # velocidad (generaciones por segundo), sin atarla a los cuadros
+        pacer.run(simulator.update, simulator.simulation_speed, paused)
+
+        # Enviar a la pantalla solo las zonas que cambiaron
+        pygame.display.update(simulator.draw(pacer.hud_text()))
+        clock.tick(visor.FRAME_RATE)
+
+    pygame.quit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+import numpy as np
+
+import carril
+from fases import (apply_lane_changes, insert_cars, lane_change_decisions,
+                   pin_broken_cars, random_lane, spawn_streams, tick_breakdowns)
+from regla184 import apply_rule
+
+
+class EnsembleTrafficSimulator:
+    """K réplicas independientes de TrafficSimulator avanzadas como un solo arreglo.
+
+    Cada carril es un arreglo (K, NUM_CELLS) y las averías se guardan como
+    cuentas regresivas del mismo tamaño (0 = auto sano). Cada generación
+    aplica la regla, las averías, los cambios de carril y las inserciones a
+    todas las réplicas en una sola pasada vectorizada. Usa las constantes
+    del módulo carril.
+    """
+
+    def __init__(self, num_replicas, boundary_mode="toroid", seed=None, density=None):
+        self.num_replicas = num_replicas
+        self.boundary_mode = boundary_mode
+        # Los mismos flujos que TrafficSimulator: uno por carril y por
+        # subsistema, cada uno sacando bloques (K, NUM_CELLS) por generación
+        self.seed, self.streams = spawn_streams(
+            seed, ("init", "insertion") + tuple(lane_name for lane_name, _, _ in carril.TrafficSimulator.LANES))
+        init_rng = self.streams["init"]
+        shape = (num_replicas, carril.NUM_CELLS)
+
+        if density is not None:
+            # Densidad pedida: cada celda ocupada con probabilidad density
+            self.upper_lane = random_lane(init_rng, shape, density)
+            self.lower_lane = random_lane(init_rng, shape, density)
+        else:
+            # Misma distribución inicial que TrafficSimulator: autos espaciados
+            # uniformemente con un desfase aleatorio por réplica
+            spacing = int(1/carril.SPACED_DENSITY)
+            offset = init_rng.integers(0, spacing, size=(num_replicas, 1))
+            cells = np.arange(carril.NUM_CELLS)
+            lower_offset = (offset + spacing//2) % spacing
+            self.upper_lane = ((cells + offset) % spacing == 0).astype(int)
+            self.lower_lane = ((cells + lower_offset) % spacing == 0).astype(int)
+
+            # Añadir algo de aleatoriedad para romper patrones rígidos
+            self.upper_lane ^= init_rng.random(shape) < 0.1
+            self.lower_lane ^= init_rng.random(shape) < 0.1
+
+        self.broken_cars_upper = np.zeros(shape, dtype=np.int16)
+        self.broken_cars_lower = np.zeros(shape, dtype=np.int16)
+
+        self.generation = 0
+
+    def apply_rule_184(self, lanes):
+        """Aplicar la regla de TrafficSimulator a todas las réplicas de un carril."""
+        new_lanes = apply_rule(lanes, carril.RULE_OUTPUT, self.boundary_mode)
+
+        # En modo toroide, reinsertar al inicio el coche que desaparece por la
+        # derecha, igual que TrafficSimulator.apply_rule_184
+        if self.boundary_mode == "toroid":
+            lost = ((lanes.sum(axis=1) != new_lanes.sum(axis=1))
+                    & (lanes[:, -1] == 1) & (new_lanes[:, -1] == 0) & (new_lanes[:, 0] == 0))
+            new_lanes[lost, 0] = 1
+
+        return new_lanes
+
+    def update(self):
+        self.generation += 1
+
+        # Procesar primero los autos descompuestos
+        tick_breakdowns(self.upper_lane, self.broken_cars_upper, self.streams["upper_lane"], carril.REPAIR_PROB)
+        tick_breakdowns(self.lower_lane, self.broken_cars_lower, self.streams["lower_lane"], carril.REPAIR_PROB)
+
+        new_upper_lane = self.apply_rule_184(self.upper_lane)
+        new_lower_lane = self.apply_rule_184(self.lower_lane)
+
+        # Decidir cambios de carril y averías con el estado anterior a los cambios
+        upper_to_lower, new_breakdowns_upper = lane_change_decisions(
+            new_upper_lane, new_lower_lane, self.broken_cars_upper, self.streams["upper_lane"],
+            carril.CAR_CHANGE_LANE_PROB, carril.CAR_BREAKDOWN_PROB)
+        lower_to_upper, new_breakdowns_lower = lane_change_decisions(
+            new_lower_lane, new_upper_lane, self.broken_cars_lower, self.streams["lower_lane"],
+            carril.CAR_CHANGE_LANE_PROB, carril.CAR_BREAKDOWN_PROB)
+
+        apply_lane_changes(new_upper_lane, new_lower_lane, upper_to_lower, lower_to_upper)
+        self.broken_cars_upper[new_breakdowns_upper] = carril.REPAIR_ATTEMPTS
+        self.broken_cars_lower[new_breakdowns_lower] = carril.REPAIR_ATTEMPTS
+
+        if self.boundary_mode == "null":
+            insert_cars(new_upper_lane, new_lower_lane, self.streams["insertion"], carril.CAR_INSERTION_PROB, 0)
+
+        pin_broken_cars(new_upper_lane, self.broken_cars_upper)
+        pin_broken_cars(new_lower_lane, self.broken_cars_lower)
+
+        self.upper_lane = new_upper_lane
+        self.lower_lane = new_lower_lane
+
+    def replica(self, k):
+        """Extraer la réplica k como un TrafficSimulator independiente.
+
+        Su semilla se deriva de la del conjunto y de k, así que la réplica
+        extraída sigue siendo reproducible.
+        """
+        simulator = carril.TrafficSimulator(self.boundary_mode, seed=[*np.atleast_1d(self.seed).tolist(), k])
+        simulator.upper_lane = self.upper_lane[k].copy()
+        simulator.lower_lane = self.lower_lane[k].copy()
+        simulator.broken_cars_upper = self.broken_cars_upper[k].copy()
+        simulator.broken_cars_lower = self.broken_cars_lower[k].copy()
+        simulator.generation = self.generation
+        return simulator
@@ -1,11 +1,14 @@
 import pygame
 import numpy as np
-import random
-import os
 import math
+import sys
 
-# Inicializar pygame
-pygame.init()
+import repeticion
+import visor
+from cambios import NO_CELLS, LaneChanges
+from fases import enforce_car_limit, pin_broken_cars, spawn_streams, tick_breakdowns
+from regla184 import RULE_184, apply_rule
+from tiempos import PhaseTimings
 
 # Constantes
 WIDTH, HEIGHT = 800, 800   # Dimensiones para acomodar el cruce
@@ -44,70 +47,128 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 YELLOW = (255, 255, 0)
 
-# Crear la ventana
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Simulador de Tráfico en Cruce - Regla 184")
+# Superficies del visor. Se crean en init_viewer(), de modo que la simulación
+# puede importarse y ejecutarse sin inicializar pygame (modo headless)
+screen = None
+road_img = None
+car_left_img = None
+car_right_img = None
+car_down_img = None
+car_up_img = None
+broken_car_left_img = None
+broken_car_right_img = None
+broken_car_down_img = None
+broken_car_up_img = None
+font = None
+shadow_img = None
+smoke_imgs = None
+cross_area_img = None
+cross_area_pos = None
+hud = None
+renderer = None
 
-# Cargar imágenes
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-road_img = pygame.image.load(os.path.join(parent_dir, "./assets/cruce.png"))
-road_img = pygame.transform.scale(road_img, (WIDTH, HEIGHT))
-
-# Coches para las cuatro direcciones
-car_left_img = pygame.image.load(os.path.join(parent_dir, "./assets/1_left.png"))  # Derecha a izquierda
-car_right_img = pygame.image.load(os.path.join(parent_dir, "./assets/2_right.png"))  # Izquierda a derecha
-car_down_img = pygame.image.load(os.path.join(parent_dir, "./assets/3_down.png"))  # Arriba a abajo
-car_up_img = pygame.image.load(os.path.join(parent_dir, "./assets/4_up.png"))  # Abajo a arriba
-
-# Escalar imágenes de coches
-car_left_img = pygame.transform.scale(car_left_img, (CELL_SIZE, CELL_SIZE))
-car_right_img = pygame.transform.scale(car_right_img, (CELL_SIZE, CELL_SIZE))
-car_down_img = pygame.transform.scale(car_down_img, (CELL_SIZE, CELL_SIZE))
-car_up_img = pygame.transform.scale(car_up_img, (CELL_SIZE, CELL_SIZE))
+def init_viewer(surface=None):
+    """Crear la ventana (o usar la superficie dada) y cargar las imágenes."""
+    global screen, road_img, font
+    global car_left_img, car_right_img, car_down_img, car_up_img
+    global broken_car_left_img, broken_car_right_img, broken_car_down_img, broken_car_up_img
+    global shadow_img, smoke_imgs, hud, cross_area_img, cross_area_pos, renderer
+    screen = visor.open_screen(WIDTH, HEIGHT, "Simulador de Tráfico en Cruce - Regla 184", surface)
+    road_img = visor.load_image("cruce.png", (WIDTH, HEIGHT))
+    
+    # Coches para las cuatro direcciones
+    car_left_img = visor.load_image("1_left.png", (CELL_SIZE, CELL_SIZE))  # Derecha a izquierda
+    car_right_img = visor.load_image("2_right.png", (CELL_SIZE, CELL_SIZE))  # Izquierda a derecha
+    car_down_img = visor.load_image("3_down.png", (CELL_SIZE, CELL_SIZE))  # Arriba a abajo
+    car_up_img = visor.load_image("4_up.png", (CELL_SIZE, CELL_SIZE))  # Abajo a arriba
+    
+    # Versiones para coches descompuestos
+    broken_car_left_img = visor.tint_broken(car_left_img)
+    broken_car_right_img = visor.tint_broken(car_right_img)
+    broken_car_down_img = visor.tint_broken(car_down_img)
+    broken_car_up_img = visor.tint_broken(car_up_img)
+    
+    font = visor.create_font(13)
+    
+    # Sombra, humo y resaltado del cruce se arman una sola vez; el
+    # renderizador guarda el fondo
+    shadow_img = visor.make_shadow(CELL_SIZE)
+    smoke_imgs = visor.make_smoke_puffs()
+    cross_area_img = pygame.Surface((CELL_SIZE*3, CELL_SIZE*3), pygame.SRCALPHA)
+    cross_area_img.fill((255, 255, 0, 50))  # Amarillo transparente
+    # Centrar exactamente en CROSS_X, CROSS_Y (1.5 celdas a la izquierda y arriba)
+    cross_area_pos = (int(CROSS_X - CELL_SIZE * 1.5), int(CROSS_Y - CELL_SIZE * 1.5))
+    hud = visor.Hud(font, BLACK)
+    renderer = visor.DirtyRenderer(screen, road_img)
 
-# Versiones para coches descompuestos
-broken_car_left_img = car_left_img.copy()
-broken_car_right_img = car_right_img.copy()
-broken_car_down_img = car_down_img.copy()
-broken_car_up_img = car_up_img.copy()
+def _lane_row(stack, row):
+    """Atributo de un carril como vista de un renglón de un arreglo apilado.
 
-# Aplicar tinte rojo a los autos descompuestos
-red_overlay = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
-red_overlay.fill((255, 0, 0, 100))
-broken_car_left_img.blit(red_overlay, (0, 0))
-broken_car_right_img.blit(red_overlay, (0, 0))
-broken_car_down_img.blit(red_overlay, (0, 0))
-broken_car_up_img.blit(red_overlay, (0, 0))
+    Leerlo devuelve la vista; asignarle un arreglo copia sus valores al
+    renglón, de modo que el código que usa los nombres de los carriles no
+    cambia.
+    """
+    def get(self):
+        return getattr(self, stack)[row]
+    
+    def set(self, lane):
+        getattr(self, stack)[row] = lane
+    
+    return property(get, set)
 
 class TrafficCrossSimulator:
-    def __init__(self, boundary_mode="toroid"):
-        # Inicializar carriles horizontales (0 = vacío, 1 = auto)
-        # Primera carretera (dirección: derecha a izquierda)
-        self.upper_lane_1 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=int)
-        self.lower_lane_1 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=int)
-        
-        # Segunda carretera (dirección: izquierda a derecha)
-        self.upper_lane_2 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=int)
-        self.lower_lane_2 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=int)
-        
-        # Tercera carretera (dirección: arriba a abajo)
-        self.left_lane_3 = np.zeros(NUM_CELLS_VERTICAL, dtype=int)
-        self.right_lane_3 = np.zeros(NUM_CELLS_VERTICAL, dtype=int)
-        
-        # Cuarta carretera (dirección: abajo a arriba)
-        self.left_lane_4 = np.zeros(NUM_CELLS_VERTICAL, dtype=int)
-        self.right_lane_4 = np.zeros(NUM_CELLS_VERTICAL, dtype=int)
-        
-        # Autos descompuestos
-        self.broken_cars_upper_1 = {}  # Derecha a izquierda, carril superior
-        self.broken_cars_lower_1 = {}  # Derecha a izquierda, carril inferior
-        self.broken_cars_upper_2 = {}  # Izquierda a derecha, carril superior
-        self.broken_cars_lower_2 = {}  # Izquierda a derecha, carril inferior
-        self.broken_cars_left_3 = {}   # Arriba a abajo, carril izquierdo
-        self.broken_cars_right_3 = {}  # Arriba a abajo, carril derecho
-        self.broken_cars_left_4 = {}   # Abajo a arriba, carril izquierdo
-        self.broken_cars_right_4 = {}  # Abajo a arriba, carril derecho
+    # Carriles del simulador: (carril, averías, sentido en que avanzan los
+    # índices). De arriba a abajo los índices crecen, igual que de izquierda
+    # a derecha
+    LANES = (
+        ("upper_lane_1", "broken_cars_upper_1", "right_to_left"),
+        ("lower_lane_1", "broken_cars_lower_1", "right_to_left"),
+        ("upper_lane_2", "broken_cars_upper_2", "left_to_right"),
+        ("lower_lane_2", "broken_cars_lower_2", "left_to_right"),
+        ("left_lane_3", "broken_cars_left_3", "left_to_right"),
+        ("right_lane_3", "broken_cars_right_3", "left_to_right"),
+        ("left_lane_4", "broken_cars_left_4", "right_to_left"),
+        ("right_lane_4", "broken_cars_right_4", "right_to_left"),
+    )
+    
+    # Sentido de cada renglón de self.horizontal y de self.vertical
+    HORIZONTAL_DIRECTIONS = tuple(direction for _, _, direction in LANES[:4])
+    VERTICAL_DIRECTIONS = tuple(direction for _, _, direction in LANES[4:])
+    
+    # Carriles como vistas de los arreglos apilados
+    upper_lane_1 = _lane_row("horizontal", 0)
+    lower_lane_1 = _lane_row("horizontal", 1)
+    upper_lane_2 = _lane_row("horizontal", 2)
+    lower_lane_2 = _lane_row("horizontal", 3)
+    left_lane_3 = _lane_row("vertical", 0)
+    right_lane_3 = _lane_row("vertical", 1)
+    left_lane_4 = _lane_row("vertical", 2)
+    right_lane_4 = _lane_row("vertical", 3)
+    
+    def __init__(self, boundary_mode="toroid", seed=None):
+        # Inicializar carriles (0 = vacío, 1 = auto), apilados por orientación:
+        # un renglón por carril en el orden de LANES. Los atributos de cada
+        # carril (upper_lane_1, ...) son vistas de estos renglones
+        # Carreteras 1 (derecha a izquierda) y 2 (izquierda a derecha)
+        self.horizontal = np.zeros((4, NUM_CELLS_HORIZONTAL), dtype=int)
+        # Carreteras 3 (arriba a abajo) y 4 (abajo a arriba)
+        self.vertical = np.zeros((4, NUM_CELLS_VERTICAL), dtype=int)
+        
+        # Autos descompuestos: generaciones restantes de cada celda (0 = auto sano)
+        self.broken_cars_upper_1 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=np.int16)  # Derecha a izquierda, carril superior
+        self.broken_cars_lower_1 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=np.int16)  # Derecha a izquierda, carril inferior
+        self.broken_cars_upper_2 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=np.int16)  # Izquierda a derecha, carril superior
+        self.broken_cars_lower_2 = np.zeros(NUM_CELLS_HORIZONTAL, dtype=np.int16)  # Izquierda a derecha, carril inferior
+        self.broken_cars_left_3 = np.zeros(NUM_CELLS_VERTICAL, dtype=np.int16)  # Arriba a abajo, carril izquierdo
+        self.broken_cars_right_3 = np.zeros(NUM_CELLS_VERTICAL, dtype=np.int16)  # Arriba a abajo, carril derecho
+        self.broken_cars_left_4 = np.zeros(NUM_CELLS_VERTICAL, dtype=np.int16)  # Abajo a arriba, carril izquierdo
+        self.broken_cars_right_4 = np.zeros(NUM_CELLS_VERTICAL, dtype=np.int16)  # Abajo a arriba, carril derecho
+        
+        # Un generador por carril (averías y reparaciones) y por subsistema
+        # (giros, inserciones, límite de coches), derivados de la semilla; la
+        # semilla usada queda en self.seed para repetir la corrida
+        self.seed, self.streams = spawn_streams(
+            seed, ("turns", "insertion", "car_limit") + tuple(lane_name for lane_name, _, _ in self.LANES))
         
         # Índices de la celda central del cruce para cada carril
         # IMPORTANTE: Inicializamos estos valores antes de llamar a _initialize_limited_cars
@@ -116,6 +177,8 @@ class TrafficCrossSimulator:
         
         # Constante para el máximo número de coches por vialidad
         self.MAX_CARS_PER_ROAD = 15
+        # Límite de cada vialidad (1 a 4); se puede fijar uno distinto por vialidad
+        self.road_caps = [self.MAX_CARS_PER_ROAD] * 4
     
         # En lugar de usar densidad, colocamos exactamente 15 coches por cada tipo de vialidad
         # distribuidos uniformemente
@@ -136,17 +199,31 @@ class TrafficCrossSimulator:
         self._initialize_limited_cars(self.left_lane_4, 8)   # 8 en carril izquierdo
         self._initialize_limited_cars(self.right_lane_4, 7)  # 7 en carril derecho
         
+        # Coches por vialidad (1 a 4); update() los mantiene al día
+        self.road_counts = [
+            int(np.sum(self.upper_lane_1) + np.sum(self.lower_lane_1)),
+            int(np.sum(self.upper_lane_2) + np.sum(self.lower_lane_2)),
+            int(np.sum(self.left_lane_3) + np.sum(self.right_lane_3)),
+            int(np.sum(self.left_lane_4) + np.sum(self.right_lane_4))
+        ]
+        
         self.generation = 0
         self.boundary_mode = boundary_mode
         self.turn_count = 0  # Contador de giros realizados
         
-        # Fuente para textos
-        try:
-            self.font = pygame.font.SysFont("Arial", 13)
-        except:
-            self.font = pygame.font.SysFont(None, 24)
+        self.simulation_speed = 10  # Velocidad predeterminada (generaciones por segundo)
+        
+        # Métricas por generación y atascos por carril (las conectan
+        # metricas.TrafficMetrics.attach y atascos.JamTracker.attach). Con
+        # alguno conectado, update() deja en self.changes un
+        # cambios.LaneChanges por carril para que se actualicen
+        self.metrics = None
+        self.jams = None
+        self.changes = None
         
-        self.simulation_speed = 10  # Velocidad predeterminada
+        # Tiempo de cada fase de update() y draw(), apagado hasta que se
+        # active (tecla P o tiempos.PhaseTimings.attach)
+        self.timings = PhaseTimings(enabled=False)
     
     def _initialize_limited_cars(self, lane, num_cars):
         #lane: El carril donde colocar los coches
@@ -201,147 +278,49 @@ class TrafficCrossSimulator:
     
     def apply_rule_184_horizontal(self, lane, direction="left_to_right"):
         """Aplicar Regla 184 para movimiento horizontal"""
-        new_lane = np.zeros_like(lane)
-        
-        if direction == "left_to_right":
-            # Movimiento de izquierda a derecha
-            for i in range(len(lane)):
-                if self.boundary_mode == "toroid":
-                    left = lane[(i - 1) % len(lane)]
-                    center = lane[i]
-                    right = lane[(i + 1) % len(lane)]
-                else:
-                    left = lane[i - 1] if i > 0 else 0
-                    center = lane[i]
-                    right = lane[i + 1] if i < len(lane) - 1 else 0
-                
-                # Regla de movimiento: avanzar si hay espacio adelante
-                if center == 1 and right == 0:
-                    new_lane[i] = 0  # El coche avanza, esta celda queda vacía
-                elif center == 0 and left == 1:
-                    new_lane[i] = 1  # Un coche llega desde la izquierda
-                else:
-                    new_lane[i] = center  # La celda mantiene su estado
-        else:
-            # Movimiento de derecha a izquierda
-            for i in range(len(lane) - 1, -1, -1):
-                if self.boundary_mode == "toroid":
-                    right = lane[(i + 1) % len(lane)]
-                    center = lane[i]
-                    left = lane[(i - 1) % len(lane)]
-                else:
-                    right = lane[i + 1] if i < len(lane) - 1 else 0
-                    center = lane[i]
-                    left = lane[i - 1] if i > 0 else 0
-                
-                # Regla de movimiento: avanzar si hay espacio adelante
-                if center == 1 and left == 0:
-                    new_lane[i] = 0  # El coche avanza, esta celda queda vacía
-                elif center == 0 and right == 1:
-                    new_lane[i] = 1  # Un coche llega desde la derecha
-                else:
-                    new_lane[i] = center  # La celda mantiene su estado
-        
-        return new_lane
+        return apply_rule(lane, RULE_184, self.boundary_mode, direction)
     
     def apply_rule_184_vertical(self, lane, direction="top_to_bottom"):
         """Aplicar Regla 184 para movimiento vertical"""
-        new_lane = np.zeros_like(lane)
-        
+        # De arriba a abajo los coches avanzan hacia índices mayores, igual que
+        # de izquierda a derecha en los carriles horizontales
         if direction == "top_to_bottom":
-            # Movimiento de arriba a abajo
-            for i in range(len(lane)):
-                if self.boundary_mode == "toroid":
-                    top = lane[(i - 1) % len(lane)]
-                    center = lane[i]
-                    bottom = lane[(i + 1) % len(lane)]
-                else:
-                    top = lane[i - 1] if i > 0 else 0
-                    center = lane[i]
-                    bottom = lane[i + 1] if i < len(lane) - 1 else 0
-                
-                # Regla de movimiento: avanzar si hay espacio adelante
-                if center == 1 and bottom == 0:
-                    new_lane[i] = 0  # El coche avanza, esta celda queda vacía
-                elif center == 0 and top == 1:
-                    new_lane[i] = 1  # Un coche llega desde arriba
-                else:
-                    new_lane[i] = center  # La celda mantiene su estado
-        else:
-            # Movimiento de abajo a arriba
-            for i in range(len(lane) - 1, -1, -1):
-                if self.boundary_mode == "toroid":
-                    bottom = lane[(i + 1) % len(lane)]
-                    center = lane[i]
-                    top = lane[(i - 1) % len(lane)]
-                else:
-                    bottom = lane[i + 1] if i < len(lane) - 1 else 0
-                    center = lane[i]
-                    top = lane[i - 1] if i > 0 else 0
-                
-                # Regla de movimiento: avanzar si hay espacio adelante
-                if center == 1 and top == 0:
-                    new_lane[i] = 0  # El coche avanza, esta celda queda vacía
-                elif center == 0 and bottom == 1:
-                    new_lane[i] = 1  # Un coche llega desde abajo
-                else:
-                    new_lane[i] = center  # La celda mantiene su estado
-        
-        return new_lane
+            return apply_rule(lane, RULE_184, self.boundary_mode, "left_to_right")
+        return apply_rule(lane, RULE_184, self.boundary_mode, "right_to_left")
+    
+    def apply_rule_184_stacked(self, lanes, directions):
+        """Aplicar Regla 184 a varios carriles apilados, con un sentido por renglón"""
+        return apply_rule(lanes, RULE_184, self.boundary_mode, directions)
     
     def handle_broken_cars(self):
-        """Procesar autos descompuestos en todos los carriles"""
-        # Definir una función auxiliar para procesar cada diccionario de autos averiados
-        def process_broken_cars(broken_dict, lane):
-            to_remove = []
-            for pos, remaining in list(broken_dict.items()):
-                if remaining <= 1:
-                    if random.random() < REPAIR_PROB:
-                        pass  # Auto reparado
-                    else:
-                        lane[pos] = 0  # Auto remolcado
-                    to_remove.append(pos)
-                else:
-                    broken_dict[pos] = remaining - 1
-            
-            for pos in to_remove:
-                del broken_dict[pos]
-        
-        # Lista de pares (diccionario_de_autos_averiados, carril)
-        broken_lanes = [
-            (self.broken_cars_upper_1, self.upper_lane_1),
-            (self.broken_cars_lower_1, self.lower_lane_1),
-            (self.broken_cars_upper_2, self.upper_lane_2),
-            (self.broken_cars_lower_2, self.lower_lane_2),
-            (self.broken_cars_left_3, self.left_lane_3),
-            (self.broken_cars_right_3, self.right_lane_3),
-            (self.broken_cars_left_4, self.left_lane_4),
-            (self.broken_cars_right_4, self.right_lane_4)
-        ]
-        
-        # Procesar cada carril
-        for broken_dict, lane in broken_lanes:
-            process_broken_cars(broken_dict, lane)
+        """Procesar autos descompuestos en todos los carriles.
+
+        Devuelve, por carril, las averías que terminaron y los autos remolcados.
+        """
+        # Procesar cada carril con su propio generador
+        return {lane_name: tick_breakdowns(getattr(self, lane_name), getattr(self, broken_name),
+                                           self.streams[lane_name], REPAIR_PROB)
+                for lane_name, broken_name, _ in self.LANES}
     
     def update(self):
         self.generation += 1
-        
+        timings = self.timings
+        timings.start()
         
         # Procesar autos descompuestos
-        self.handle_broken_cars()
+        previous = {lane_name: getattr(self, lane_name) for lane_name, _, _ in self.LANES}
+        ended_and_towed = self.handle_broken_cars()
+        timings.lap("handle_broken_cars")
         
-        # Calcular nuevos estados para cada carril sin considerar giros aún
-        # Carriles horizontales
-        new_upper_lane_1 = self.apply_rule_184_horizontal(self.upper_lane_1, "right_to_left")
-        new_lower_lane_1 = self.apply_rule_184_horizontal(self.lower_lane_1, "right_to_left")
-        new_upper_lane_2 = self.apply_rule_184_horizontal(self.upper_lane_2, "left_to_right")
-        new_lower_lane_2 = self.apply_rule_184_horizontal(self.lower_lane_2, "left_to_right")
+        # Calcular nuevos estados para cada carril sin considerar giros aún:
+        # una sola operación por orientación sobre los carriles apilados
+        new_horizontal = self.apply_rule_184_stacked(self.horizontal, self.HORIZONTAL_DIRECTIONS)
+        new_vertical = self.apply_rule_184_stacked(self.vertical, self.VERTICAL_DIRECTIONS)
         
-        # Carriles verticales
-        new_left_lane_3 = self.apply_rule_184_vertical(self.left_lane_3, "top_to_bottom")
-        new_right_lane_3 = self.apply_rule_184_vertical(self.right_lane_3, "top_to_bottom")
-        new_left_lane_4 = self.apply_rule_184_vertical(self.left_lane_4, "bottom_to_top")
-        new_right_lane_4 = self.apply_rule_184_vertical(self.right_lane_4, "bottom_to_top")
+        # Vistas de cada carril; lo que sigue las modifica en su lugar
+        new_upper_lane_1, new_lower_lane_1, new_upper_lane_2, new_lower_lane_2 = new_horizontal
+        new_left_lane_3, new_right_lane_3, new_left_lane_4, new_right_lane_4 = new_vertical
+        timings.lap("rule")
         
         # Crear un diccionario con todos los carriles para facilitar el manejo
         new_lanes = {
@@ -358,62 +337,64 @@ class TrafficCrossSimulator:
         turns = []
         new_breakdowns = []
         
-        # Giros en el cruce
+        # Giros en el cruce (un número aleatorio por giro en cada generación)
+        turn_rolls = self.streams["turns"].random(4)
+        
         # 1. Giro desde carril inferior 1 hacia carretera 4
         if (new_lower_lane_1[self.cross_index_h] == 1 and
             new_right_lane_4[self.cross_index_v] == 0 and
-            random.random() < CAR_TURN_PROB):
+            turn_rolls[0] < CAR_TURN_PROB):
             turns.append(("lower_1_to_right_4", self.cross_index_h, self.cross_index_v))
             new_lower_lane_1[self.cross_index_h] = 0
         
         # 2. Giro desde carril inferior 2 hacia carretera 3 (izquierda)
         if (new_lower_lane_2[self.cross_index_h] == 1 and
             new_left_lane_3[self.cross_index_v] == 0 and
-            random.random() < CAR_TURN_PROB):
+            turn_rolls[1] < CAR_TURN_PROB):
             turns.append(("lower_2_to_left_3", self.cross_index_h, self.cross_index_v))
             new_lower_lane_2[self.cross_index_h] = 0
         
         # 3. Giro desde carril izquierdo 3 hacia carretera 1 (superior)
         if (new_left_lane_3[self.cross_index_v] == 1 and
             new_upper_lane_1[self.cross_index_h] == 0 and
-            random.random() < CAR_TURN_PROB):
+            turn_rolls[2] < CAR_TURN_PROB):
             turns.append(("left_3_to_upper_1", self.cross_index_h, self.cross_index_v))
             new_left_lane_3[self.cross_index_v] = 0
         
         # 4. Giro desde carril derecho 4 hacia carretera 2 (superior)
         if (new_right_lane_4[self.cross_index_v] == 1 and
             new_upper_lane_2[self.cross_index_h] == 0 and
-            random.random() < CAR_TURN_PROB):
+            turn_rolls[3] < CAR_TURN_PROB):
             turns.append(("right_4_to_upper_2", self.cross_index_h, self.cross_index_v))
             new_right_lane_4[self.cross_index_v] = 0
+        timings.lap("turns")
           # Verificar posibles averías en todos los carriles
         # Carriles horizontales
         lanes_h = [
-            ('upper_1', new_upper_lane_1, self.broken_cars_upper_1),
-            ('lower_1', new_lower_lane_1, self.broken_cars_lower_1),
-            ('upper_2', new_upper_lane_2, self.broken_cars_upper_2),
-            ('lower_2', new_lower_lane_2, self.broken_cars_lower_2)
+            ('upper_1', new_upper_lane_1, self.broken_cars_upper_1, self.streams["upper_lane_1"]),
+            ('lower_1', new_lower_lane_1, self.broken_cars_lower_1, self.streams["lower_lane_1"]),
+            ('upper_2', new_upper_lane_2, self.broken_cars_upper_2, self.streams["upper_lane_2"]),
+            ('lower_2', new_lower_lane_2, self.broken_cars_lower_2, self.streams["lower_lane_2"])
         ]
         
         # Verificar averías en carreteras horizontales
-        for name, lane, broken_dict in lanes_h:
-            for i in range(NUM_CELLS_HORIZONTAL):
-                if lane[i] == 1 and i not in broken_dict and random.random() < CAR_BREAKDOWN_PROB:
-                    new_breakdowns.append((name, i))
+        for name, lane, broken, rng in lanes_h:
+            breakdowns = (lane == 1) & (broken == 0) & (rng.random(NUM_CELLS_HORIZONTAL) < CAR_BREAKDOWN_PROB)
+            new_breakdowns.append((name, breakdowns))
         
         # Carriles verticales
         lanes_v = [
-            ('left_3', new_left_lane_3, self.broken_cars_left_3),
-            ('right_3', new_right_lane_3, self.broken_cars_right_3),
-            ('left_4', new_left_lane_4, self.broken_cars_left_4),
-            ('right_4', new_right_lane_4, self.broken_cars_right_4)
+            ('left_3', new_left_lane_3, self.broken_cars_left_3, self.streams["left_lane_3"]),
+            ('right_3', new_right_lane_3, self.broken_cars_right_3, self.streams["right_lane_3"]),
+            ('left_4', new_left_lane_4, self.broken_cars_left_4, self.streams["left_lane_4"]),
+            ('right_4', new_right_lane_4, self.broken_cars_right_4, self.streams["right_lane_4"])
         ]
         
         # Verificar averías en carreteras verticales
-        for name, lane, broken_dict in lanes_v:
-            for i in range(NUM_CELLS_VERTICAL):
-                if lane[i] == 1 and i not in broken_dict and random.random() < CAR_BREAKDOWN_PROB:
-                    new_breakdowns.append((name, i))
+        for name, lane, broken, rng in lanes_v:
+            breakdowns = (lane == 1) & (broken == 0) & (rng.random(NUM_CELLS_VERTICAL) < CAR_BREAKDOWN_PROB)
+            new_breakdowns.append((name, breakdowns))
+        timings.lap("decisions")
         
         # Aplicar giros en el cruce
         for turn, i_h, i_v in turns:
@@ -428,8 +409,8 @@ class TrafficCrossSimulator:
                 self.turn_count += 1
             elif turn == "right_4_to_upper_2":
                 new_upper_lane_2[i_h] = 1
-                self.turn_count += 1        # Aplicar nuevas averías usando un diccionario para mapear los nombres de los carriles a sus diccionarios
-        broken_dict_map = {
+                self.turn_count += 1        # Aplicar nuevas averías usando un diccionario para mapear los nombres de los carriles a sus averías
+        broken_map = {
             'upper_1': self.broken_cars_upper_1,
             'lower_1': self.broken_cars_lower_1,
             'upper_2': self.broken_cars_upper_2,
@@ -440,14 +421,21 @@ class TrafficCrossSimulator:
             'right_4': self.broken_cars_right_4
         }
         
-        for lane, i in new_breakdowns:
-            broken_dict_map[lane][i] = REPAIR_ATTEMPTS
+        for lane, breakdowns in new_breakdowns:
+            broken_map[lane][breakdowns] = REPAIR_ATTEMPTS
+        timings.lap("apply")
         
         # Manejar inserciones en frontera nula de manera más ordenada
+        entries = ((new_upper_lane_1, -1), (new_lower_lane_1, -1), (new_upper_lane_2, 0), (new_lower_lane_2, 0),
+                   (new_left_lane_3, 0), (new_right_lane_3, 0), (new_left_lane_4, -1), (new_right_lane_4, -1))
+        entry_before = [lane[cell] for lane, cell in entries]
         if self.boundary_mode == "null":
+            # Un número aleatorio por carretera en cada generación
+            insertion_rolls = self.streams["insertion"].random(4)
+            
             # Carretera 1 (derecha a izquierda, inserción por la derecha)
             road1_total = np.sum(new_upper_lane_1) + np.sum(new_lower_lane_1)
-            if road1_total < self.MAX_CARS_PER_ROAD and random.random() < CAR_INSERTION_PROB * 0.3:
+            if road1_total < self.road_caps[0] and insertion_rolls[0] < CAR_INSERTION_PROB * 0.3:
                 # Intentar insertar en el carril con menos autos primero
                 if np.sum(new_upper_lane_1) <= np.sum(new_lower_lane_1) and new_upper_lane_1[-1] == 0:
                     new_upper_lane_1[-1] = 1
@@ -456,7 +444,7 @@ class TrafficCrossSimulator:
             
             # Carretera 2 (izquierda a derecha, inserción por la izquierda)
             road2_total = np.sum(new_upper_lane_2) + np.sum(new_lower_lane_2)
-            if road2_total < self.MAX_CARS_PER_ROAD and random.random() < CAR_INSERTION_PROB * 0.3:
+            if road2_total < self.road_caps[1] and insertion_rolls[1] < CAR_INSERTION_PROB * 0.3:
                 if np.sum(new_upper_lane_2) <= np.sum(new_lower_lane_2) and new_upper_lane_2[0] == 0:
                     new_upper_lane_2[0] = 1
                 elif new_lower_lane_2[0] == 0:
@@ -464,7 +452,7 @@ class TrafficCrossSimulator:
             
             # Carretera 3 (arriba a abajo, inserción por arriba)
             road3_total = np.sum(new_left_lane_3) + np.sum(new_right_lane_3)
-            if road3_total < self.MAX_CARS_PER_ROAD and random.random() < CAR_INSERTION_PROB * 0.3:
+            if road3_total < self.road_caps[2] and insertion_rolls[2] < CAR_INSERTION_PROB * 0.3:
                 if np.sum(new_left_lane_3) <= np.sum(new_right_lane_3) and new_left_lane_3[0] == 0:
                     new_left_lane_3[0] = 1
                 elif new_right_lane_3[0] == 0:
@@ -472,11 +460,13 @@ class TrafficCrossSimulator:
             
             # Carretera 4 (abajo a arriba, inserción por abajo)
             road4_total = np.sum(new_left_lane_4) + np.sum(new_right_lane_4)
-            if road4_total < self.MAX_CARS_PER_ROAD and random.random() < CAR_INSERTION_PROB * 0.3:
+            if road4_total < self.road_caps[3] and insertion_rolls[3] < CAR_INSERTION_PROB * 0.3:
                 if np.sum(new_left_lane_4) <= np.sum(new_right_lane_4) and new_left_lane_4[-1] == 0:
                     new_left_lane_4[-1] = 1
                 elif new_right_lane_4[-1] == 0:
                     new_right_lane_4[-1] = 1
+        inserted = [bool(lane[cell]) and not before for (lane, cell), before in zip(entries, entry_before)]
+        timings.lap("insertion")
           # Asegurar que los autos descompuestos permanezcan en su lugar utilizando las listas de carriles
         broken_pairs = [
             (self.broken_cars_upper_1, new_upper_lane_1),
@@ -489,64 +479,100 @@ class TrafficCrossSimulator:
             (self.broken_cars_right_4, new_right_lane_4)
         ]
         
-        for broken_dict, lane in broken_pairs:
-            for pos in broken_dict:
-                lane[pos] = 1
-        
-        # Forzar el límite estricto de 15 coches por vialidad
-        # Si hay más de 15, eliminar algunos aleatoriamente
-        self._enforce_car_limit(new_upper_lane_1, new_lower_lane_1, self.MAX_CARS_PER_ROAD)
-        self._enforce_car_limit(new_upper_lane_2, new_lower_lane_2, self.MAX_CARS_PER_ROAD)
-        self._enforce_car_limit(new_left_lane_3, new_right_lane_3, self.MAX_CARS_PER_ROAD)
-        self._enforce_car_limit(new_left_lane_4, new_right_lane_4, self.MAX_CARS_PER_ROAD)
+        for broken, lane in broken_pairs:
+            pin_broken_cars(lane, broken)
+        timings.lap("pin")
+        
+        # Forzar el límite estricto de coches de cada vialidad (self.road_caps)
+        # Si hay más, eliminar algunos aleatoriamente
+        # Guardar de paso el número de coches de cada vialidad para el HUD
+        limited = [
+            self._enforce_car_limit((new_upper_lane_1, new_lower_lane_1),
+                                    (self.broken_cars_upper_1, self.broken_cars_lower_1), self.road_caps[0]),
+            self._enforce_car_limit((new_upper_lane_2, new_lower_lane_2),
+                                    (self.broken_cars_upper_2, self.broken_cars_lower_2), self.road_caps[1]),
+            self._enforce_car_limit((new_left_lane_3, new_right_lane_3),
+                                    (self.broken_cars_left_3, self.broken_cars_right_3), self.road_caps[2]),
+            self._enforce_car_limit((new_left_lane_4, new_right_lane_4),
+                                    (self.broken_cars_left_4, self.broken_cars_right_4), self.road_caps[3])
+        ]
+        self.road_counts = [count for count, _ in limited]
+        timings.lap("car_limit")
         
         # Actualizar estado de los carriles
-        self.upper_lane_1 = new_upper_lane_1
-        self.lower_lane_1 = new_lower_lane_1
-        self.upper_lane_2 = new_upper_lane_2
-        self.lower_lane_2 = new_lower_lane_2
-        self.left_lane_3 = new_left_lane_3
-        self.right_lane_3 = new_right_lane_3
-        self.left_lane_4 = new_left_lane_4
-        self.right_lane_4 = new_right_lane_4
+        self.horizontal = new_horizontal
+        self.vertical = new_vertical
+        
+        if self.metrics is not None or self.jams is not None:
+            self.changes = self._lane_changes(previous, ended_and_towed, new_breakdowns, turns, entries,
+                                              inserted, [cells for _, removed in limited for cells in removed])
+        if self.metrics is not None:
+            self.metrics.observe(self)
+        if self.jams is not None:
+            self.jams.observe(self)
+        timings.lap("observers")
     
-    def _enforce_car_limit(self, lane1, lane2, max_cars):
+    def _lane_changes(self, previous, ended_and_towed, new_breakdowns, turns, entries, inserted, removed):
+        """Un cambios.LaneChanges por carril con los sucesos de la última generación.
+
+        previous son los carriles anteriores, ya sin los autos remolcados;
+        entries, inserted y removed van en el orden de LANES: la celda de
+        entrada de cada carril, si se insertó un auto en ella y los autos
+        retirados por el límite.
         """
-        Fuerza el límite de coches en un par de carriles.
-        Si hay más coches que el límite, elimina algunos aleatoriamente
-        pero evitando los coches descompuestos.
+        names = [lane_name for lane_name, _, _ in self.LANES]
+        left = {lane_name: [NO_CELLS] for lane_name in names}
+        entered = {lane_name: [NO_CELLS] for lane_name in names}
+        for lane_name, (lane, cell), was_inserted in zip(names, entries, inserted):
+            if was_inserted:
+                entered[lane_name].append([cell % len(lane)])
+        # Cada giro saca un auto de la celda del cruce de un carril y lo
+        # pone en la del otro
+        turn_lanes = {
+            "lower_1_to_right_4": ("lower_lane_1", "right_lane_4"),
+            "lower_2_to_left_3": ("lower_lane_2", "left_lane_3"),
+            "left_3_to_upper_1": ("left_lane_3", "upper_lane_1"),
+            "right_4_to_upper_2": ("right_lane_4", "upper_lane_2"),
+        }
+        for turn, i_h, i_v in turns:
+            # En las carreteras 1 y 2 el cruce es la celda i_h; en la 3 y la 4, i_v
+            for lane_name, events in zip(turn_lanes[turn], (left, entered)):
+                events[lane_name].append([i_v if lane_name.endswith(("_3", "_4")) else i_h])
+        started = {short_name.replace("_", "_lane_"): np.flatnonzero(breakdowns)
+                   for short_name, breakdowns in new_breakdowns}
+
+        changes = {}
+        for lane_name, cells in zip(names, removed):
+            ended, towed = ended_and_towed[lane_name]
+            # Un auto que entró (por giro o inserción) y luego fue retirado
+            # no cambió lo que dejó la regla en esa celda
+            arrivals = np.concatenate(entered[lane_name])
+            withdrawn = np.intersect1d(arrivals, cells)
+            departures = np.concatenate([np.setdiff1d(cells, withdrawn)] + left[lane_name])
+            changes[lane_name] = LaneChanges.between(
+                previous[lane_name], getattr(self, lane_name), towed, ended, started[lane_name],
+                departures, np.setdiff1d(arrivals, withdrawn))
+        return changes
+    
+    def _enforce_car_limit(self, lanes, broken_lanes, max_cars):
         """
-        #lane1: Primer carril
-        #lane2: Segundo carril
-        #max_cars: Número máximo de coches permitido en ambos carriles
-        total_cars = np.sum(lane1) + np.sum(lane2)
-        
-        if total_cars > max_cars:
-            excess = total_cars - max_cars
-            
-            # Recopilar índices de coches que pueden eliminarse
-            # (evitando los descompuestos)
-            indices_lane1 = [i for i in range(len(lane1)) if lane1[i] == 1]
-            indices_lane2 = [i for i in range(len(lane2)) if lane2[i] == 1]
-            
-            # Mezclar índices para seleccionar aleatoriamente
-            random.shuffle(indices_lane1)
-            random.shuffle(indices_lane2)
-            
-            # Eliminar coches en exceso
-            for _ in range(excess):
-                if indices_lane1 and (not indices_lane2 or random.random() < 0.5):
-                    idx = indices_lane1.pop()
-                    lane1[idx] = 0
-                elif indices_lane2:
-                    idx = indices_lane2.pop()
-                    lane2[idx] = 0
-                else:
-                    # No hay más coches que eliminar
-                    break
+        Fuerza el límite de coches en una vialidad (sus carriles en lanes).
+        Si hay más coches que el límite, elimina al azar los que sobran
+        entre los coches sanos, nunca los descompuestos. Devuelve el número
+        de coches que quedan en la vialidad y los índices de los retirados
+        de cada carril.
+        """
+        return enforce_car_limit(lanes, broken_lanes, max_cars, self.streams["car_limit"])
     
-    def draw(self):
-        screen.blit(road_img, (0, 0))
+    def draw(self, rate_text=None):
+        """Dibujar la escena y devolver los rectángulos de pantalla que cambiaron.
+
+        rate_text, si se da, se muestra bajo los contadores (generaciones
+        por segundo reales y tiempo de cuadro).
+        """
+        timings = self.timings
+        timings.start()
+        items = []
         
         # Obtener tiempo para efectos visuales
         current_time = pygame.time.get_ticks()
@@ -563,26 +589,15 @@ class TrafficCrossSimulator:
                 y_pos = UPPER_LANE_1_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_upper_1:
+                if self.broken_cars_upper_1[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_left_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_left_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_left_img, (x_pos, y_pos))
+                    layers.append((car_left_img, (x_pos, y_pos)))
+                items.append((("upper_1", i), layers))
             
             # Carril inferior
             if self.lower_lane_1[i] == 1:
@@ -590,26 +605,15 @@ class TrafficCrossSimulator:
                 y_pos = LOWER_LANE_1_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_lower_1:
+                if self.broken_cars_lower_1[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_left_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_left_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_left_img, (x_pos, y_pos))
+                    layers.append((car_left_img, (x_pos, y_pos)))
+                items.append((("lower_1", i), layers))
         
         # Carretera 2 (izquierda a derecha)
         for i in range(NUM_CELLS_HORIZONTAL):
@@ -621,26 +625,15 @@ class TrafficCrossSimulator:
                 y_pos = UPPER_LANE_2_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_upper_2:
+                if self.broken_cars_upper_2[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_right_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos, x_pos + CELL_SIZE//2), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_right_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_right_img, (x_pos, y_pos))
+                    layers.append((car_right_img, (x_pos, y_pos)))
+                items.append((("upper_2", i), layers))
             
             # Carril inferior
             if self.lower_lane_2[i] == 1:
@@ -648,26 +641,15 @@ class TrafficCrossSimulator:
                 y_pos = LOWER_LANE_2_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_lower_2:
+                if self.broken_cars_lower_2[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_right_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos, x_pos + CELL_SIZE//2), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car_right_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_right_img, (x_pos, y_pos))
+                    layers.append((car_right_img, (x_pos, y_pos)))
+                items.append((("lower_2", i), layers))
         
         # ======= Dibujar autos en carreteras verticales =======
         
@@ -681,26 +663,15 @@ class TrafficCrossSimulator:
                 x_pos = LEFT_LANE_3_X + offset_x
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_left_3:
+                if self.broken_cars_left_3[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(5, 15)
-                        smoke_y = y_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_down_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + 5, x_pos + 15), (y_pos, y_pos + CELL_SIZE//2))
+                    layers.append((broken_car_down_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_down_img, (x_pos, y_pos))
+                    layers.append((car_down_img, (x_pos, y_pos)))
+                items.append((("left_3", i), layers))
             
             # Carril derecho
             if self.right_lane_3[i] == 1:
@@ -708,26 +679,15 @@ class TrafficCrossSimulator:
                 x_pos = RIGHT_LANE_3_X + offset_x
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_right_3:
+                if self.broken_cars_right_3[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(5, 15)
-                        smoke_y = y_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_down_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + 5, x_pos + 15), (y_pos, y_pos + CELL_SIZE//2))
+                    layers.append((broken_car_down_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_down_img, (x_pos, y_pos))
+                    layers.append((car_down_img, (x_pos, y_pos)))
+                items.append((("right_3", i), layers))
         
         # Carretera 4 (abajo a arriba)
         for i in range(NUM_CELLS_VERTICAL):
@@ -739,26 +699,15 @@ class TrafficCrossSimulator:
                 x_pos = LEFT_LANE_4_X + offset_x
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_left_4:
+                if self.broken_cars_left_4[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(5, 15)
-                        smoke_y = y_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_up_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + 5, x_pos + 15), (y_pos + CELL_SIZE//2, y_pos + CELL_SIZE))
+                    layers.append((broken_car_up_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_up_img, (x_pos, y_pos))
+                    layers.append((car_up_img, (x_pos, y_pos)))
+                items.append((("left_4", i), layers))
             
             # Carril derecho
             if self.right_lane_4[i] == 1:
@@ -766,80 +715,41 @@ class TrafficCrossSimulator:
                 x_pos = RIGHT_LANE_4_X + offset_x
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_right_4:
+                if self.broken_cars_right_4[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(5, 15)
-                        smoke_y = y_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car_up_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + 5, x_pos + 15), (y_pos + CELL_SIZE//2, y_pos + CELL_SIZE))
+                    layers.append((broken_car_up_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car_up_img, (x_pos, y_pos))
-          # Resaltar el área del cruce para mejor visualización
-        cross_area = pygame.Surface((CELL_SIZE*3, CELL_SIZE*3), pygame.SRCALPHA)
-        cross_area.fill((255, 255, 0, 50))  # Amarillo transparente
+                    layers.append((car_up_img, (x_pos, y_pos)))
+                items.append((("right_4", i), layers))
+        timings.lap("draw_cars")
         
-        # Corregir la posición para centrar exactamente en CROSS_X, CROSS_Y (400, 400)
-        cross_x = CROSS_X - (CELL_SIZE * 1.5)  # Centrar horizontalmente (1.5 celdas a la izquierda)
-        cross_y = CROSS_Y - (CELL_SIZE * 1.5)  # Centrar verticalmente (1.5 celdas arriba)
-        
-        screen.blit(cross_area, (cross_x, cross_y))
+        # Resaltar el área del cruce para mejor visualización
+        items.append(("cross_area", [(cross_area_img, cross_area_pos)]))
+        timings.lap("draw_effects")
         
         # Mostrar información de depuración para los giros
-        debug_text = self.font.render(f"Último giro: {self.turn_count} | Prob: {CAR_TURN_PROB}", True, BLACK)
-        debug_bg = pygame.Surface((debug_text.get_width() + 10, debug_text.get_height() + 6))
-        debug_bg.fill((220, 220, 220))
-        debug_bg.set_alpha(180)
-        screen.blit(debug_bg, (10, 30))
-        screen.blit(debug_text, (15, 33))
+        items.append(("debug", hud.label("debug", f"Último giro: {self.turn_count} | Prob: {CAR_TURN_PROB}", (10, 30))))
         
         # Dibujar contador de generaciones
-        gen_text = self.font.render(f"Generación: {self.generation}", True, BLACK)
-        text_bg = pygame.Surface((gen_text.get_width() + 10, gen_text.get_height() + 6))
-        text_bg.fill((220, 220, 220))
-        text_bg.set_alpha(180)
-        screen.blit(text_bg, (5, 2))
-        screen.blit(gen_text, (10, 5))
+        items.append(("generation", hud.label("generation", f"Generación: {self.generation}", (5, 2))))
+        
+        # Velocidad real de la simulación
+        if rate_text is not None:
+            items.append(("rate", hud.label("rate", rate_text, (10, 58))))
         
         # Dibujar modo de frontera
-        mode_text = self.font.render(f"Modo: {self.boundary_mode.capitalize()}", True, BLACK)
-        mode_bg = pygame.Surface((mode_text.get_width() + 10, mode_text.get_height() + 6))
-        mode_bg.fill((220, 220, 220))
-        mode_bg.set_alpha(180)
-        screen.blit(mode_bg, (WIDTH - mode_text.get_width() - 15, 2))
-        screen.blit(mode_text, (WIDTH - mode_text.get_width() - 10, 5))
-        
-        # Mostrar contadores de coches por vialidad
-        count_road1 = np.sum(self.upper_lane_1) + np.sum(self.lower_lane_1)
-        count_road2 = np.sum(self.upper_lane_2) + np.sum(self.lower_lane_2)
-        count_road3 = np.sum(self.left_lane_3) + np.sum(self.right_lane_3)
-        count_road4 = np.sum(self.left_lane_4) + np.sum(self.right_lane_4)
-        
-        cars_text = self.font.render(f"Coches: O→E:{count_road2} E→O:{count_road1} N→S:{count_road3} S→N:{count_road4}", True, BLACK)
-        cars_bg = pygame.Surface((cars_text.get_width() + 10, cars_text.get_height() + 6))
-        cars_bg.fill((220, 220, 220))
-        cars_bg.set_alpha(180)
-        screen.blit(cars_bg, (WIDTH - cars_text.get_width() - 15, 30))
-        screen.blit(cars_text, (WIDTH - cars_text.get_width() - 10, 33))
+        items.append(("mode", hud.label("mode", f"Modo: {self.boundary_mode.capitalize()}", (WIDTH - 5, 2), "right")))
+        
+        # Mostrar contadores de coches por vialidad (los lleva el simulador)
+        count_road1, count_road2, count_road3, count_road4 = self.road_counts
+        cars_text = f"Coches: O→E:{count_road2} E→O:{count_road1} N→S:{count_road3} S→N:{count_road4}"
+        items.append(("cars", hud.label("cars", cars_text, (WIDTH - 5, 30), "right")))
         
         # Mostrar contador de giros
-        turns_text = self.font.render(f"Giros: {self.turn_count}", True, BLACK)
-        turns_bg = pygame.Surface((turns_text.get_width() + 10, turns_text.get_height() + 6))
-        turns_bg.fill((220, 220, 220))
-        turns_bg.set_alpha(180)
-        screen.blit(turns_bg, (WIDTH - turns_text.get_width() - 15, 58))
-        screen.blit(turns_text, (WIDTH - turns_text.get_width() - 10, 61))
+        items.append(("turns", hud.label("turns", f"Giros: {self.turn_count}", (WIDTH - 5, 58), "right")))
         
         # Instrucciones
         instructions = [
@@ -847,30 +757,30 @@ class TrafficCrossSimulator:
             "T: Toroide",
             "N: Frontera nula",
             "R: Reiniciar",
+            "P: Tiempos",
             f"Arriba/Abajo: Vel({self.simulation_speed})"
         ]
+        items.append(("instructions", hud.bar("instructions", instructions, (200, 2))))
+        
+        # Tiempos por fase (tecla P)
+        items += visor.timing_items(hud, timings, (10, 86), per_line=3)
+        timings.lap("draw_hud")
         
-        # Fondo para instrucciones
-        total_width = 0
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)
-            total_width += text.get_width() + 20
-        
-        instruction_bg = pygame.Surface((total_width, 30))
-        instruction_bg.fill((240, 240, 240))
-        instruction_bg.set_alpha(180)
-        screen.blit(instruction_bg, (200, 2))
-        
-        # Mostrar instrucciones
-        x_offset = 210
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)
-            screen.blit(text, (x_offset, 8))
-            x_offset += text.get_width() + 20
+        # Fondo y autos en las zonas que cambiaron
+        dirty = renderer.render(items)
+        timings.lap("draw_render")
+        return dirty
 
 def main():
+    # python cruce.py --replay <grabación> reproduce una corrida grabada
+    if len(sys.argv) == 3 and sys.argv[1] == "--replay":
+        repeticion.replay(sys.argv[2], sys.modules[__name__], "TrafficCrossSimulator")
+        return
+    init_viewer()
     simulator = TrafficCrossSimulator(boundary_mode="null")
     clock = pygame.time.Clock()
+    pacer = visor.GenerationPacer()
+    timings = PhaseTimings(enabled=False)
     running = True
     paused = False
     
@@ -878,6 +788,8 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     paused = not paused
@@ -887,18 +799,25 @@ def main():
                     simulator = TrafficCrossSimulator(boundary_mode="null")
                 elif event.key == pygame.K_r:
                     simulator = TrafficCrossSimulator(simulator.boundary_mode)
+                elif event.key == pygame.K_p:
+                    # Mostrar u ocultar los tiempos por fase (y medirlos)
+                    timings.enabled = not timings.enabled
+                    timings.reset()
                 elif event.key == pygame.K_UP:
-                    simulator.simulation_speed = min(simulator.simulation_speed + 2, 30)
+                    simulator.simulation_speed = visor.speed_up(simulator.simulation_speed)
                 elif event.key == pygame.K_DOWN:
-                    simulator.simulation_speed = max(simulator.simulation_speed - 2, 1)
+                    simulator.simulation_speed = visor.slow_down(simulator.simulation_speed)
         
-        if not paused:
-            simulator.update()
+        # Las mediciones pasan al simulador nuevo al reiniciar
+        simulator.timings = timings
         
-        simulator.draw()
+        # Ejecutar las generaciones que tocan en este cuadro según la
+        # velocidad (generaciones por segundo), sin atarla a los cuadros
+        pacer.run(simulator.update, simulator.simulation_speed, paused)
         
-        pygame.display.flip()
-        clock.tick(simulator.simulation_speed)
+        # Enviar a la pantalla solo las zonas que cambiaron
+        pygame.display.update(simulator.draw(pacer.hud_text()))
+        clock.tick(visor.FRAME_RATE)
     
     pygame.quit()
 
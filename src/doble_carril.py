@@ -1,11 +1,16 @@
 import pygame
 import numpy as np
-import random
-import os
 import math
+import sys
 
-# Inicializar pygame
-pygame.init()
+import repeticion
+import visor
+from cambios import LaneChanges
+from empaquetado import PackedLane
+from fases import (apply_lane_changes, lane_change_cells, pin_broken_cars, random_lane, spawn_streams,
+                   tick_breakdowns)
+from regla184 import apply_rule
+from tiempos import PhaseTimings
 
 # Constantes
 WIDTH, HEIGHT = 1500, 280  # Aumentar altura para 4 carriles (2 carreteras)
@@ -22,43 +27,123 @@ CAR_BREAKDOWN_PROB = 0.05
 CAR_INSERTION_PROB = 0.1
 REPAIR_ATTEMPTS = 20
 REPAIR_PROB = 0.5
+# Ocupación del patrón inicial espaciado, cuando no se pide una densidad
+SPACED_DENSITY = 0.3
 
 # Colores
 BLACK = (0, 0, 0)
 WHITE = (255, 255, 255)
 RED = (255, 0, 0)
 
-# Crear la ventana
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-pygame.display.set_caption("Simulador de Tráfico Doble Carretera - Regla 184")
+# Tabla de búsqueda de la regla (izquierda a derecha), indexada por el patrón
+# (izquierda, centro, derecha)
+RULE_OUTPUT = np.array([0, 1, 0, 1, 1, 0, 1, 0])
 
-# Cargar imágenes
-current_dir = os.path.dirname(os.path.abspath(__file__))
-parent_dir = os.path.dirname(current_dir)
-road_img = pygame.image.load(os.path.join(parent_dir, "./assets/doble_carril.png"))
-road_img = pygame.transform.scale(road_img, (WIDTH, HEIGHT))
+# Superficies del visor. Se crean en init_viewer(), de modo que la simulación
+# puede importarse y ejecutarse sin inicializar pygame (modo headless)
+screen = None
+road_img = None
+car1_img = None
+car2_img = None
+broken_car1_img = None
+broken_car2_img = None
+font = None
+shadow_img = None
+smoke_imgs = None
+lane_marker_imgs = None
+hud = None
+renderer = None
 
-# Coches para la primera carretera (derecha a izquierda)
-car1_img = pygame.image.load(os.path.join(parent_dir, "./assets/1_left.png"))
-car1_img = pygame.transform.scale(car1_img, (CELL_SIZE, CELL_SIZE))
-
-# Coches para la segunda carretera (izquierda a derecha)
-car2_img = pygame.image.load(os.path.join(parent_dir, "./assets/3_right.png"))
-car2_img = pygame.transform.scale(car2_img, (CELL_SIZE, CELL_SIZE))
-
-# Versiones para coches descompuestos
-broken_car1_img = car1_img.copy()
-broken_car2_img = car2_img.copy()
-
-# Aplicar tinte rojo a los autos descompuestos
-red_overlay = pygame.Surface((CELL_SIZE, CELL_SIZE), pygame.SRCALPHA)
-red_overlay.fill((255, 0, 0, 100))
-broken_car1_img.blit(red_overlay, (0, 0))
-broken_car2_img.blit(red_overlay, (0, 0))
+def init_viewer(surface=None):
+    """Crear la ventana (o usar la superficie dada) y cargar las imágenes."""
+    global screen, road_img, car1_img, car2_img, broken_car1_img, broken_car2_img, font
+    global shadow_img, smoke_imgs, hud, lane_marker_imgs, renderer
+    screen = visor.open_screen(WIDTH, HEIGHT, "Simulador de Tráfico Doble Carretera - Regla 184", surface)
+    road_img = visor.load_image("doble_carril.png", (WIDTH, HEIGHT))
+    
+    # Coches para la primera carretera (derecha a izquierda)
+    car1_img = visor.load_image("1_left.png", (CELL_SIZE, CELL_SIZE))
+    # Coches para la segunda carretera (izquierda a derecha)
+    car2_img = visor.load_image("3_right.png", (CELL_SIZE, CELL_SIZE))
+    
+    # Versiones para coches descompuestos
+    broken_car1_img = visor.tint_broken(car1_img)
+    broken_car2_img = visor.tint_broken(car2_img)
+    
+    font = visor.create_font(18)
+    
+    # Sombra, humo y líneas de carril se arman una sola vez; el renderizador
+    # guarda el fondo
+    shadow_img = visor.make_shadow(CELL_SIZE)
+    smoke_imgs = visor.make_smoke_puffs()
+    lane_marker_imgs = []
+    for color in ((255, 255, 255), (220, 220, 220)):
+        marker = pygame.Surface((CELL_SIZE//2, 5))
+        marker.fill(color)
+        lane_marker_imgs.append(marker)
+    hud = visor.Hud(font, BLACK)
+    renderer = visor.DirtyRenderer(screen, road_img)
 
 class DoubleRoadTrafficSimulator:
-    def __init__(self, boundary_mode="toroid"):
+    # Carriles del simulador: (atributo del carril, atributo de averías, sentido)
+    LANES = (
+        ("upper_lane_1", "broken_cars_upper_1", "right_to_left"),
+        ("lower_lane_1", "broken_cars_lower_1", "right_to_left"),
+        ("upper_lane_2", "broken_cars_upper_2", "left_to_right"),
+        ("lower_lane_2", "broken_cars_lower_2", "left_to_right"),
+    )
+    
+    def __init__(self, boundary_mode="toroid", engine="dense", density=None, seed=None):
+        # Un generador por carril y por subsistema, derivados de la semilla
+        # (la semilla usada queda en self.seed para repetir la corrida)
+        self.seed, self.streams = spawn_streams(
+            seed, ("init", "insertion") + tuple(lane_name for lane_name, _, _ in self.LANES))
+        init_rng = self.streams["init"]
+        
         # Inicializar carriles (0 = vacío, 1 = auto)
+        if density is not None:
+            # Densidad pedida: cada celda ocupada con probabilidad density
+            self.upper_lane_1 = random_lane(init_rng, NUM_CELLS, density)
+            self.lower_lane_1 = random_lane(init_rng, NUM_CELLS, density)
+            self.upper_lane_2 = random_lane(init_rng, NUM_CELLS, density)
+            self.lower_lane_2 = random_lane(init_rng, NUM_CELLS, density)
+        else:
+            self._initialize_spaced(init_rng)
+        
+        # Motor de carriles: "dense" (un entero por celda) o "packed"
+        # (64 celdas por palabra, para carriles muy largos)
+        self.engine = engine
+        if engine == "packed":
+            self.upper_lane_1 = PackedLane.from_array(self.upper_lane_1)
+            self.lower_lane_1 = PackedLane.from_array(self.lower_lane_1)
+            self.upper_lane_2 = PackedLane.from_array(self.upper_lane_2)
+            self.lower_lane_2 = PackedLane.from_array(self.lower_lane_2)
+        
+        # Autos descompuestos: generaciones restantes de cada celda (0 = auto sano)
+        self.broken_cars_upper_1 = np.zeros(NUM_CELLS, dtype=np.int16)
+        self.broken_cars_lower_1 = np.zeros(NUM_CELLS, dtype=np.int16)
+        self.broken_cars_upper_2 = np.zeros(NUM_CELLS, dtype=np.int16)
+        self.broken_cars_lower_2 = np.zeros(NUM_CELLS, dtype=np.int16)
+        
+        self.generation = 0
+        self.boundary_mode = boundary_mode
+        
+        self.simulation_speed = 10  # Velocidad predeterminada (generaciones por segundo)
+        
+        # Métricas por generación y atascos por carril (las conectan
+        # metricas.TrafficMetrics.attach y atascos.JamTracker.attach). Con
+        # alguno conectado, update() deja en self.changes un
+        # cambios.LaneChanges por carril para que se actualicen
+        self.metrics = None
+        self.jams = None
+        self.changes = None
+        
+        # Tiempo de cada fase de update() y draw(), apagado hasta que se
+        # active (tecla P o tiempos.PhaseTimings.attach)
+        self.timings = PhaseTimings(enabled=False)
+    
+    def _initialize_spaced(self, init_rng):
+        """Patrón inicial predeterminado: autos espaciados con algo de ruido."""
         # Primera carretera (dirección: derecha a izquierda)
         self.upper_lane_1 = np.zeros(NUM_CELLS, dtype=int)
         self.lower_lane_1 = np.zeros(NUM_CELLS, dtype=int)
@@ -68,11 +153,10 @@ class DoubleRoadTrafficSimulator:
         self.lower_lane_2 = np.zeros(NUM_CELLS, dtype=int)
         
         # Distribuir autos de manera uniforme
-        density = 0.3  # 30% de ocupación
-        spacing = int(1/density)
+        spacing = int(1/SPACED_DENSITY)
         
         # Colocar coches en primera carretera
-        offset1 = random.randint(0, spacing-1)
+        offset1 = int(init_rng.integers(0, spacing))
         for i in range(NUM_CELLS):
             if (i + offset1) % spacing == 0:
                 self.upper_lane_1[i] = 1
@@ -82,7 +166,7 @@ class DoubleRoadTrafficSimulator:
                 self.lower_lane_1[i] = 1
         
         # Colocar coches en segunda carretera
-        offset2 = random.randint(0, spacing-1)
+        offset2 = int(init_rng.integers(0, spacing))
         for i in range(NUM_CELLS):
             if (i + offset2) % spacing == 0:
                 self.upper_lane_2[i] = 1
@@ -91,55 +175,19 @@ class DoubleRoadTrafficSimulator:
             if (i + lower_offset2) % spacing == 0:
                 self.lower_lane_2[i] = 1
         
-        # Añadir aleatoriedad para romper patrones rígidos
-        for i in range(NUM_CELLS):
-            if random.random() < 0.1:
-                self.upper_lane_1[i] = 1 - self.upper_lane_1[i]
-            if random.random() < 0.1:
-                self.lower_lane_1[i] = 1 - self.lower_lane_1[i]
-            if random.random() < 0.1:
-                self.upper_lane_2[i] = 1 - self.upper_lane_2[i]
-            if random.random() < 0.1:
-                self.lower_lane_2[i] = 1 - self.lower_lane_2[i]
-        
-        # Autos descompuestos
-        self.broken_cars_upper_1 = {}
-        self.broken_cars_lower_1 = {}
-        self.broken_cars_upper_2 = {}
-        self.broken_cars_lower_2 = {}
-        
-        self.generation = 0
-        self.boundary_mode = boundary_mode
-        
-        # Fuente para textos
-        try:
-            self.font = pygame.font.SysFont("Arial", 18)
-        except:
-            self.font = pygame.font.SysFont(None, 24)
-        
-        self.simulation_speed = 10  # Velocidad predeterminada
+        # Añadir aleatoriedad para romper patrones rígidos: cada celda se
+        # invierte con 10% de probabilidad
+        self.upper_lane_1 ^= init_rng.random(NUM_CELLS) < 0.1
+        self.lower_lane_1 ^= init_rng.random(NUM_CELLS) < 0.1
+        self.upper_lane_2 ^= init_rng.random(NUM_CELLS) < 0.1
+        self.lower_lane_2 ^= init_rng.random(NUM_CELLS) < 0.1
     
     def apply_rule_184_left_to_right(self, lane):
         """Aplicar Regla 184 para movimiento de izquierda a derecha"""
-        new_lane = np.zeros_like(lane)
-        
-        for i in range(len(lane)):
-            if self.boundary_mode == "toroid":
-                left = lane[(i - 1) % len(lane)]
-                center = lane[i]
-                right = lane[(i + 1) % len(lane)]
-            else:
-                left = lane[i - 1] if i > 0 else 0
-                center = lane[i]
-                right = lane[i + 1] if i < len(lane) - 1 else 0
-            
-            # Tabla de búsqueda para Regla 184 (izquierda a derecha)
-            pattern = (left << 2) | (center << 1) | right
-            rule_output = {
-                0: 0, 1: 1, 2: 0, 3: 1,
-                4: 1, 5: 0, 6: 1, 7: 0
-            }
-            new_lane[i] = rule_output[pattern]
+        if self.engine == "packed":
+            new_lane = lane.step(RULE_OUTPUT, self.boundary_mode)
+        else:
+            new_lane = apply_rule(lane, RULE_OUTPUT, self.boundary_mode)
         
         # En modo toroide, mantener el número de coches
         if self.boundary_mode == "toroid":
@@ -154,6 +202,9 @@ class DoubleRoadTrafficSimulator:
         """Aplicar Regla 184 para movimiento de derecha a izquierda (inverso)"""
         # Para simular movimiento de derecha a izquierda, invertimos el arreglo,
         # aplicamos la regla estándar y volvemos a invertir
+        if self.engine == "packed":
+            return self.apply_rule_184_left_to_right(lane.flipped()).flipped()
+        
         reversed_lane = np.flip(lane)
         new_reversed_lane = self.apply_rule_184_left_to_right(reversed_lane)
         new_lane = np.flip(new_reversed_lane)
@@ -161,73 +212,22 @@ class DoubleRoadTrafficSimulator:
         return new_lane
     
     def handle_broken_cars(self):
-        # Procesar autos descompuestos en todos los carriles
-        
-        # Primera carretera (carril superior)
-        broken_cars_to_remove_upper_1 = []
-        for pos, remaining in list(self.broken_cars_upper_1.items()):
-            if remaining <= 1:
-                if random.random() < REPAIR_PROB:
-                    pass  # Auto reparado
-                else:
-                    self.upper_lane_1[pos] = 0  # Auto remolcado
-                broken_cars_to_remove_upper_1.append(pos)
-            else:
-                self.broken_cars_upper_1[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_upper_1:
-            del self.broken_cars_upper_1[pos]
-        
-        # Primera carretera (carril inferior)
-        broken_cars_to_remove_lower_1 = []
-        for pos, remaining in list(self.broken_cars_lower_1.items()):
-            if remaining <= 1:
-                if random.random() < REPAIR_PROB:
-                    pass  # Auto reparado
-                else:
-                    self.lower_lane_1[pos] = 0  # Auto remolcado
-                broken_cars_to_remove_lower_1.append(pos)
-            else:
-                self.broken_cars_lower_1[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_lower_1:
-            del self.broken_cars_lower_1[pos]
-        
-        # Segunda carretera (carril superior)
-        broken_cars_to_remove_upper_2 = []
-        for pos, remaining in list(self.broken_cars_upper_2.items()):
-            if remaining <= 1:
-                if random.random() < REPAIR_PROB:
-                    pass  # Auto reparado
-                else:
-                    self.upper_lane_2[pos] = 0  # Auto remolcado
-                broken_cars_to_remove_upper_2.append(pos)
-            else:
-                self.broken_cars_upper_2[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_upper_2:
-            del self.broken_cars_upper_2[pos]
-        
-        # Segunda carretera (carril inferior)
-        broken_cars_to_remove_lower_2 = []
-        for pos, remaining in list(self.broken_cars_lower_2.items()):
-            if remaining <= 1:
-                if random.random() < REPAIR_PROB:
-                    pass  # Auto reparado
-                else:
-                    self.lower_lane_2[pos] = 0  # Auto remolcado
-                broken_cars_to_remove_lower_2.append(pos)
-            else:
-                self.broken_cars_lower_2[pos] = remaining - 1
-        
-        for pos in broken_cars_to_remove_lower_2:
-            del self.broken_cars_lower_2[pos]
+        # Procesar autos descompuestos en todos los carriles: descontar una
+        # generación y reparar o remolcar los que agotan su cuenta. Devuelve,
+        # por carril, las averías que terminaron y los autos remolcados
+        return {lane_name: tick_breakdowns(getattr(self, lane_name), getattr(self, broken_name),
+                                           self.streams[lane_name], REPAIR_PROB)
+                for lane_name, broken_name, _ in self.LANES}
     
     def update(self):
         self.generation += 1
+        timings = self.timings
+        timings.start()
         
         # Procesar autos descompuestos
-        self.handle_broken_cars()
+        previous = {lane_name: getattr(self, lane_name) for lane_name, _, _ in self.LANES}
+        ended_and_towed = self.handle_broken_cars()
+        timings.lap("handle_broken_cars")
         
         # Calcular nuevos estados para cada carril
         # Primera carretera (derecha a izquierda)
@@ -237,139 +237,53 @@ class DoubleRoadTrafficSimulator:
         # Segunda carretera (izquierda a derecha)
         new_upper_lane_2 = self.apply_rule_184_left_to_right(self.upper_lane_2)
         new_lower_lane_2 = self.apply_rule_184_left_to_right(self.lower_lane_2)
-        
-        # Verificar cambios de carril y averías en primera carretera
-        upper_to_lower_1 = []
-        lower_to_upper_1 = []
-        new_breakdowns_upper_1 = []
-        new_breakdowns_lower_1 = []
-        
-        # Primera carretera, carril superior
-        for i in range(NUM_CELLS):
-            if new_upper_lane_1[i] == 1 and i not in self.broken_cars_upper_1:
-                # Verificar si coche está bloqueado
-                is_blocked = False
-                # En carril derecha-izquierda, verificamos la celda anterior (a la izquierda)
-                if i > 0 and i - 1 in self.broken_cars_upper_1:
-                    is_blocked = True
-                
-                if is_blocked:
-                    decision = random.random()
-                    if decision < 0.2:
-                        # Decide esperar (20% probabilidad)
-                        pass
-                    elif decision < 0.7 and new_lower_lane_1[i] == 0:
-                        # Intenta cambiar de carril (50% probabilidad)
-                        upper_to_lower_1.append(i)
-                else:
-                    # Comportamiento normal
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_lower_lane_1[i] == 0:
-                        upper_to_lower_1.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_upper_1.append(i)
-        
-        # Primera carretera, carril inferior
-        for i in range(NUM_CELLS):
-            if new_lower_lane_1[i] == 1 and i not in self.broken_cars_lower_1:
-                is_blocked = False
-                if i > 0 and i - 1 in self.broken_cars_lower_1:
-                    is_blocked = True
-                
-                if is_blocked:
-                    decision = random.random()
-                    if decision < 0.2:
-                        pass
-                    elif decision < 0.7 and new_upper_lane_1[i] == 0:
-                        lower_to_upper_1.append(i)
-                else:
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_upper_lane_1[i] == 0:
-                        lower_to_upper_1.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_lower_1.append(i)
-        
-        # Verificar cambios de carril y averías en segunda carretera
-        upper_to_lower_2 = []
-        lower_to_upper_2 = []
-        new_breakdowns_upper_2 = []
-        new_breakdowns_lower_2 = []
-        
-        # Segunda carretera, carril superior
-        for i in range(NUM_CELLS):
-            if new_upper_lane_2[i] == 1 and i not in self.broken_cars_upper_2:
-                # En carril izquierda-derecha, verificamos la celda siguiente
-                is_blocked = False
-                if i < NUM_CELLS - 1 and i + 1 in self.broken_cars_upper_2:
-                    is_blocked = True
-                
-                if is_blocked:
-                    decision = random.random()
-                    if decision < 0.2:
-                        pass
-                    elif decision < 0.7 and new_lower_lane_2[i] == 0:
-                        upper_to_lower_2.append(i)
-                else:
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_lower_lane_2[i] == 0:
-                        upper_to_lower_2.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_upper_2.append(i)
-        
-        # Segunda carretera, carril inferior
-        for i in range(NUM_CELLS):
-            if new_lower_lane_2[i] == 1 and i not in self.broken_cars_lower_2:
-                is_blocked = False
-                if i < NUM_CELLS - 1 and i + 1 in self.broken_cars_lower_2:
-                    is_blocked = True
-                
-                if is_blocked:
-                    decision = random.random()
-                    if decision < 0.2:
-                        pass
-                    elif decision < 0.7 and new_upper_lane_2[i] == 0:
-                        lower_to_upper_2.append(i)
-                else:
-                    if random.random() < CAR_CHANGE_LANE_PROB and new_upper_lane_2[i] == 0:
-                        lower_to_upper_2.append(i)
-                    elif random.random() < CAR_BREAKDOWN_PROB:
-                        new_breakdowns_lower_2.append(i)
+        timings.lap("rule")
+        
+        # Decidir cambios de carril y averías de todos los autos a la vez, con
+        # el estado de ambos carriles antes de aplicar cualquier cambio. Las
+        # decisiones son índices de celdas, así que el motor empaquetado nunca
+        # desempaqueta el carril completo
+        # Primera carretera: en carril derecha-izquierda, el auto de adelante
+        # está en la celda anterior
+        upper_to_lower_1, new_breakdowns_upper_1 = lane_change_cells(
+            new_upper_lane_1, new_lower_lane_1, self.broken_cars_upper_1, self.streams["upper_lane_1"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB, "right_to_left")
+        lower_to_upper_1, new_breakdowns_lower_1 = lane_change_cells(
+            new_lower_lane_1, new_upper_lane_1, self.broken_cars_lower_1, self.streams["lower_lane_1"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB, "right_to_left")
+        
+        # Segunda carretera: en carril izquierda-derecha, la celda siguiente
+        upper_to_lower_2, new_breakdowns_upper_2 = lane_change_cells(
+            new_upper_lane_2, new_lower_lane_2, self.broken_cars_upper_2, self.streams["upper_lane_2"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB, "left_to_right")
+        lower_to_upper_2, new_breakdowns_lower_2 = lane_change_cells(
+            new_lower_lane_2, new_upper_lane_2, self.broken_cars_lower_2, self.streams["lower_lane_2"],
+            CAR_CHANGE_LANE_PROB, CAR_BREAKDOWN_PROB, "left_to_right")
         
         # Aplicar cambios de carril
-        # Primera carretera
-        for i in upper_to_lower_1:
-            new_upper_lane_1[i] = 0
-            new_lower_lane_1[i] = 1
-        
-        for i in lower_to_upper_1:
-            new_lower_lane_1[i] = 0
-            new_upper_lane_1[i] = 1
-        
-        # Segunda carretera
-        for i in upper_to_lower_2:
-            new_upper_lane_2[i] = 0
-            new_lower_lane_2[i] = 1
-        
-        for i in lower_to_upper_2:
-            new_lower_lane_2[i] = 0
-            new_upper_lane_2[i] = 1
+        apply_lane_changes(new_upper_lane_1, new_lower_lane_1, upper_to_lower_1, lower_to_upper_1)
+        apply_lane_changes(new_upper_lane_2, new_lower_lane_2, upper_to_lower_2, lower_to_upper_2)
         
         # Aplicar nuevas averías
-        # Primera carretera
-        for i in new_breakdowns_upper_1:
-            self.broken_cars_upper_1[i] = REPAIR_ATTEMPTS
-        
-        for i in new_breakdowns_lower_1:
-            self.broken_cars_lower_1[i] = REPAIR_ATTEMPTS
-        
-        # Segunda carretera
-        for i in new_breakdowns_upper_2:
-            self.broken_cars_upper_2[i] = REPAIR_ATTEMPTS
-        
-        for i in new_breakdowns_lower_2:
-            self.broken_cars_lower_2[i] = REPAIR_ATTEMPTS
+        new_breakdowns = [
+            (new_breakdowns_upper_1, self.broken_cars_upper_1),
+            (new_breakdowns_lower_1, self.broken_cars_lower_1),
+            (new_breakdowns_upper_2, self.broken_cars_upper_2),
+            (new_breakdowns_lower_2, self.broken_cars_lower_2)
+        ]
+        for breakdowns, broken_cars in new_breakdowns:
+            broken_cars[breakdowns] = REPAIR_ATTEMPTS
+        timings.lap("decisions")
         
         # Manejar inserciones en frontera nula
+        entries = ((new_upper_lane_1, -1), (new_lower_lane_1, -1), (new_upper_lane_2, 0), (new_lower_lane_2, 0))
+        entry_before = [lane[cell] for lane, cell in entries]
         if self.boundary_mode == "null":
+            # Un número aleatorio por carretera en cada generación
+            insertion_rolls = self.streams["insertion"].random(2)
+            
             # Primera carretera (inserciones por la derecha)
-            if random.random() < CAR_INSERTION_PROB:
+            if insertion_rolls[0] < CAR_INSERTION_PROB:
                 upper_count = np.sum(new_upper_lane_1)
                 lower_count = np.sum(new_lower_lane_1)
                 total_cells = NUM_CELLS * 2
@@ -387,7 +301,7 @@ class DoubleRoadTrafficSimulator:
                         new_lower_lane_1[-1] = 1
             
             # Segunda carretera (inserciones por la izquierda)
-            if random.random() < CAR_INSERTION_PROB:
+            if insertion_rolls[1] < CAR_INSERTION_PROB:
                 upper_count = np.sum(new_upper_lane_2)
                 lower_count = np.sum(new_lower_lane_2)
                 total_cells = NUM_CELLS * 2
@@ -403,28 +317,54 @@ class DoubleRoadTrafficSimulator:
                         new_upper_lane_2[0] = 1
                     elif new_lower_lane_2[0] == 0:
                         new_lower_lane_2[0] = 1
+        inserted = [[cell % NUM_CELLS] if lane[cell] and not before else []
+                    for (lane, cell), before in zip(entries, entry_before)]
+        timings.lap("insertion")
         
         # Asegurar que los autos descompuestos permanezcan en su lugar
-        for pos in self.broken_cars_upper_1:
-            new_upper_lane_1[pos] = 1
-        
-        for pos in self.broken_cars_lower_1:
-            new_lower_lane_1[pos] = 1
-        
-        for pos in self.broken_cars_upper_2:
-            new_upper_lane_2[pos] = 1
-        
-        for pos in self.broken_cars_lower_2:
-            new_lower_lane_2[pos] = 1
+        pin_broken_cars(new_upper_lane_1, self.broken_cars_upper_1)
+        pin_broken_cars(new_lower_lane_1, self.broken_cars_lower_1)
+        pin_broken_cars(new_upper_lane_2, self.broken_cars_upper_2)
+        pin_broken_cars(new_lower_lane_2, self.broken_cars_lower_2)
+        timings.lap("pin")
         
         # Actualizar estado de los carriles
         self.upper_lane_1 = new_upper_lane_1
         self.lower_lane_1 = new_lower_lane_1
         self.upper_lane_2 = new_upper_lane_2
         self.lower_lane_2 = new_lower_lane_2
+        
+        if self.metrics is not None or self.jams is not None:
+            # Lo que cambió en cada carril respecto a previous (ya sin los
+            # autos remolcados): cambios de carril, inserciones y averías
+            moves = {
+                "upper_lane_1": (new_breakdowns_upper_1, upper_to_lower_1, lower_to_upper_1),
+                "lower_lane_1": (new_breakdowns_lower_1, lower_to_upper_1, upper_to_lower_1),
+                "upper_lane_2": (new_breakdowns_upper_2, upper_to_lower_2, lower_to_upper_2),
+                "lower_lane_2": (new_breakdowns_lower_2, lower_to_upper_2, upper_to_lower_2),
+            }
+            self.changes = {}
+            for (lane_name, _, _), lane_inserted in zip(self.LANES, inserted):
+                started, left, entered = moves[lane_name]
+                ended, towed = ended_and_towed[lane_name]
+                self.changes[lane_name] = LaneChanges.between(
+                    previous[lane_name], getattr(self, lane_name), towed, ended, started, left,
+                    np.concatenate([entered, lane_inserted]))
+        if self.metrics is not None:
+            self.metrics.observe(self)
+        if self.jams is not None:
+            self.jams.observe(self)
+        timings.lap("observers")
     
-    def draw(self):
-        screen.blit(road_img, (0, 0))
+    def draw(self, rate_text=None):
+        """Dibujar la escena y devolver los rectángulos de pantalla que cambiaron.
+
+        rate_text, si se da, se muestra bajo los contadores (generaciones
+        por segundo reales y tiempo de cuadro).
+        """
+        timings = self.timings
+        timings.start()
+        items = []
         
         # Obtener tiempo para efectos visuales
         current_time = pygame.time.get_ticks()
@@ -438,27 +378,16 @@ class DoubleRoadTrafficSimulator:
                 x_pos = i * CELL_SIZE
                 y_pos = UPPER_LANE_1_Y + offset_y
                 
-                # Sombra debajo del auto
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                # Sombra
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_upper_1:
-                    # Efecto de humo para autos descompuestos
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car1_img, (x_pos, y_pos))
+                if self.broken_cars_upper_1[i] > 0:
+                    # Efecto de humo
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car1_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car1_img, (x_pos, y_pos))
+                    layers.append((car1_img, (x_pos, y_pos)))
+                items.append((("upper_1", i), layers))
         
         # Carril inferior
         for i in range(NUM_CELLS):
@@ -468,26 +397,15 @@ class DoubleRoadTrafficSimulator:
                 y_pos = LOWER_LANE_1_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_lower_1:
+                if self.broken_cars_lower_1[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(CELL_SIZE//2, CELL_SIZE)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car1_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos + CELL_SIZE//2, x_pos + CELL_SIZE), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car1_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car1_img, (x_pos, y_pos))
+                    layers.append((car1_img, (x_pos, y_pos)))
+                items.append((("lower_1", i), layers))
         
         # Dibujar autos en la segunda carretera (izquierda a derecha)
         # Carril superior
@@ -498,26 +416,15 @@ class DoubleRoadTrafficSimulator:
                 y_pos = UPPER_LANE_2_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_upper_2:
+                if self.broken_cars_upper_2[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car2_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos, x_pos + CELL_SIZE//2), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car2_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car2_img, (x_pos, y_pos))
+                    layers.append((car2_img, (x_pos, y_pos)))
+                items.append((("upper_2", i), layers))
         
         # Carril inferior
         for i in range(NUM_CELLS):
@@ -527,66 +434,55 @@ class DoubleRoadTrafficSimulator:
                 y_pos = LOWER_LANE_2_Y + offset_y
                 
                 # Sombra
-                shadow = pygame.Surface((CELL_SIZE - 10, 10))
-                shadow.fill((30, 30, 30))
-                shadow.set_alpha(100)
-                screen.blit(shadow, (x_pos + 5, y_pos + CELL_SIZE - 5))
+                layers = [(shadow_img, (x_pos + 5, y_pos + CELL_SIZE - 5))]
                 
-                if i in self.broken_cars_lower_2:
+                if self.broken_cars_lower_2[i] > 0:
                     # Efecto de humo
-                    for _ in range(3):
-                        smoke_x = x_pos + random.randint(0, CELL_SIZE//2)
-                        smoke_y = y_pos + random.randint(5, 15)
-                        smoke_size = random.randint(5, 10)
-                        smoke_alpha = random.randint(50, 150)
-                        smoke = pygame.Surface((smoke_size, smoke_size))
-                        smoke.fill(WHITE)
-                        smoke.set_alpha(smoke_alpha)
-                        screen.blit(smoke, (smoke_x, smoke_y))
-                    
-                    screen.blit(broken_car2_img, (x_pos, y_pos))
+                    layers += visor.smoke_layers(smoke_imgs, (x_pos, x_pos + CELL_SIZE//2), (y_pos + 5, y_pos + 15))
+                    layers.append((broken_car2_img, (x_pos, y_pos)))
                 else:
-                    screen.blit(car2_img, (x_pos, y_pos))
+                    layers.append((car2_img, (x_pos, y_pos)))
+                items.append((("lower_2", i), layers))
+        timings.lap("draw_cars")
         
         # Dibujar líneas de carril con efecto de movimiento
         if self.generation % 4 < 2:
-            lane_marker_color = (255, 255, 255)
+            lane_marker_img = lane_marker_imgs[0]
         else:
-            lane_marker_color = (220, 220, 220)
+            lane_marker_img = lane_marker_imgs[1]
         
         # Líneas divisorias en primera carretera
         center_y_1 = (UPPER_LANE_1_Y + LOWER_LANE_1_Y + CELL_SIZE) // 2
+        layers = []
         for i in range(NUM_CELLS):
             # En primera carretera el movimiento es de derecha a izquierda
             marker_offset_1 = (self.generation * 2) % CELL_SIZE
             marker_x_1 = i * CELL_SIZE + marker_offset_1
             if marker_x_1 >= 0 and marker_x_1 < WIDTH:
-                pygame.draw.rect(screen, lane_marker_color, (marker_x_1, center_y_1, CELL_SIZE//2, 5))
+                layers.append((lane_marker_img, (marker_x_1, center_y_1)))
+        items.append(("markers_1", layers))
         
         # Líneas divisorias en segunda carretera
         center_y_2 = (UPPER_LANE_2_Y + LOWER_LANE_2_Y + CELL_SIZE) // 2
+        layers = []
         for i in range(NUM_CELLS):
             # En segunda carretera el movimiento es de izquierda a derecha
             marker_offset_2 = (self.generation * 2) % CELL_SIZE
             marker_x_2 = i * CELL_SIZE - marker_offset_2
             if marker_x_2 >= 0 and marker_x_2 < WIDTH:
-                pygame.draw.rect(screen, lane_marker_color, (marker_x_2, center_y_2, CELL_SIZE//2, 5))
+                layers.append((lane_marker_img, (marker_x_2, center_y_2)))
+        items.append(("markers_2", layers))
+        timings.lap("draw_effects")
         
         # Dibujar contador de generaciones
-        gen_text = self.font.render(f"Generación: {self.generation}", True, BLACK)
-        text_bg = pygame.Surface((gen_text.get_width() + 10, gen_text.get_height() + 6))
-        text_bg.fill((220, 220, 220))
-        text_bg.set_alpha(180)
-        screen.blit(text_bg, (5, 2))
-        screen.blit(gen_text, (10, 5))
+        items.append(("generation", hud.label("generation", f"Generación: {self.generation}", (5, 2))))
+        
+        # Velocidad real de la simulación
+        if rate_text is not None:
+            items.append(("rate", hud.label("rate", rate_text, (5, 34))))
         
         # Dibujar modo de frontera
-        mode_text = self.font.render(f"Modo: {self.boundary_mode.capitalize()}", True, BLACK)
-        mode_bg = pygame.Surface((mode_text.get_width() + 10, mode_text.get_height() + 6))
-        mode_bg.fill((220, 220, 220))
-        mode_bg.set_alpha(180)
-        screen.blit(mode_bg, (WIDTH - mode_text.get_width() - 15, 2))
-        screen.blit(mode_text, (WIDTH - mode_text.get_width() - 10, 5))
+        items.append(("mode", hud.label("mode", f"Modo: {self.boundary_mode.capitalize()}", (WIDTH - 5, 2), "right")))
         
         # Instrucciones
         instructions = [
@@ -594,30 +490,30 @@ class DoubleRoadTrafficSimulator:
             "T: Toroide",
             "N: Frontera nula",
             "R: Reiniciar",
+            "P: Tiempos",
             f"Arriba/Abajo: Vel({self.simulation_speed})"
         ]
+        items.append(("instructions", hud.bar("instructions", instructions, (200, 2))))
+        
+        # Tiempos por fase (tecla P)
+        items += visor.timing_items(hud, timings, (5, 66), per_line=5)
+        timings.lap("draw_hud")
         
-        # Fondo para instrucciones
-        total_width = 0
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)
-            total_width += text.get_width() + 20
-        
-        instruction_bg = pygame.Surface((total_width, 30))
-        instruction_bg.fill((240, 240, 240))
-        instruction_bg.set_alpha(180)
-        screen.blit(instruction_bg, (200, 2))
-        
-        # Mostrar instrucciones
-        x_offset = 210
-        for instruction in instructions:
-            text = self.font.render(instruction, True, BLACK)
-            screen.blit(text, (x_offset, 8))
-            x_offset += text.get_width() + 20
+        # Fondo y autos en las zonas que cambiaron
+        dirty = renderer.render(items)
+        timings.lap("draw_render")
+        return dirty
 
 def main():
+    # python doble_carril.py --replay <grabación> reproduce una corrida grabada
+    if len(sys.argv) == 3 and sys.argv[1] == "--replay":
+        repeticion.replay(sys.argv[2], sys.modules[__name__], "DoubleRoadTrafficSimulator")
+        return
+    init_viewer()
     simulator = DoubleRoadTrafficSimulator(boundary_mode="toroid")
     clock = pygame.time.Clock()
+    pacer = visor.GenerationPacer()
+    timings = PhaseTimings(enabled=False)
     running = True
     paused = False
     
@@ -625,6 +521,8 @@ def main():
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                renderer.invalidate()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     paused = not paused
@@ -633,19 +531,26 @@ def main():
                 elif event.key == pygame.K_n:
                     simulator = DoubleRoadTrafficSimulator(boundary_mode="null")
                 elif event.key == pygame.K_r:
-                    simulator = DoubleRoadTrafficSimulator(simulator.boundary_mode)
+                    simulator = DoubleRoadTrafficSimulator(simulator.boundary_mode, simulator.engine)
+                elif event.key == pygame.K_p:
+                    # Mostrar u ocultar los tiempos por fase (y medirlos)
+                    timings.enabled = not timings.enabled
+                    timings.reset()
                 elif event.key == pygame.K_UP:
-                    simulator.simulation_speed = min(simulator.simulation_speed + 2, 30)
+                    simulator.simulation_speed = visor.speed_up(simulator.simulation_speed)
                 elif event.key == pygame.K_DOWN:
-                    simulator.simulation_speed = max(simulator.simulation_speed - 2, 1)
+                    simulator.simulation_speed = visor.slow_down(simulator.simulation_speed)
         
-        if not paused:
-            simulator.update()
+        # Las mediciones pasan al simulador nuevo al reiniciar
+        simulator.timings = timings
         
-        simulator.draw()
+        # Ejecutar las generaciones que tocan en este cuadro según la
+        # velocidad (generaciones por segundo), sin atarla a los cuadros
+        pacer.run(simulator.update, simulator.simulation_speed, paused)
         
-        pygame.display.flip()
-        clock.tick(simulator.simulation_speed)
+        # Enviar a la pantalla solo las zonas que cambiaron
+        pygame.display.update(simulator.draw(pacer.hud_text()))
+        clock.tick(visor.FRAME_RATE)
     
     pygame.quit()
 
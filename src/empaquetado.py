@@ -0,0 +1,192 @@
+import numpy as np
+
+from regla184 import RULE_184
+
+WORD_BITS = 64
+# Bytes que flatnonzero() desempaqueta a la vez
+UNPACK_CHUNK_BYTES = 1 << 16
+
+# Tabla para invertir el orden de los bits de cada byte
+_REVERSED_BYTES = np.array([int(f"{b:08b}"[::-1], 2) for b in range(256)], dtype=np.uint8)
+
+
+class PackedLane:
+    """Carril empaquetado: 64 celdas por palabra uint64.
+
+    La celda i vive en el bit i % 64 de la palabra i // 64. Los bits de
+    relleno de la última palabra se mantienen siempre en cero. Admite la
+    lectura y escritura de celdas sueltas (lane[i]) o por índices, sum() y
+    flatnonzero(), de modo que el resto de la lógica del simulador puede
+    usarlo igual que un arreglo.
+    """
+
+    def __init__(self, num_cells, words=None):
+        self.num_cells = num_cells
+        num_words = (num_cells + WORD_BITS - 1) // WORD_BITS
+        if words is None:
+            words = np.zeros(num_words, dtype=np.uint64)
+        self.words = words
+
+    @classmethod
+    def from_array(cls, lane):
+        """Empaquetar un carril denso (0 = vacío, 1 = auto)."""
+        lane = np.asarray(lane)
+        num_words = (len(lane) + WORD_BITS - 1) // WORD_BITS
+        packed = np.zeros(num_words * 8, dtype=np.uint8)
+        bits = np.packbits(lane.astype(bool), bitorder="little")
+        packed[:len(bits)] = bits
+        return cls(len(lane), packed.view("<u8").astype(np.uint64))
+
+    def to_array(self, dtype=int):
+        """Desempaquetar a un carril denso."""
+        bytes_ = self.words.astype("<u8").view(np.uint8)
+        return np.unpackbits(bytes_, count=self.num_cells, bitorder="little").astype(dtype)
+
+    def copy(self):
+        return PackedLane(self.num_cells, self.words.copy())
+
+    def __len__(self):
+        return self.num_cells
+
+    def _locate(self, i):
+        if i < 0:
+            i += self.num_cells
+        if not 0 <= i < self.num_cells:
+            raise IndexError("índice de celda fuera del carril")
+        return i // WORD_BITS, np.uint64(i % WORD_BITS)
+
+    def __getitem__(self, i):
+        if np.ndim(i) > 0:
+            # Máscara booleana o arreglo de índices: leer todas las celdas a la vez
+            cells = np.asarray(i)
+            if cells.dtype == bool:
+                cells = np.flatnonzero(cells)
+            cells = cells % self.num_cells
+            values = self.words[cells // WORD_BITS]
+            values >>= (cells % WORD_BITS).astype(np.uint64)
+            values &= np.uint64(1)
+            return values.astype(np.uint8)
+        word, bit = self._locate(i)
+        return int((self.words[word] >> bit) & np.uint64(1))
+
+    def __setitem__(self, i, value):
+        if np.ndim(i) > 0:
+            # Máscara booleana o arreglo de índices: escribir todas las celdas a la vez
+            cells = np.asarray(i)
+            if cells.dtype == bool:
+                cells = np.flatnonzero(cells)
+            cells = cells % self.num_cells
+            words = cells // WORD_BITS
+            bits = np.uint64(1) << (cells % WORD_BITS).astype(np.uint64)
+            if value:
+                np.bitwise_or.at(self.words, words, bits)
+            else:
+                np.bitwise_and.at(self.words, words, ~bits)
+            return
+        word, bit = self._locate(i)
+        if value:
+            self.words[word] |= np.uint64(1) << bit
+        else:
+            self.words[word] &= ~(np.uint64(1) << bit)
+
+    def flatnonzero(self):
+        """Índices de las celdas con auto, desempaquetando por bloques."""
+        bytes_ = self.words.astype("<u8").view(np.uint8)
+        cells = np.empty(self.sum(), dtype=np.intp)
+        filled = 0
+        for start in range(0, len(bytes_), UNPACK_CHUNK_BYTES):
+            bits = np.unpackbits(bytes_[start:start + UNPACK_CHUNK_BYTES], bitorder="little")
+            # Los bits de relleno siempre están en cero
+            chunk = np.flatnonzero(bits)
+            cells[filled:filled + len(chunk)] = chunk + 8 * start
+            filled += len(chunk)
+        return cells
+
+    def changed_cells(self, other):
+        """Índices de las celdas distintas de other, desempaquetando solo las palabras que difieren."""
+        diff = self.words ^ other.words
+        words = np.flatnonzero(diff)
+        bits = np.unpackbits(diff[words].astype("<u8").view(np.uint8), bitorder="little")
+        word_index, bit_index = np.nonzero(bits.reshape(len(words), WORD_BITS))
+        return words[word_index] * WORD_BITS + bit_index
+
+    def sum(self, *args, **kwargs):
+        """Número de autos en el carril (np.sum delega en este método)."""
+        if hasattr(np, "bitwise_count"):
+            return int(np.bitwise_count(self.words).sum())
+        return int(np.unpackbits(self.words.view(np.uint8)).sum())
+
+    def _valid_mask(self):
+        """Máscara de los bits válidos de la última palabra."""
+        tail = self.num_cells % WORD_BITS
+        if tail == 0:
+            return np.uint64(0xFFFFFFFFFFFFFFFF)
+        return np.uint64((1 << tail) - 1)
+
+    def _neighbours(self, boundary_mode):
+        """Palabras con el vecino anterior (i - 1) y siguiente (i + 1) de cada celda."""
+        one = np.uint64(1)
+        top = np.uint64(WORD_BITS - 1)
+        w = self.words
+        last = np.uint64((self.num_cells - 1) % WORD_BITS)
+
+        # Vecino anterior: desplazar hacia bits altos arrastrando el bit 63
+        # de la palabra previa
+        prev = w << one
+        prev[1:] |= w[:-1] >> top
+        # Vecino siguiente: desplazar hacia bits bajos arrastrando el bit 0
+        # de la palabra siguiente
+        nxt = w >> one
+        nxt[:-1] |= w[1:] << top
+
+        if boundary_mode == "toroid":
+            prev[0] |= (w[-1] >> last) & one
+            nxt[-1] |= (w[0] & one) << last
+        return prev, nxt
+
+    def moving_cars(self, boundary_mode="toroid", direction="left_to_right"):
+        """Autos con la celda de adelante libre, como regla184.moving_cars, sin desempaquetar."""
+        prev, nxt = self._neighbours(boundary_mode)
+        ahead = nxt if direction == "left_to_right" else prev
+        words = self.words & ~ahead
+        words[-1] &= self._valid_mask()
+        return PackedLane(self.num_cells, words)
+
+    def step(self, rule_output=RULE_184, boundary_mode="toroid", direction="left_to_right"):
+        """Avanzar una generación con operaciones palabra a palabra.
+
+        La regla se evalúa como la suma de los minitérminos de la tabla, de
+        modo que el resultado es idéntico al de regla184.apply_rule.
+        """
+        prev, nxt = self._neighbours(boundary_mode)
+        if direction == "left_to_right":
+            behind, ahead = prev, nxt
+        else:
+            behind, ahead = nxt, prev
+        center = self.words
+
+        new_words = np.zeros_like(center)
+        for pattern, output in enumerate(rule_output):
+            if not output:
+                continue
+            term = behind if pattern & 4 else ~behind
+            term = term & (center if pattern & 2 else ~center)
+            term &= ahead if pattern & 1 else ~ahead
+            new_words |= term
+
+        new_words[-1] &= self._valid_mask()
+        return PackedLane(self.num_cells, new_words)
+
+    def flipped(self):
+        """Carril con el orden de las celdas invertido."""
+        # Invertir el orden de las palabras y de los bits dentro de cada palabra
+        reversed_bytes = _REVERSED_BYTES[self.words[::-1].astype("<u8").view(np.uint8)]
+        words = reversed_bytes.reshape(-1, 8)[:, ::-1].copy().view("<u8").ravel().astype(np.uint64)
+
+        # El relleno quedó al inicio: recorrer todo el carril hacia los bits bajos
+        pad = np.uint64(len(words) * WORD_BITS - self.num_cells)
+        if pad:
+            shifted = words >> pad
+            shifted[:-1] |= words[1:] << (np.uint64(WORD_BITS) - pad)
+            words = shifted
+        return PackedLane(self.num_cells, words)
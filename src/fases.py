@@ -0,0 +1,189 @@
+import numpy as np
+
+# Fases vectorizadas de la actualización. Todas trabajan sobre carriles 1D o
+# sobre arreglos apilados (..., celdas), de modo que sirven tanto para un
+# simulador como para un conjunto de réplicas.
+
+# Reparto de decisiones de un auto bloqueado por uno descompuesto
+BLOCKED_WAIT_PROB = 0.2    # Decide esperar
+BLOCKED_CHANGE_PROB = 0.5  # Intenta cambiar de carril
+
+
+def spawn_streams(seed, names):
+    """Un generador independiente por carril o subsistema, todos de una semilla.
+
+    Devuelve la semilla usada y un diccionario nombre -> Generator. Los
+    flujos se derivan con SeedSequence.spawn y usan Philox (basado en
+    contador), así que cada uno es reproducible sin importar cuántos números
+    saquen los demás. Si seed es None se toma entropía del sistema y se
+    devuelve, de modo que cualquier corrida se puede repetir.
+    """
+    sequence = np.random.SeedSequence(seed)
+    children = sequence.spawn(len(names))
+    return sequence.entropy, {name: np.random.Generator(np.random.Philox(child))
+                              for name, child in zip(names, children)}
+
+
+def check_density(density):
+    """Rechazar densidades iniciales que no son una fracción de celdas."""
+    if not 0 <= density <= 1:
+        raise ValueError(f"la densidad debe estar entre 0 y 1, no {density}")
+
+
+def random_lane(rng, shape, density):
+    """Carril (o arreglo apilado) con cada celda ocupada con probabilidad density."""
+    check_density(density)
+    return (rng.random(shape) < density).astype(int)
+
+
+def tick_breakdowns(lane, broken, rng, repair_prob):
+    """Descontar una generación a los autos descompuestos.
+
+    broken guarda las generaciones restantes de cada celda (0 = auto sano).
+    Los autos que agotan su cuenta se reparan con probabilidad repair_prob
+    y, si no, son remolcados (la celda queda vacía). Modifica lane y broken
+    en su lugar y devuelve los índices planos de las averías que terminaron
+    y, de ellas, las de los autos remolcados.
+    """
+    active = broken > 0
+    expiring = active & (broken <= 1)
+    ended = np.flatnonzero(expiring)
+    towed = np.zeros_like(expiring)
+    towed[expiring] = rng.random(len(ended)) >= repair_prob
+    lane[towed] = 0
+    broken[active] -= 1
+    return ended, np.flatnonzero(towed)
+
+
+def occupied_cells(lane):
+    """Índices planos de las celdas con auto (PackedLane no se desempaqueta completo)."""
+    if hasattr(lane, "flatnonzero"):
+        return lane.flatnonzero()
+    return np.flatnonzero(lane)
+
+
+def _cell_values(lane, cells):
+    """Estado de las celdas dadas por índices planos."""
+    if hasattr(lane, "flatnonzero"):
+        return lane[cells]
+    return np.asarray(lane).reshape(-1)[cells]
+
+
+def lane_change_cells(new_lane, other_lane, broken, rng, change_prob, breakdown_prob,
+                      direction="left_to_right", beyond=0):
+    """Decidir a la vez los cambios de carril y las nuevas averías de un carril.
+
+    Devuelve dos arreglos de índices planos: autos que pasan al otro carril
+    y autos que se descomponen. Un auto bloqueado por uno descompuesto (en
+    la celda de adelante, sin dar la vuelta en los extremos) espera (20%) o
+    intenta cambiar de carril (50%); uno libre cambia de carril con
+    change_prob y, si no cambia, se descompone con breakdown_prob. Solo se
+    sacan números aleatorios para los autos sanos, así que la memoria
+    temporal depende del número de autos y no del largo del carril; los
+    carriles pueden ser PackedLane. beyond es la cuenta de averías de la
+    celda que sigue a la última, cuando broken es solo un tramo del carril.
+    """
+    flat_broken = broken.reshape(-1)
+    cells = occupied_cells(new_lane)
+    cells = cells[flat_broken[cells] == 0]
+
+    # ¿Hay un auto descompuesto adelante? En el borde de cada fila se usa beyond
+    width = broken.shape[-1]
+    step, edge_column = (1, width - 1) if direction == "left_to_right" else (-1, 0)
+    edge = np.flatnonzero(cells % width == edge_column)
+    ahead = cells + step
+    ahead[edge] = cells[edge]
+    blocked = flat_broken[ahead] > 0
+    del ahead
+    beyond = np.broadcast_to(np.asarray(beyond) > 0, broken.shape[:-1]).reshape(-1)
+    blocked[edge] = beyond[cells[edge] // width]
+
+    change = _cell_values(other_lane, cells) == 0
+    decision = rng.random(len(cells))
+    change &= np.where(blocked,
+                       (decision >= BLOCKED_WAIT_PROB)
+                       & (decision < BLOCKED_WAIT_PROB + BLOCKED_CHANGE_PROB),
+                       decision < change_prob)
+    del decision
+    breakdown = ~blocked & ~change & (rng.random(len(cells)) < breakdown_prob)
+    return cells[change], cells[breakdown]
+
+
+def lane_change_decisions(new_lane, other_lane, broken, rng, change_prob, breakdown_prob,
+                          direction="left_to_right", beyond=0):
+    """lane_change_cells como dos máscaras del tamaño del carril (para arreglos apilados)."""
+    change, breakdown = lane_change_cells(new_lane, other_lane, broken, rng, change_prob,
+                                          breakdown_prob, direction, beyond)
+    masks = np.zeros((2, broken.size), dtype=bool)
+    masks[0, change] = True
+    masks[1, breakdown] = True
+    return masks[0].reshape(broken.shape), masks[1].reshape(broken.shape)
+
+
+def apply_lane_changes(lane_a, lane_b, a_to_b, b_to_a):
+    """Mover los autos marcados (máscaras o índices) de un carril al otro, en la misma celda.
+
+    Un cambio solo se decide si la celda destino está libre, así que dos
+    autos nunca cambian hacia la misma celda; aun así el orden es fijo
+    (primero de a a b, luego de b a a) para que el resultado sea determinista.
+    """
+    lane_a[a_to_b] = 0
+    lane_b[a_to_b] = 1
+    lane_b[b_to_a] = 0
+    lane_a[b_to_a] = 1
+
+
+def insert_cars(lane_a, lane_b, rng, insertion_prob, entry, max_density=0.3):
+    """Insertar un auto en la celda de entrada de un par de carriles (frontera nula).
+
+    Con probabilidad insertion_prob, y solo si la densidad de ambos carriles
+    es menor a max_density, se inserta en el carril con menos autos que
+    tenga libre la celda de entrada.
+    """
+    attempt = rng.random(lane_a.shape[:-1]) < insertion_prob
+    count_a = lane_a.sum(axis=-1)
+    count_b = lane_b.sum(axis=-1)
+    current_density = (count_a + count_b) / (lane_a.shape[-1] * 2)
+    attempt &= current_density < max_density
+
+    a_free = lane_a[..., entry] == 0
+    b_free = lane_b[..., entry] == 0
+    to_a = attempt & a_free & (~b_free | (count_a <= count_b))
+    to_b = attempt & b_free & ~to_a
+    lane_a[..., entry] = np.where(to_a, 1, lane_a[..., entry])
+    lane_b[..., entry] = np.where(to_b, 1, lane_b[..., entry])
+
+
+def pin_broken_cars(lane, broken):
+    """Asegurar que los autos descompuestos permanezcan en su lugar."""
+    lane[broken > 0] = 1
+
+
+def enforce_car_limit(lanes, broken_lanes, max_cars, rng):
+    """Retirar al azar los autos que excedan max_cars en un grupo de carriles.
+
+    Las víctimas se eligen de una sola vez, sin reemplazo y con la misma
+    probabilidad, entre los autos sanos de todos los carriles del grupo:
+    los descompuestos nunca se retiran (los quita la grúa al agotar su
+    cuenta), así que si solo quedan descompuestos el grupo puede quedar
+    por encima del límite. Modifica los carriles en su lugar y devuelve el
+    número de autos que quedan y, por carril, los índices de los retirados.
+    """
+    total_cars = sum(int(np.count_nonzero(lane)) for lane in lanes)
+    if total_cars <= max_cars:
+        return total_cars, [np.zeros(0, dtype=np.intp) for _ in lanes]
+
+    # Autos que pueden retirarse en cada carril, elegidos de una sola vez
+    # sobre la lista de todos los carriles
+    candidates = [np.flatnonzero((lane == 1) & (broken == 0)) for lane, broken in zip(lanes, broken_lanes)]
+    sizes = [len(cells) for cells in candidates]
+    count = min(total_cars - max_cars, sum(sizes))
+    victims = np.sort(rng.choice(sum(sizes), size=count, replace=False))
+    bounds = np.searchsorted(victims, np.cumsum(sizes))
+    start = 0
+    removed = []
+    for lane, cells, offset, end in zip(lanes, candidates, np.cumsum([0] + sizes), bounds):
+        removed.append(cells[victims[start:end] - offset])
+        lane[removed[-1]] = 0
+        start = end
+    return total_cars - count, removed
@@ -0,0 +1,179 @@
+import numpy as np
+
+# Generaciones que guarda el búfer circular de métricas
+HISTORY_SIZE = 4096
+
+# Registro de una generación en el búfer
+SAMPLE_DTYPE = np.dtype([
+    ("generation", np.int64),
+    ("cars", np.int32),        # Autos en todos los carriles
+    ("flow", np.int32),        # Autos que avanzaron en el paso de la regla
+    ("density", np.float64),   # Autos por celda
+    ("mean_speed", np.float64),  # Celdas por auto y generación
+    ("stopped", np.int32),     # Autos que no se movieron
+    ("broken", np.int32),      # Autos descompuestos
+])
+
+
+def _values(lane, cells):
+    """¿Hay auto en cada una de las celdas dadas? (PackedLane lee solo esas celdas)."""
+    if len(cells) == 0:
+        return np.zeros(0, dtype=bool)
+    return np.asarray(lane[cells]) > 0
+
+
+def _moves(lane, broken, changes, boundary_mode, direction):
+    """Autos que avanzaron una celda en el paso de la regla: celdas de las que salieron y a las que llegaron.
+
+    Solo se miran las celdas que tocó la generación. Antes de la regla el
+    estado es el de la generación anterior sin los autos remolcados;
+    después, el actual sin los autos que llegaron de otro carril o por
+    inserción y con los que se fueron a otro carril, giraron o se
+    retiraron. Un auto avanzó si su celda se vació y la de adelante se
+    ocupó, salvo que siga descompuesto desde antes (la regla lo copió
+    adelante pero pin_broken_cars lo dejó en su lugar). Los que salen por la
+    frontera nula se cuentan aparte.
+    """
+    touched = changes.touched()
+    now = _values(lane, touched)
+    before = now ^ np.isin(touched, changes.changed, assume_unique=True)
+    before &= ~np.isin(touched, changes.towed, assume_unique=True)
+    after = now & ~np.isin(touched, changes.entered, assume_unique=True)
+    after |= np.isin(touched, changes.left, assume_unique=True)
+    departures = touched[before & ~after]
+    pinned = (broken[departures] > 0) & ~np.isin(departures, changes.broken, assume_unique=True)
+    departures = departures[~pinned]
+    arrivals = touched[after & ~before]
+
+    targets = departures + (1 if direction == "left_to_right" else -1)
+    if boundary_mode == "toroid":
+        targets %= len(lane)
+    moved = np.isin(targets, arrivals, assume_unique=True)
+    return departures[moved], targets[moved]
+
+
+def cross_detectors(simulator):
+    """Un detector en la celda central del cruce de cada carril de cruce.py."""
+    detectors = {}
+    for name, _, _ in simulator.LANES:
+        vertical = name.endswith(("_3", "_4"))
+        detectors[name] = [simulator.cross_index_v if vertical else simulator.cross_index_h]
+    return detectors
+
+
+class TrafficMetrics:
+    """Métricas de tráfico por generación.
+
+    Se llevan totales de autos y de averías que se actualizan con los
+    cambios que el simulador deja en self.changes (un cambios.LaneChanges
+    por carril), así que cada generación cuesta lo que las celdas que
+    cambiaron y PackedLane nunca se desempaqueta. El flujo son los autos
+    que avanzaron de verdad en el paso de la regla (ver _moves) más los
+    que salieron por la frontera nula; los cambios de carril, inserciones,
+    giros y remolques no cuentan, y un auto descompuesto no avanza aunque
+    la regla lo haya copiado adelante. Un detector cuenta un auto cuando
+    uno avanza de la celda de atrás hacia él. Cada generación se guarda en
+    un búfer circular (recent()) y, si se da callback, se le entrega como
+    diccionario.
+    """
+
+    def __init__(self, simulator, detectors=None, capacity=HISTORY_SIZE, callback=None):
+        """detectors asocia el nombre de un carril con las celdas a vigilar."""
+        self.lanes = [(name, broken_name, direction) for name, broken_name, direction in simulator.LANES]
+        self.boundary_mode = simulator.boundary_mode
+        self.callback = callback
+        self.num_cells = sum(len(getattr(simulator, name)) for name, _, _ in self.lanes)
+
+        # Detectores: (carril, celda) y autos que han llegado a cada uno
+        self.detectors = [(name, cell) for name, cells in (detectors or {}).items() for cell in cells]
+        self.detector_counts = np.zeros(len(self.detectors), dtype=np.int64)
+
+        # Totales iniciales: la única vez que se cuentan los carriles completos
+        self.cars = sum(int(np.sum(getattr(simulator, name))) for name, _, _ in self.lanes)
+        self.broken = sum(int(np.count_nonzero(getattr(simulator, broken_name)))
+                          for _, broken_name, _ in self.lanes)
+
+        # En frontera nula, la celda de salida de cada carril y, antes de
+        # cada generación, si hay auto en ella y su cuenta de avería
+        self._broken_names = {name: broken_name for name, broken_name, _ in self.lanes}
+        self._exits = {}
+        if self.boundary_mode != "toroid":
+            self._exits = {name: len(getattr(simulator, name)) - 1 if direction == "left_to_right" else 0
+                           for name, _, direction in self.lanes}
+        self._exit_states = self._exit_cars(simulator)
+
+        self.capacity = capacity
+        self.history = np.zeros(capacity, dtype=SAMPLE_DTYPE)
+        self.detector_history = np.zeros((capacity, len(self.detectors)), dtype=np.uint8)
+        self.samples = 0  # Generaciones observadas
+
+    @classmethod
+    def attach(cls, simulator, detectors=None, capacity=HISTORY_SIZE, callback=None):
+        """Crear las métricas y conectarlas: el update() del simulador las alimenta."""
+        if detectors is None and hasattr(simulator, "cross_index_h"):
+            detectors = cross_detectors(simulator)
+        simulator.metrics = cls(simulator, detectors, capacity, callback)
+        return simulator.metrics
+
+    def _exit_cars(self, simulator):
+        """Estado de la celda de salida de cada carril: (¿hay auto?, cuenta de avería)."""
+        return {name: (getattr(simulator, name)[cell], int(getattr(simulator, self._broken_names[name])[cell]))
+                for name, cell in self._exits.items()}
+
+    def observe(self, simulator):
+        """Registrar la generación que el simulador acaba de calcular."""
+        cars_before = self.cars
+        flow = 0
+        arrivals = {}
+        for name, broken_name, direction in self.lanes:
+            lane = getattr(simulator, name)
+            changes = simulator.changes[name]
+            self.cars += 2 * int(np.count_nonzero(_values(lane, changes.changed))) - len(changes.changed)
+            broken = getattr(simulator, broken_name)
+            self.broken += 2 * int(np.count_nonzero(broken[changes.broken] > 0)) - len(changes.broken)
+
+            _, arrivals[name] = _moves(lane, broken, changes, self.boundary_mode, direction)
+            flow += len(arrivals[name])
+            if name in self._exits:
+                # Sale el auto que estaba en la última celda, salvo que siga
+                # descompuesto o se lo haya llevado la grúa
+                occupied, countdown = self._exit_states[name]
+                cell = self._exits[name]
+                if occupied and countdown <= 1 and not np.isin(cell, changes.towed):
+                    flow += 1
+        self._exit_states = self._exit_cars(simulator)
+
+        detections = np.array([np.isin(cell, arrivals[name]) for name, cell in self.detectors], dtype=np.uint8)
+        self.detector_counts += detections
+
+        row = self.samples % self.capacity
+        sample = self.history[row]
+        sample["generation"] = simulator.generation
+        sample["cars"] = self.cars
+        sample["flow"] = flow
+        sample["density"] = self.cars / self.num_cells
+        sample["mean_speed"] = flow / cars_before if cars_before else 0.0
+        sample["stopped"] = cars_before - flow
+        sample["broken"] = self.broken
+        self.detector_history[row] = detections
+        self.samples += 1
+
+        if self.callback is not None:
+            self.callback(self.latest())
+
+    def latest(self):
+        """Última generación registrada como diccionario (None si aún no hay)."""
+        if self.samples == 0:
+            return None
+        row = (self.samples - 1) % self.capacity
+        sample = {field: self.history[row][field].item() for field in SAMPLE_DTYPE.names}
+        sample["detectors"] = {f"{name}[{cell}]": int(hit)
+                               for (name, cell), hit in zip(self.detectors, self.detector_history[row])}
+        return sample
+
+    def recent(self, count=None):
+        """Las últimas count generaciones del búfer, de la más antigua a la más nueva."""
+        stored = min(self.samples, self.capacity)
+        count = stored if count is None else min(count, stored)
+        rows = np.arange(self.samples - count, self.samples) % self.capacity
+        return self.history[rows]
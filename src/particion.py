@@ -0,0 +1,406 @@
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import carril
+from cambios import LaneChanges
+from fases import (apply_lane_changes, check_density, lane_change_cells, pin_broken_cars,
+                   spawn_streams, tick_breakdowns)
+from regla184 import apply_rule
+from tiempos import PhaseTimings
+
+# Celdas que se inicializan por bloque (para no crear temporales del tamaño
+# de todo el carril)
+INIT_CHUNK = 1 << 22
+
+# Columnas del arreglo de intercambio, una fila por fragmento
+DELTA = 0  # Cambio en el número de autos por la regla (una columna por carril)
+COUNT = 2  # Autos tras los cambios de carril (una columna por carril)
+EDGE = 4   # Último fragmento: última celda antes y después de la regla (dos columnas por carril)
+EXCHANGE_COLUMNS = 8
+
+
+def _shard_bounds(num_cells, num_shards):
+    """Primera celda de cada fragmento y, al final, num_cells."""
+    return (np.arange(num_shards + 1) * num_cells) // num_shards
+
+
+def _block_sizes(num_cells, num_shards):
+    """Bytes de cada bloque de memoria compartida."""
+    return {"upper_lane": num_cells, "lower_lane": num_cells,
+            "broken_cars_upper": 2 * num_cells, "broken_cars_lower": 2 * num_cells,
+            "exchange": 8 * EXCHANGE_COLUMNS * num_shards}
+
+
+def _views(blocks, num_cells, num_shards):
+    """Ver los bloques de memoria compartida como arreglos."""
+    return {
+        "upper_lane": np.ndarray(num_cells, np.uint8, blocks["upper_lane"].buf),
+        "lower_lane": np.ndarray(num_cells, np.uint8, blocks["lower_lane"].buf),
+        "broken_cars_upper": np.ndarray(num_cells, np.int16, blocks["broken_cars_upper"].buf),
+        "broken_cars_lower": np.ndarray(num_cells, np.int16, blocks["broken_cars_lower"].buf),
+        "exchange": np.ndarray((num_shards, EXCHANGE_COLUMNS), np.int64, blocks["exchange"].buf),
+    }
+
+
+def _shard_worker(index, bounds, names, boundary_mode, params, streams, insertion, barrier, connection):
+    """Proceso dueño de un fragmento: avanza sus celdas cuando el principal lo pide.
+
+    Los carriles completos están en memoria compartida; el fragmento solo
+    escribe sus celdas y lee de las vecinas la celda de cada borde (el halo)
+    después de una barrera.
+    """
+    num_cells = int(bounds[-1])
+    num_shards = len(bounds) - 1
+    start, end = int(bounds[index]), int(bounds[index + 1])
+    last = num_shards - 1
+    toroid = boundary_mode == "toroid"
+    blocks = {name: shared_memory.SharedMemory(name=block_name) for name, block_name in names.items()}
+    arrays = _views(blocks, num_cells, num_shards)
+    lanes = (arrays["upper_lane"], arrays["lower_lane"])
+    brokens = (arrays["broken_cars_upper"], arrays["broken_cars_lower"])
+    exchange = arrays["exchange"]
+    padded = np.zeros(end - start + 2, dtype=np.uint8)
+
+    def step(report):
+        """Avanzar una generación; con report, devolver los cambios del fragmento por carril."""
+        local = [lane[start:end] for lane in lanes]
+        local_broken = [broken[start:end] for broken in brokens]
+
+        # Procesar primero los autos descompuestos
+        ended_and_towed = [tick_breakdowns(lane, broken, rng, params["repair_prob"])
+                           for lane, broken, rng in zip(local, local_broken, streams)]
+        # Para reportar los cambios hace falta el estado anterior del fragmento
+        previous = [lane.copy() for lane in local] if report else None
+        barrier.wait()
+
+        # Regla con una celda de halo de cada lado; el carril extendido
+        # tiene frontera nula porque el halo ya trae los vecinos
+        new = []
+        beyond = []
+        for k, lane in enumerate(lanes):
+            padded[1:-1] = local[k]
+            padded[0] = lane[start - 1] if start > 0 or toroid else 0
+            padded[-1] = lane[end % num_cells] if end < num_cells or toroid else 0
+            new_lane = apply_rule(padded, carril.RULE_OUTPUT, "null")[1:-1]
+            new.append(new_lane)
+            exchange[index, DELTA + k] = np.count_nonzero(new_lane) - np.count_nonzero(local[k])
+            if index == last:
+                exchange[index, EDGE + 2 * k] = local[k][-1]
+                exchange[index, EDGE + 2 * k + 1] = new_lane[-1]
+            # La comprobación de averías adelante no da la vuelta
+            beyond.append(brokens[k][end] if end < num_cells else 0)
+        barrier.wait()
+
+        # En toroide, reinsertar al inicio el coche que desaparece por la
+        # derecha, igual que TrafficSimulator.apply_rule_184
+        if toroid and index == 0:
+            for k in range(2):
+                if (exchange[:, DELTA + k].sum() != 0 and exchange[last, EDGE + 2 * k] == 1
+                        and exchange[last, EDGE + 2 * k + 1] == 0 and new[k][0] == 0):
+                    new[k][0] = 1
+
+        # Cambios de carril y averías: todo dentro del fragmento
+        upper_to_lower, new_breakdowns_upper = lane_change_cells(
+            new[0], new[1], local_broken[0], streams[0],
+            params["change_prob"], params["breakdown_prob"], beyond=beyond[0])
+        lower_to_upper, new_breakdowns_lower = lane_change_cells(
+            new[1], new[0], local_broken[1], streams[1],
+            params["change_prob"], params["breakdown_prob"], beyond=beyond[1])
+        apply_lane_changes(new[0], new[1], upper_to_lower, lower_to_upper)
+        local_broken[0][new_breakdowns_upper] = params["repair_attempts"]
+        local_broken[1][new_breakdowns_lower] = params["repair_attempts"]
+        # Todos leyeron ya sus halos: se puede escribir el estado nuevo
+        for k in range(2):
+            local[k][:] = new[k]
+            exchange[index, COUNT + k] = np.count_nonzero(new[k])
+
+        entry = (local[0][0], local[1][0])
+        if boundary_mode == "null":
+            # La inserción necesita los autos de todo el carril
+            barrier.wait()
+            if index == 0 and insertion.random() < params["insertion_prob"]:
+                upper, lower = local
+                upper_count, lower_count = exchange[:, COUNT].sum(), exchange[:, COUNT + 1].sum()
+                # Solo insertar si la densidad es menor al 30%
+                if (upper_count + lower_count) / (num_cells * 2) < 0.3:
+                    if upper[0] == 0 and lower[0] == 0:
+                        if upper_count <= lower_count:
+                            upper[0] = 1
+                        else:
+                            lower[0] = 1
+                    elif upper[0] == 0:
+                        upper[0] = 1
+                    elif lower[0] == 0:
+                        lower[0] = 1
+        inserted = [[0] if lane[0] and not before else [] for lane, before in zip(local, entry)]
+
+        # Asegurarnos que los autos descompuestos permanezcan en su lugar
+        pin_broken_cars(local[0], local_broken[0])
+        pin_broken_cars(local[1], local_broken[1])
+
+        if not report:
+            return None
+        moves = ((new_breakdowns_upper, upper_to_lower, lower_to_upper),
+                 (new_breakdowns_lower, lower_to_upper, upper_to_lower))
+        changes = []
+        for k, (started, left, entered) in enumerate(moves):
+            ended, towed = ended_and_towed[k]
+            changes.append(LaneChanges.between(previous[k], local[k], towed, ended, started, left,
+                                               np.concatenate([entered, inserted[k]])))
+        return changes
+
+    try:
+        while True:
+            command, count, report = connection.recv()
+            if command == "stop":
+                break
+            try:
+                changes = None
+                for _ in range(count):
+                    changes = step(report)
+                connection.send(("done", changes))
+            except Exception:
+                # Liberar a los demás fragmentos si alguno espera en la barrera
+                barrier.abort()
+                connection.send(("error", traceback.format_exc()))
+    finally:
+        del lanes, brokens, exchange, arrays
+        for block in blocks.values():
+            block.close()
+
+
+def _release(processes, connections, blocks):
+    """Detener los procesos y liberar la memoria compartida."""
+    for connection in connections:
+        try:
+            connection.send(("stop", 0, False))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for block in blocks.values():
+        try:
+            block.close()
+        except BufferError:
+            # Alguien conserva una vista del bloque; se libera al soltarla
+            pass
+        block.unlink()
+
+
+class ShardedTrafficSimulator:
+    """Un TrafficSimulator de carril muy largo repartido en fragmentos contiguos.
+
+    Los dos carriles y sus averías viven en memoria compartida y cada
+    fragmento de celdas lo avanza un proceso propio. Como la regla solo mira
+    a un vecino de cada lado, en cada generación un fragmento necesita una
+    sola celda de cada fragmento vecino (el halo), que lee de la memoria
+    compartida entre barreras; los cambios de carril ocurren en la misma
+    celda, así que no salen del fragmento. Lo único global es la
+    reinserción del coche perdido en toroide y la densidad que decide las
+    inserciones en frontera nula, que se reducen a una fila de contadores
+    por fragmento.
+
+    La dinámica es la de carril.TrafficSimulator (con sus constantes al
+    momento de crear el simulador). Cada fragmento saca sus números
+    aleatorios de su propio generador, así que la corrida se repite con la
+    misma semilla y el mismo número de fragmentos; con un solo fragmento
+    coincide con TrafficSimulator(seed=seed) celda por celda.
+
+    Los carriles (self.upper_lane, ...) son vistas de la memoria
+    compartida: entre generaciones se pueden leer o pasar a TrafficMetrics,
+    JamTracker o los grabadores. Hay que llamar a close() (o usar el
+    simulador en un bloque with) para detener los procesos.
+    """
+
+    LANES = carril.TrafficSimulator.LANES
+
+    def __init__(self, num_cells=None, num_shards=None, boundary_mode="toroid", density=None, seed=None):
+        self.num_cells = carril.NUM_CELLS if num_cells is None else int(num_cells)
+        self.num_shards = min(num_shards or os.cpu_count() or 1, self.num_cells)
+        self.boundary_mode = boundary_mode  # "toroid" o "null"
+        self.bounds = _shard_bounds(self.num_cells, self.num_shards)
+
+        # Los mismos flujos que TrafficSimulator; con varios fragmentos el de
+        # cada carril se divide en uno por fragmento
+        self.seed, self.streams = spawn_streams(
+            seed, ("init", "insertion") + tuple(lane_name for lane_name, _, _ in self.LANES))
+        if self.num_shards == 1:
+            shard_streams = [(self.streams["upper_lane"], self.streams["lower_lane"])]
+        else:
+            shard_streams = list(zip(self.streams["upper_lane"].spawn(self.num_shards),
+                                     self.streams["lower_lane"].spawn(self.num_shards)))
+
+        # Un bloque de memoria compartida por arreglo
+        self._blocks = {}
+        self._processes = []
+        self._connections = []
+        self._finalizer = weakref.finalize(self, _release, self._processes, self._connections, self._blocks)
+        for name, size in _block_sizes(self.num_cells, self.num_shards).items():
+            self._blocks[name] = shared_memory.SharedMemory(create=True, size=size)
+        arrays = _views(self._blocks, self.num_cells, self.num_shards)
+        self.upper_lane = arrays["upper_lane"]
+        self.lower_lane = arrays["lower_lane"]
+        self.broken_cars_upper = arrays["broken_cars_upper"]
+        self.broken_cars_lower = arrays["broken_cars_lower"]
+        self.broken_cars_upper[:] = 0
+        self.broken_cars_lower[:] = 0
+        self._initialize(density)
+
+        # Constantes de carril, fijadas al crear el simulador (los procesos
+        # nuevos no ven los cambios hechos al módulo en este)
+        params = {"change_prob": carril.CAR_CHANGE_LANE_PROB, "breakdown_prob": carril.CAR_BREAKDOWN_PROB,
+                  "insertion_prob": carril.CAR_INSERTION_PROB, "repair_attempts": carril.REPAIR_ATTEMPTS,
+                  "repair_prob": carril.REPAIR_PROB}
+        names = {name: block.name for name, block in self._blocks.items()}
+        barrier = multiprocessing.Barrier(self.num_shards)
+        for index in range(self.num_shards):
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_shard_worker, daemon=True,
+                args=(index, self.bounds, names, boundary_mode, params, shard_streams[index],
+                      self.streams["insertion"] if index == 0 else None, barrier, child_end))
+            process.start()
+            self._processes.append(process)
+            self._connections.append(parent_end)
+
+        self.generation = 0
+
+        # Métricas por generación y atascos por carril (las conectan
+        # metricas.TrafficMetrics.attach y atascos.JamTracker.attach). Con
+        # alguno conectado, update() deja en self.changes un
+        # cambios.LaneChanges por carril para que se actualicen
+        self.metrics = None
+        self.jams = None
+        self.changes = None
+
+        # Tiempo de cada fase de update(), apagado hasta que se active
+        self.timings = PhaseTimings(enabled=False)
+
+    def _initialize(self, density):
+        """Misma distribución inicial que TrafficSimulator, por bloques.
+
+        Con density, cada celda ocupada con esa probabilidad; sin ella, autos
+        espaciados uniformemente con un desfase aleatorio y después cada
+        celda invertida con 10% de probabilidad. Los bloques sacan los mismos
+        números que una sola llamada sobre todo el carril.
+        """
+        init_rng = self.streams["init"]
+        if density is not None:
+            check_density(density)
+            for lane in (self.upper_lane, self.lower_lane):
+                for start in range(0, self.num_cells, INIT_CHUNK):
+                    chunk = lane[start:start + INIT_CHUNK]
+                    chunk[:] = init_rng.random(len(chunk)) < density
+            return
+        spacing = int(1/carril.SPACED_DENSITY)
+        offset = int(init_rng.integers(0, spacing))
+        lower_offset = (offset + spacing//2) % spacing
+        for start in range(0, self.num_cells, INIT_CHUNK):
+            cells = np.arange(start, min(start + INIT_CHUNK, self.num_cells))
+            self.upper_lane[cells] = (cells + offset) % spacing == 0
+            self.lower_lane[cells] = (cells + lower_offset) % spacing == 0
+        for lane in (self.upper_lane, self.lower_lane):
+            for start in range(0, self.num_cells, INIT_CHUNK):
+                chunk = lane[start:start + INIT_CHUNK]
+                chunk ^= init_rng.random(len(chunk)) < 0.1
+
+    def run(self, n_generations):
+        """Avanzar n_generations en los procesos sin volver entre generaciones.
+
+        Con observadores conectados se avanza de una en una para que vean
+        cada generación.
+        """
+        if self.metrics is not None or self.jams is not None:
+            for _ in range(n_generations):
+                self.update()
+            return
+        self._advance(n_generations)
+
+    def _advance(self, n_generations, report=False):
+        """Avanzar en todos los fragmentos; con report, devolver los cambios de cada uno."""
+        if not self._finalizer.alive:
+            raise RuntimeError("el simulador ya se cerró")
+        for connection in self._connections:
+            connection.send(("run", n_generations, report))
+        errors = []
+        replies = []
+        for connection in self._connections:
+            status, message = connection.recv()
+            if status == "error":
+                errors.append(message)
+            replies.append(message)
+        self.generation += n_generations
+        if errors:
+            raise RuntimeError("falló un fragmento:\n" + errors[0])
+        return replies
+
+    def update(self):
+        timings = self.timings
+        timings.start()
+        observed = self.metrics is not None or self.jams is not None
+        replies = self._advance(1, observed)
+        timings.lap("shards")
+
+        if observed:
+            # Cada fragmento reporta sus cambios con índices relativos a su primera celda
+            self.changes = {lane_name: LaneChanges.concatenate([reply[k] for reply in replies], self.bounds[:-1])
+                            for k, (lane_name, _, _) in enumerate(self.LANES)}
+
+        if self.metrics is not None:
+            self.metrics.observe(self)
+        if self.jams is not None:
+            self.jams.observe(self)
+        timings.lap("observers")
+
+    def close(self):
+        """Detener los procesos y liberar la memoria compartida.
+
+        Los carriles dejan de estar disponibles: hay que copiar antes lo que
+        se quiera conservar.
+        """
+        # Soltar las vistas para poder cerrar los bloques
+        self.upper_lane = self.lower_lane = None
+        self.broken_cars_upper = self.broken_cars_lower = None
+        self._finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Avanzar un carril muy largo repartido en varios procesos.")
+    parser.add_argument("--cells", type=float, default=1e8, help="celdas por carril")
+    parser.add_argument("--shards", type=int, default=None, help="fragmentos (por defecto, uno por núcleo)")
+    parser.add_argument("--generations", type=int, default=100)
+    parser.add_argument("--mode", choices=("toroid", "null"), default="toroid")
+    parser.add_argument("--density", type=float, default=None,
+                        help="ocupación inicial (por defecto, el patrón espaciado de carril)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    with ShardedTrafficSimulator(int(args.cells), args.shards, args.mode, args.density, args.seed) as simulator:
+        ready = time.perf_counter()
+        simulator.run(args.generations)
+        elapsed = time.perf_counter() - ready
+        cars = np.count_nonzero(simulator.upper_lane) + np.count_nonzero(simulator.lower_lane)
+    print(f"{simulator.num_cells} celdas x 2 carriles en {simulator.num_shards} fragmentos "
+          f"(preparación {ready - started:.1f} s)")
+    print(f"{args.generations} generaciones en {elapsed:.2f} s: {args.generations / elapsed:.1f} gen/s, "
+          f"{2 * simulator.num_cells * args.generations / elapsed / 1e6:.0f} M celdas/s, {cars} autos")
+
+
+if __name__ == "__main__":
+    main()
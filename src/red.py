@@ -0,0 +1,373 @@
+import numpy as np
+
+from fases import spawn_streams, tick_breakdowns
+from regla184 import RULE_184
+from tiempos import PhaseTimings
+
+# Probabilidades (las mismas del simulador de cruce)
+CAR_BREAKDOWN_PROB = 0.02
+CAR_INSERTION_PROB = 0.05
+CAR_TURN_PROB = 0.2
+REPAIR_ATTEMPTS = 20
+REPAIR_PROB = 0.5
+
+# Motor automático: lista de autos por debajo de esta densidad y celdas
+# completas por encima del doble (el margen evita cambiar a cada rato)
+SPARSE_DENSITY = 0.1
+
+
+class TrafficNetworkSimulator:
+    """Red de carriles unidos por cruces, avanzada en un solo paso vectorizado.
+
+    Los carriles son las aristas de la red y los cruces sus nodos: un cruce
+    marca una celda en cada carril que pasa por él, y los giros dicen con
+    qué probabilidad un auto en la celda de un carril pasa a la celda de
+    otro. Todas las celdas viven en un único arreglo (self.cells), con una
+    celda centinela vacía al final, y cada celda guarda el índice de su
+    vecino de atrás y de adelante; así la Regla 184 se aplica a toda la red
+    con una sola consulta a la tabla y los giros son escrituras indexadas.
+
+    Con el motor "sparse" cada generación recorre solo la lista ordenada de
+    celdas con auto (self.cars): avanza cada auto sano cuya celda de adelante
+    está libre, y las averías y reparaciones se sortean por auto, así que el
+    costo depende del número de autos y no del largo de la red. self.cells
+    se mantiene al día con escrituras puntuales, para dibujar y consultar
+    carriles igual que con el motor denso. El motor "auto" (el
+    predeterminado) cambia entre ambos según la densidad.
+
+    add_lane, add_junction y add_turn solo anotan la red; el arreglo de
+    celdas y los índices se arman una sola vez en finalize(), que update(),
+    lane() y broken() llaman solos si hace falta. Hay que llamarlo antes de
+    leer self.cells directamente tras agregar carriles.
+    """
+
+    def __init__(self, boundary_mode="toroid", seed=None, engine="auto"):
+        self.boundary_mode = boundary_mode  # "toroid" o "null"
+        # Motor pedido ("auto", "dense" o "sparse") y motor en uso
+        self.engine_setting = engine
+        self.engine = "sparse" if engine == "sparse" else "dense"
+        # Un generador por subsistema: las celdas de todos los carriles viven
+        # en un solo arreglo y cada fase saca un bloque por generación
+        self.seed, self.streams = spawn_streams(seed, ("repairs", "breakdowns", "turns", "insertion"))
+
+        self.lanes = {}      # Nombre -> (primera celda, número de celdas, dirección)
+        self.junctions = {}  # Nombre -> {carril: celda del carril en el cruce}
+        self.turns = []      # (cruce, carril de origen, carril de destino, probabilidad)
+
+        # Estado de todas las celdas más la centinela (siempre vacía)
+        self.cells = np.zeros(1, dtype=int)
+        # Generaciones restantes de cada celda (0 = auto sano)
+        self.broken_cars = np.zeros(1, dtype=np.int16)
+        # Carriles agregados que aún no están en self.cells: (primera celda,
+        # número de celdas, autos iniciales), y si hay que rehacer los índices
+        self._pending_lanes = []
+        self._stale = False
+        self._size = 0
+
+        self.generation = 0
+        self.turn_count = 0  # Contador de giros realizados
+        # Tiempo de cada fase de update(), apagado hasta que se active
+        self.timings = PhaseTimings(enabled=False)
+        self._build()
+
+    @property
+    def num_cells(self):
+        return self._size
+
+    def add_lane(self, name, num_cells, direction="left_to_right", num_cars=0):
+        """Agregar un carril con num_cars autos espaciados uniformemente.
+
+        direction indica si los autos avanzan hacia índices mayores
+        ("left_to_right") o menores ("right_to_left").
+        """
+        if name in self.lanes:
+            raise ValueError(f"el carril {name!r} ya existe")
+        start = self._size
+        self.lanes[name] = (start, num_cells, direction)
+        self._pending_lanes.append((start, num_cells, num_cars))
+        self._size += num_cells
+        self._stale = True
+
+    def add_junction(self, name, positions):
+        """Agregar un cruce: positions asocia cada carril con su celda en el cruce."""
+        for lane_name, cell in positions.items():
+            if not 0 <= cell < self.lanes[lane_name][1]:
+                raise IndexError(f"celda {cell} fuera del carril {lane_name!r}")
+        self.junctions[name] = dict(positions)
+        self._stale = True
+
+    def add_turn(self, junction, from_lane, to_lane, probability=CAR_TURN_PROB):
+        """Permitir el giro de from_lane a to_lane en el cruce.
+
+        Los giros que salen de la misma celda se reparten un único número
+        aleatorio, así que sus probabilidades deben sumar a lo más 1.
+        """
+        positions = self.junctions[junction]
+        if from_lane not in positions or to_lane not in positions:
+            raise ValueError(f"ambos carriles deben pasar por el cruce {junction!r}")
+        self.turns.append((junction, from_lane, to_lane, probability))
+        self._stale = True
+
+    def finalize(self):
+        """Armar de una vez las celdas de los carriles nuevos y los índices de la red."""
+        if self._pending_lanes:
+            # Un solo arreglo nuevo para todos los carriles agregados
+            cells = np.zeros(self._size + 1, dtype=int)
+            broken_cars = np.zeros(self._size + 1, dtype=np.int16)
+            built = len(self.cells) - 1
+            cells[:built] = self.cells[:-1]
+            broken_cars[:built] = self.broken_cars[:-1]
+            for start, num_cells, num_cars in self._pending_lanes:
+                if num_cars > 0:
+                    count = min(num_cars, num_cells)
+                    cells[start + (np.arange(count) * num_cells) // count] = 1
+            self.cells = cells
+            self.broken_cars = broken_cars
+            self._pending_lanes = []
+        if self._stale:
+            self._build()
+            self._stale = False
+        return self
+
+    def lane(self, name):
+        """Vista del estado del carril (escribir en ella modifica la red).
+
+        Con el motor disperso hay que llamar a sync_cars() después de
+        escribir en la vista.
+        """
+        self.finalize()
+        start, num_cells, _ = self.lanes[name]
+        return self.cells[start:start + num_cells]
+
+    def broken(self, name):
+        """Vista de las averías del carril."""
+        self.finalize()
+        start, num_cells, _ = self.lanes[name]
+        return self.broken_cars[start:start + num_cells]
+
+    def _build(self):
+        """Precalcular los índices de vecinos, entradas y giros de la red."""
+        sentinel = self.num_cells
+        self._ahead = {}
+        self._behind = {}
+        for mode in ("toroid", "null"):
+            ahead = np.full(sentinel, sentinel)
+            behind = np.full(sentinel, sentinel)
+            for start, num_cells, direction in self.lanes.values():
+                # Celdas en el orden en que las recorren los autos
+                path = np.arange(start, start + num_cells)
+                if direction != "left_to_right":
+                    path = path[::-1]
+                ahead[path[:-1]] = path[1:]
+                behind[path[1:]] = path[:-1]
+                if mode == "toroid":
+                    ahead[path[-1]] = path[0]
+                    behind[path[0]] = path[-1]
+            self._ahead[mode] = ahead
+            self._behind[mode] = behind
+
+        # Celda por la que entran autos a cada carril en frontera nula
+        self._entries = np.array([start if direction == "left_to_right" else start + num_cells - 1
+                                  for start, num_cells, direction in self.lanes.values()], dtype=int)
+
+        # Giros como arreglos de celdas globales. Cada giro dispara si el
+        # número aleatorio de su celda de origen cae en [low, high)
+        turn_from, turn_to, low, high = [], [], [], []
+        used = {}
+        for junction, from_lane, to_lane, probability in self.turns:
+            positions = self.junctions[junction]
+            source = self.lanes[from_lane][0] + positions[from_lane]
+            turn_from.append(source)
+            turn_to.append(self.lanes[to_lane][0] + positions[to_lane])
+            low.append(used.get(source, 0.0))
+            high.append(low[-1] + probability)
+            used[source] = high[-1]
+        self._turn_from = np.array(turn_from, dtype=int)
+        self._turn_to = np.array(turn_to, dtype=int)
+        self._turn_low = np.array(low)
+        self._turn_high = np.array(high)
+        self._turn_sources, self._turn_slot = np.unique(self._turn_from, return_inverse=True)
+        # Celdas que pueden ganar o perder un auto por un giro
+        self._turn_cells = np.unique(np.concatenate([self._turn_from, self._turn_to]))
+        self.sync_cars()
+
+    def sync_cars(self):
+        """Reconstruir la lista de autos a partir de las celdas."""
+        self.cars = np.flatnonzero(self.cells[:-1])
+
+    def choose_engine(self):
+        """Con el motor automático, pasar al disperso o al denso según la densidad."""
+        if self.engine_setting != "auto" or self.num_cells == 0:
+            return
+        if self.engine == "sparse":
+            density = len(self.cars) / self.num_cells
+            if density > 2 * SPARSE_DENSITY:
+                self.engine = "dense"
+        else:
+            density = np.count_nonzero(self.cells) / self.num_cells
+            if density < SPARSE_DENSITY:
+                self.engine = "sparse"
+                self.sync_cars()
+
+    def apply_rule_184(self):
+        """Aplicar la Regla 184 a todas las celdas de la red a la vez.
+
+        Los autos descompuestos no se mueven: para la regla, su celda de
+        adelante cuenta como ocupada y, para la celda que tienen adelante,
+        su celda de atrás cuenta como vacía.
+        """
+        ahead = self._ahead[self.boundary_mode]
+        behind = self._behind[self.boundary_mode]
+        body = self.cells[:-1]
+        stuck = self.broken_cars > 0
+
+        behind_cells = self.cells[behind] & ~stuck[behind]
+        ahead_cells = self.cells[ahead] | stuck[:-1]
+        pattern = (behind_cells << 2) | (body << 1) | ahead_cells
+        body[:] = RULE_184[pattern]
+
+    def apply_turns(self):
+        """Pasar autos de un carril a otro en los cruces."""
+        if len(self._turn_from) == 0:
+            return 0
+        rolls = self.streams["turns"].random(len(self._turn_sources))[self._turn_slot]
+        fire = ((self.cells[self._turn_from] == 1)
+                & (self.broken_cars[self._turn_from] == 0)
+                & (self.cells[self._turn_to] == 0)
+                & (rolls >= self._turn_low) & (rolls < self._turn_high))
+
+        # Si dos giros llegan a la misma celda, gana el que se declaró primero
+        fired = np.flatnonzero(fire)
+        _, first = np.unique(self._turn_to[fired], return_index=True)
+        fired = fired[first]
+
+        self.cells[self._turn_from[fired]] = 0
+        self.cells[self._turn_to[fired]] = 1
+        return len(fired)
+
+    def update(self):
+        if self._stale:
+            self.finalize()
+        self.generation += 1
+        timings = self.timings
+        timings.start()
+        self.choose_engine()
+        if self.engine == "sparse":
+            self.update_sparse()
+            return
+        body = self.cells[:-1]
+        broken = self.broken_cars[:-1]
+
+        # Procesar primero los autos descompuestos
+        tick_breakdowns(body, broken, self.streams["repairs"], REPAIR_PROB)
+        timings.lap("handle_broken_cars")
+
+        # Mover todos los carriles y después aplicar los giros en los cruces
+        self.apply_rule_184()
+        timings.lap("rule")
+        self.turn_count += self.apply_turns()
+        timings.lap("turns")
+
+        # Nuevas averías
+        new_breakdowns = (body == 1) & (broken == 0) & (self.streams["breakdowns"].random(len(body)) < CAR_BREAKDOWN_PROB)
+        broken[new_breakdowns] = REPAIR_ATTEMPTS
+        timings.lap("decisions")
+
+        # En frontera nula entran autos por la primera celda de cada carril
+        if self.boundary_mode == "null" and len(self._entries):
+            insert = (self.cells[self._entries] == 0) & (self.streams["insertion"].random(len(self._entries)) < CAR_INSERTION_PROB)
+            self.cells[self._entries[insert]] = 1
+        timings.lap("insertion")
+
+    def update_sparse(self):
+        """update() recorriendo solo la lista de autos."""
+        timings = self.timings
+        cells = self.cells
+        broken = self.broken_cars
+        cars = self.cars
+
+        # Procesar primero los autos descompuestos: solo una celda con auto
+        # puede tenerlos, y se recorren en el mismo orden que tick_breakdowns
+        active = cars[broken[cars] > 0]
+        expiring = active[broken[active] <= 1]
+        towed = expiring[self.streams["repairs"].random(len(expiring)) >= REPAIR_PROB]
+        cells[towed] = 0
+        broken[active] -= 1
+        cars = cars[cells[cars] == 1]
+        timings.lap("handle_broken_cars")
+
+        # Regla 184: avanza cada auto sano con la celda de adelante libre (la
+        # centinela, siempre libre, es la salida en frontera nula)
+        targets = self._ahead[self.boundary_mode][cars]
+        move = (broken[cars] == 0) & (cells[targets] == 0)
+        arrived = targets[move]
+        cells[cars[move]] = 0
+        cells[arrived] = 1
+        cells[-1] = 0
+        cars = np.concatenate([cars[~move], arrived[arrived != self.num_cells]])
+        timings.lap("rule")
+
+        # Giros en los cruces; después actualizar la lista en sus celdas
+        self.turn_count += self.apply_turns()
+        if len(self._turn_cells):
+            turn_cells = self._turn_cells
+            cars = np.concatenate([cars[~np.isin(cars, turn_cells)], turn_cells[cells[turn_cells] == 1]])
+        cars = np.sort(cars)
+        timings.lap("turns")
+
+        # Nuevas averías, un número aleatorio por auto
+        rolls = self.streams["breakdowns"].random(len(cars))
+        broken[cars[(broken[cars] == 0) & (rolls < CAR_BREAKDOWN_PROB)]] = REPAIR_ATTEMPTS
+        timings.lap("decisions")
+
+        # En frontera nula entran autos por la primera celda de cada carril
+        if self.boundary_mode == "null" and len(self._entries):
+            insert = (cells[self._entries] == 0) & (self.streams["insertion"].random(len(self._entries)) < CAR_INSERTION_PROB)
+            cells[self._entries[insert]] = 1
+            cars = np.sort(np.concatenate([cars, self._entries[insert]]))
+        timings.lap("insertion")
+
+        self.cars = cars
+
+
+def cross_network(boundary_mode="toroid", seed=None, num_cells_horizontal=50, num_cells_vertical=60, engine="auto"):
+    """Red equivalente al cruce de cruce.py: cuatro carreteras de dos carriles y un cruce."""
+    network = TrafficNetworkSimulator(boundary_mode, seed, engine)
+    h, v = num_cells_horizontal, num_cells_vertical
+    # Los carriles verticales de arriba a abajo avanzan hacia índices mayores
+    lanes = [
+        ("upper_1", h, "right_to_left", 8), ("lower_1", h, "right_to_left", 7),
+        ("upper_2", h, "left_to_right", 8), ("lower_2", h, "left_to_right", 7),
+        ("left_3", v, "left_to_right", 8), ("right_3", v, "left_to_right", 7),
+        ("left_4", v, "right_to_left", 8), ("right_4", v, "right_to_left", 7),
+    ]
+    for name, num_cells, direction, num_cars in lanes:
+        network.add_lane(name, num_cells, direction, num_cars)
+
+    network.add_junction("centro", {name: (h if name[-1] in "12" else v) // 2 for name, *_ in lanes})
+    network.add_turn("centro", "lower_1", "right_4")
+    network.add_turn("centro", "lower_2", "left_3")
+    network.add_turn("centro", "left_3", "upper_1")
+    network.add_turn("centro", "right_4", "upper_2")
+    return network.finalize()
+
+
+def corridor_network(num_crossings, block_cells=10, density=0.2, boundary_mode="toroid", seed=None, engine="auto"):
+    """Avenida de dos carriles cruzada por num_crossings calles de un carril.
+
+    Cada calle cruza la avenida a mitad de su cuadra; los autos pueden
+    entrar a la calle desde el carril inferior y volver a la avenida por el
+    carril superior.
+    """
+    network = TrafficNetworkSimulator(boundary_mode, seed, engine)
+    avenue_cells = num_crossings * block_cells
+    network.add_lane("avenue_upper", avenue_cells, "left_to_right", int(density * avenue_cells))
+    network.add_lane("avenue_lower", avenue_cells, "left_to_right", int(density * avenue_cells))
+    for k in range(num_crossings):
+        street = f"street_{k}"
+        network.add_lane(street, 2 * block_cells, "left_to_right", int(density * 2 * block_cells))
+        crossing = k * block_cells + block_cells // 2
+        network.add_junction(street, {"avenue_upper": crossing, "avenue_lower": crossing, street: block_cells})
+        network.add_turn(street, "avenue_lower", street)
+        network.add_turn(street, street, "avenue_upper")
+    return network.finalize()
@@ -0,0 +1,196 @@
+import json
+import os
+
+import numpy as np
+
+# Archivo con la descripción de la grabación
+METADATA_FILE = "registro.json"
+# Generación del simulador en cada cuadro grabado (int64, un valor por cuadro)
+GENERATIONS_FILE = "generaciones.int64"
+# Generaciones reservadas al crear la grabación; el archivo crece al doble al llenarse
+INITIAL_CAPACITY = 4096
+
+
+def _dense(lane):
+    """Carril como arreglo de un byte por celda (desempaqueta PackedLane)."""
+    if hasattr(lane, "to_array"):
+        return lane.to_array(np.uint8)
+    return lane
+
+
+class SpacetimeRecorder:
+    """Diagrama espacio-tiempo de cada carril guardado en disco.
+
+    Cada carril tiene dos archivos en la carpeta de la grabación: sus
+    estados (<carril>.lane) y su máscara de averías (<carril>.broken), ambos
+    como matrices (generaciones, celdas) de un byte por celda abiertas con
+    np.memmap. Los archivos se reservan por adelantado y duplican su tamaño
+    al llenarse, así que grabar una generación es copiar una fila. lane() y
+    broken() devuelven vistas del mapa en memoria, sin copias. Junto a cada
+    cuadro se guarda la generación en que estaba el simulador
+    (generaciones.int64), que no coincide con el número de cuadro si la
+    grabación empezó tarde o no se grabaron todas las generaciones.
+    """
+
+    def __init__(self, path, lanes, capacity=INITIAL_CAPACITY, mode="w", metadata=None):
+        """Crear una grabación (mode="w") o abrir una existente ("r" o "a").
+
+        lanes asocia el nombre de cada carril con su número de celdas y
+        metadata guarda datos libres de la corrida (simulador, modo de
+        frontera); al abrir una grabación existente ambos se toman del disco.
+        """
+        self.path = path
+        self.mode = mode
+        if mode == "w":
+            os.makedirs(path, exist_ok=True)
+            self.lanes = dict(lanes)
+            self.metadata = dict(metadata or {})
+            self.generations = 0
+            self.capacity = capacity
+        else:
+            with open(os.path.join(path, METADATA_FILE)) as f:
+                metadata = json.load(f)
+            self.lanes = metadata["lanes"]
+            self.metadata = metadata.get("metadata", {})
+            self.generations = metadata["generations"]
+            self.capacity = metadata["capacity"] if mode == "a" else self.generations
+
+        self._cells = {}
+        self._broken = {}
+        for name, num_cells in self.lanes.items():
+            self._cells[name] = self._open(name, "lane", num_cells)
+            self._broken[name] = self._open(name, "broken", num_cells)
+        self._generations = self._open_generations()
+        if mode == "w":
+            self._write_metadata()
+
+    @classmethod
+    def for_simulator(cls, simulator, path, capacity=INITIAL_CAPACITY):
+        """Grabación con todos los carriles de simulator.LANES."""
+        lanes = {name: len(getattr(simulator, name)) for name, _, _ in simulator.LANES}
+        metadata = {"simulator": f"{type(simulator).__module__}.{type(simulator).__name__}",
+                    "boundary_mode": simulator.boundary_mode}
+        return cls(path, lanes, capacity, metadata=metadata)
+
+    def _filename(self, name, kind):
+        return os.path.join(self.path, f"{name}.{kind}")
+
+    def _open(self, name, kind, num_cells):
+        filename = self._filename(name, kind)
+        if self.mode == "r":
+            if self.generations == 0:
+                return np.zeros((0, num_cells), dtype=np.uint8)
+            return np.memmap(filename, dtype=np.uint8, mode="r", shape=(self.generations, num_cells))
+        file_mode = "w+" if self.mode == "w" else "r+"
+        return np.memmap(filename, dtype=np.uint8, mode=file_mode, shape=(self.capacity, num_cells))
+
+    def _open_generations(self):
+        filename = os.path.join(self.path, GENERATIONS_FILE)
+        if self.mode != "w" and not os.path.exists(filename):
+            # Grabación anterior a este archivo: el cuadro es la generación
+            generations = np.arange(self.capacity, dtype=np.int64)
+            if self.mode == "a":
+                generations.tofile(filename)
+            else:
+                return generations
+        if self.mode == "r":
+            if self.generations == 0:
+                return np.zeros(0, dtype=np.int64)
+            return np.memmap(filename, dtype=np.int64, mode="r", shape=(self.generations,))
+        file_mode = "w+" if self.mode == "w" else "r+"
+        return np.memmap(filename, dtype=np.int64, mode=file_mode, shape=(self.capacity,))
+
+    def _grow(self):
+        """Duplicar la capacidad de todos los archivos."""
+        self.flush()
+        self.capacity *= 2
+        for name, num_cells in self.lanes.items():
+            for kind, maps in (("lane", self._cells), ("broken", self._broken)):
+                del maps[name]
+                with open(self._filename(name, kind), "r+b") as f:
+                    f.truncate(self.capacity * num_cells)
+                maps[name] = np.memmap(self._filename(name, kind), dtype=np.uint8, mode="r+",
+                                       shape=(self.capacity, num_cells))
+        filename = os.path.join(self.path, GENERATIONS_FILE)
+        del self._generations
+        with open(filename, "r+b") as f:
+            f.truncate(self.capacity * np.dtype(np.int64).itemsize)
+        self._generations = np.memmap(filename, dtype=np.int64, mode="r+", shape=(self.capacity,))
+
+    def append(self, states, generation=None):
+        """Grabar una generación: states asocia cada carril con (carril, averías).
+
+        generation es la generación del simulador en ese estado; si se omite
+        se usa el número de cuadro.
+        """
+        if self.mode == "r":
+            raise ValueError("la grabación se abrió solo para lectura")
+        if self.generations == self.capacity:
+            self._grow()
+        row = self.generations
+        for name, (lane, broken) in states.items():
+            self._cells[name][row] = _dense(lane)
+            self._broken[name][row] = np.asarray(broken) > 0
+        self._generations[row] = row if generation is None else generation
+        self.generations += 1
+
+    def record(self, simulator):
+        """Grabar el estado actual de todos los carriles del simulador."""
+        self.append({name: (getattr(simulator, name), getattr(simulator, broken_name))
+                     for name, broken_name, _ in simulator.LANES}, simulator.generation)
+
+    def lane(self, name, start=0, stop=None):
+        """Estados del carril en las generaciones [start, stop), sin copiar."""
+        return self._cells[name][:self.generations][start:stop]
+
+    def broken(self, name, start=0, stop=None):
+        """Máscara de averías del carril en las generaciones [start, stop), sin copiar."""
+        return self._broken[name][:self.generations][start:stop]
+
+    def state(self, generation):
+        """Estado de la generación: diccionario carril -> (carril, máscara de averías)."""
+        if not 0 <= generation < self.generations:
+            raise IndexError("generación fuera de la grabación")
+        return {name: (self._cells[name][generation], self._broken[name][generation]) for name in self.lanes}
+
+    def generation(self, frame):
+        """Generación del simulador en el cuadro frame de la grabación."""
+        if not 0 <= frame < self.generations:
+            raise IndexError("generación fuera de la grabación")
+        return int(self._generations[frame])
+
+    def __len__(self):
+        return self.generations
+
+    def _write_metadata(self):
+        metadata = {"lanes": self.lanes, "generations": self.generations, "capacity": self.capacity,
+                    "metadata": self.metadata}
+        with open(os.path.join(self.path, METADATA_FILE), "w") as f:
+            json.dump(metadata, f)
+
+    def flush(self):
+        """Asegurar que lo grabado está en disco."""
+        if self.mode == "r":
+            return
+        for maps in (self._cells, self._broken):
+            for memmap in maps.values():
+                memmap.flush()
+        self._generations.flush()
+        self._write_metadata()
+
+    def close(self):
+        self.flush()
+        self._cells = {}
+        self._broken = {}
+        self._generations = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_recording(path, mode="r"):
+    """Abrir una grabación existente para leerla ("r") o seguir grabando ("a")."""
+    return SpacetimeRecorder(path, None, mode=mode)
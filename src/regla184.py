@@ -0,0 +1,167 @@
+import numpy as np
+
+# Tabla de búsqueda de la Regla 184, indexada por el patrón (atrás, centro, adelante)
+# 111 -> 1
+# 110 -> 0
+# 101 -> 1
+# 100 -> 1
+# 011 -> 1
+# 010 -> 0
+# 001 -> 0
+# 000 -> 0
+RULE_184 = np.array([0, 0, 0, 1, 1, 1, 0, 1])
+
+
+def _neighbours(lane, boundary_mode, direction):
+    """Vecino de atrás (del que llegan los coches) y de adelante de cada celda."""
+    behind = np.zeros_like(lane)
+    ahead = np.zeros_like(lane)
+
+    if direction == "left_to_right":
+        behind[..., 1:] = lane[..., :-1]
+        ahead[..., :-1] = lane[..., 1:]
+        if boundary_mode == "toroid":
+            behind[..., 0] = lane[..., -1]
+            ahead[..., -1] = lane[..., 0]
+    else:
+        # De derecha a izquierda: equivale a invertir el carril, aplicar la
+        # regla y volver a invertirlo
+        behind[..., :-1] = lane[..., 1:]
+        ahead[..., 1:] = lane[..., :-1]
+        if boundary_mode == "toroid":
+            behind[..., -1] = lane[..., 0]
+            ahead[..., 0] = lane[..., -1]
+    return behind, ahead
+
+
+def neighbours(lane, boundary_mode="toroid", direction="left_to_right"):
+    """Vecino de atrás y de adelante de cada celda; direction puede ir por renglón.
+
+    Con un arreglo (carriles, celdas), direction puede ser una secuencia con
+    el sentido de cada renglón: en los de derecha a izquierda el vecino de
+    atrás y el de adelante se intercambian (también al dar la vuelta).
+    """
+    if isinstance(direction, str):
+        return _neighbours(lane, boundary_mode, direction)
+    behind, ahead = _neighbours(lane, boundary_mode, "left_to_right")
+    backward = (np.asarray(direction) != "left_to_right")[:, None]
+    return np.where(backward, ahead, behind), np.where(backward, behind, ahead)
+
+
+def apply_rule(lane, rule_output=RULE_184, boundary_mode="toroid", direction="left_to_right"):
+    """Aplicar una regla elemental a todas las celdas del carril a la vez.
+
+    El carril puede ser un arreglo 1D o un arreglo apilado (..., celdas); la
+    regla se aplica sobre el último eje. En lugar de recorrer celda por celda,
+    se construyen los vecinos desplazando el arreglo completo y se consulta la
+    tabla con el patrón de tres bits de cada celda. Con un arreglo
+    (carriles, celdas), direction puede ser una secuencia con el sentido de
+    cada renglón.
+    """
+    lane = np.asarray(lane)
+    behind, ahead = neighbours(lane, boundary_mode, direction)
+    pattern = (behind << 2) | (lane << 1) | ahead
+    return np.asarray(rule_output, dtype=lane.dtype)[pattern]
+
+
+def moving_cars(lane, boundary_mode="toroid", direction="left_to_right"):
+    """Máscara de los autos con la celda de adelante libre, los que avanzan.
+
+    En frontera nula el auto de la última celda cuenta como que avanza,
+    porque sale del carril.
+    """
+    lane = np.asarray(lane)
+    _, ahead = _neighbours(lane, boundary_mode, direction)
+    return (lane == 1) & (ahead == 0)
+
+
+def _window_min(values, width, count):
+    """Mínimo de values[k:k + width] para cada k en range(count).
+
+    Algoritmo de van Herk/Gil-Werman: mínimos acumulados hacia adelante y
+    hacia atrás por bloques de tamaño width, en O(len(values)).
+    """
+    size = count + width - 1
+    num_blocks = -(-size // width)
+    padded = np.full(num_blocks * width, np.iinfo(np.int64).max, dtype=np.int64)
+    # Más allá de los valores dados la ventana no tiene candidatos
+    values = values[:size]
+    padded[:len(values)] = values
+    blocks = padded.reshape(num_blocks, width)
+    prefix = np.minimum.accumulate(blocks, axis=1).ravel()
+    suffix = np.minimum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    starts = np.arange(count)
+    return np.minimum(suffix[starts], prefix[starts + width - 1])
+
+
+def _advance_rule_184(lane, n_generations, boundary_mode):
+    """Avance exacto de la Regla 184 (izquierda a derecha) en O(celdas).
+
+    Cada auto k avanza si la celda de adelante está libre, así que su
+    posición cumple x_k(t) = min(x_k(t-1) + 1, x_{k+1}(t-1) - 1). Desarrollando
+    la recurrencia queda x_k(t) = t + min_{0<=m<=t} (x_{k+m} - 2m), un mínimo
+    sobre una ventana de autos que se resuelve sin simular cada generación.
+    """
+    num_cells = len(lane)
+    positions = np.flatnonzero(lane).astype(np.int64)
+    num_cars = len(positions)
+    new_lane = np.zeros_like(lane)
+    if num_cars == 0:
+        return new_lane
+
+    t = n_generations
+    car_ids = np.arange(num_cars, dtype=np.int64)
+    # a_j = x_j - 2j; el mínimo de la ventana [k, k + t] da la posición final
+    slack = positions - 2 * car_ids
+
+    if boundary_mode == "toroid":
+        # En el anillo el auto j + N es el auto j una vuelta más adelante:
+        # a_{j+N} = a_j + D, con D = celdas - 2 * autos
+        drift = num_cells - 2 * num_cars
+        extended = np.concatenate([slack, slack + drift])
+        laps, rest = divmod(t, num_cars)
+        if drift >= 0 or laps == 0:
+            # El mínimo está dentro de la primera vuelta
+            window = _window_min(extended, min(t, num_cars - 1) + 1, num_cars)
+            base = t
+        else:
+            # Con densidad mayor a 1/2 conviene llegar a la última vuelta posible
+            window = _window_min(extended, rest + 1, num_cars) + drift
+            if rest + 1 < num_cars:
+                window = np.minimum(window, _window_min(extended[rest + 1:], num_cars - 1 - rest, num_cars))
+            base = t + (laps - 1) * drift
+        new_positions = (base % num_cells + 2 * car_ids + window) % num_cells
+    else:
+        # Frontera nula: el último auto no tiene a nadie adelante y los autos
+        # que pasan de la última celda salen del carril
+        window = _window_min(slack, min(t, num_cars - 1) + 1, num_cars)
+        new_positions = t + 2 * car_ids + window
+        new_positions = new_positions[new_positions < num_cells]
+
+    new_lane[new_positions] = 1
+    return new_lane
+
+
+def advance(lane, n_generations, rule_output=RULE_184, boundary_mode="toroid", direction="left_to_right"):
+    """Estado del carril tras n_generations aplicaciones de apply_rule.
+
+    Con la tabla de la Regla 184 el resultado se calcula directamente a
+    partir de las posiciones de los autos, en O(celdas) sin importar el
+    número de generaciones. Con cualquier otra tabla se avanza generación
+    por generación, que es la referencia.
+    """
+    lane = np.asarray(lane)
+    if lane.ndim > 1:
+        return np.stack([advance(row, n_generations, rule_output, boundary_mode, direction) for row in lane])
+
+    if not np.array_equal(rule_output, RULE_184):
+        new_lane = lane.copy()
+        for _ in range(n_generations):
+            new_lane = apply_rule(new_lane, rule_output, boundary_mode, direction)
+        return new_lane
+
+    if n_generations <= 0:
+        return lane.copy()
+    if direction == "left_to_right":
+        return _advance_rule_184(lane, n_generations, boundary_mode)
+    return _advance_rule_184(lane[::-1], n_generations, boundary_mode)[::-1].copy()
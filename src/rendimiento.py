@@ -0,0 +1,329 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import numpy as np
+
+# Sin ventana: el dibujado se mide sobre una superficie fuera de pantalla
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+import carril
+import cruce
+import doble_carril
+from empaquetado import PackedLane
+from regla184 import RULE_184, apply_rule
+
+# Modelos medidos: módulo, clase, motores disponibles y constantes con el
+# largo de los carriles (en cruce los verticales miden 6/5 de los horizontales)
+MODELS = {
+    "carril": (carril, "TrafficSimulator", ("dense", "packed"), ("NUM_CELLS",)),
+    "doble_carril": (doble_carril, "DoubleRoadTrafficSimulator", ("dense", "packed"), ("NUM_CELLS",)),
+    "cruce": (cruce, "TrafficCrossSimulator", ("dense",), ("NUM_CELLS_HORIZONTAL", "NUM_CELLS_VERTICAL")),
+}
+
+# Rejilla predeterminada: largo de carril, densidad y frontera
+BENCH_SIZES = (50, 1_000, 100_000, 10_000_000)
+BENCH_DENSITIES = (0.05, 0.3, 0.6, 0.95)
+BOUNDARY_MODES = ("toroid", "null")
+# Rejilla de --quick, para revisar un cambio en segundos
+QUICK_SIZES = (50, 10_000)
+QUICK_DENSITIES = (0.1, 0.6)
+QUICK_CELL_BUDGET = 100_000
+QUICK_DRAW_FRAMES = 20
+
+# Celdas que procesa cada repetición: fija cuántas generaciones se miden
+# (muchas en carriles cortos, pocas en los de millones de celdas)
+CELL_BUDGET = 2_000_000
+MAX_GENERATIONS = 200
+# Repeticiones de cada medición; se informa la mediana
+BENCH_REPEATS = 5
+# Cuadros por repetición al medir draw()
+DRAW_FRAMES = 100
+# Aumento relativo del tiempo a partir del cual compare marca una regresión
+REGRESSION_THRESHOLD = 0.15
+# Celdas del carril de referencia con que se mide la velocidad de la máquina
+REFERENCE_CELLS = 1_000_000
+
+
+def _lane_sizes(model, cells):
+    """Valores de las constantes de largo del modelo para carriles de cells celdas."""
+    names = MODELS[model][3]
+    if len(names) == 1:
+        return {names[0]: cells}
+    return {names[0]: cells, names[1]: cells * 6 // 5}
+
+
+def make_simulator(model, boundary_mode, engine, density, seed):
+    """Simulador con carriles llenados al azar a la densidad pedida.
+
+    Todos los modelos se llenan igual (cada celda ocupada con probabilidad
+    density), así que las densidades son comparables entre modelos; en
+    cruce el límite de cada vialidad se fija en sus autos iniciales.
+    """
+    module, class_name, _, _ = MODELS[model]
+    cls = getattr(module, class_name)
+    if model == "cruce":
+        simulator = cls(boundary_mode, seed=seed)
+    else:
+        simulator = cls(boundary_mode, engine=engine, density=density, seed=seed)
+
+    rng = np.random.default_rng(seed)
+    for name, broken_name, _ in simulator.LANES:
+        size = len(getattr(simulator, broken_name))
+        lane = (rng.random(size) < density).astype(int)
+        setattr(simulator, name, PackedLane.from_array(lane) if engine == "packed" else lane)
+    if model == "cruce":
+        counts = [int(np.sum(getattr(simulator, name))) for name, _, _ in simulator.LANES]
+        simulator.road_counts = [counts[k] + counts[k + 1] for k in range(0, len(counts), 2)]
+        simulator.road_caps = list(simulator.road_counts)
+    return simulator
+
+
+def reference_ms(repeats=BENCH_REPEATS):
+    """Tiempo de un paso de apply_rule sobre un carril fijo (el mejor de repeats).
+
+    Se guarda con los resultados: compare divide entre el cociente de las
+    referencias para descontar que una máquina (o un momento) sea más lenta.
+    """
+    lane = (np.random.default_rng(0).random(REFERENCE_CELLS) < 0.3).astype(int)
+    return min(_timed(lambda: apply_rule(lane, RULE_184, "toroid"), 10, repeats))
+
+
+def _timed(function, count, repeats):
+    """Milisegundos por llamada: mediana y mínimo sobre las repeticiones."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(count):
+            function()
+        times.append((time.perf_counter() - start) / count * 1000)
+    return statistics.median(times), min(times)
+
+
+def bench_update(model, boundary_mode, engine, cells, density, seed=0, repeats=BENCH_REPEATS,
+                 cell_budget=CELL_BUDGET):
+    """Medir update() sin ventana; devuelve una fila de resultados."""
+    module = MODELS[model][0]
+    sizes = _lane_sizes(model, cells)
+    saved = {name: getattr(module, name) for name in sizes}
+    try:
+        for name, value in sizes.items():
+            setattr(module, name, value)
+        simulator = make_simulator(model, boundary_mode, engine, density, seed)
+        generations = int(np.clip(cell_budget // cells, 1, MAX_GENERATIONS))
+        # Calentamiento: una repetición sin medir
+        for _ in range(generations):
+            simulator.update()
+        median, best = _timed(simulator.update, generations, repeats)
+    finally:
+        for name, value in saved.items():
+            setattr(module, name, value)
+
+    total_cells = sum(sizes.values()) * len(simulator.LANES) // len(sizes)
+    return {
+        "kind": "update", "model": model, "boundary_mode": boundary_mode, "engine": engine,
+        "cells": cells, "density": density, "generations": generations, "repeats": repeats,
+        "ms": median, "min_ms": best, "cells_per_second": total_cells / (median / 1000),
+    }
+
+
+def bench_draw(model, boundary_mode, density, seed=0, repeats=BENCH_REPEATS, frames=DRAW_FRAMES):
+    """Medir draw() sobre una superficie fuera de pantalla, con los carriles de la ventana.
+
+    Cada cuadro avanza una generación (sin medirla) y mide el dibujado de
+    las zonas que cambiaron, como en el visor.
+    """
+    module = MODELS[model][0]
+    module.init_viewer(pygame.Surface((module.WIDTH, module.HEIGHT)))
+    simulator = make_simulator(model, boundary_mode, "dense", density, seed)
+    simulator.draw()
+
+    times = []
+    for _ in range(repeats):
+        elapsed = 0.0
+        for _ in range(frames):
+            simulator.update()
+            start = time.perf_counter()
+            simulator.draw()
+            elapsed += time.perf_counter() - start
+        times.append(elapsed / frames * 1000)
+
+    cells = _lane_sizes(model, getattr(module, MODELS[model][3][0]))
+    return {
+        "kind": "draw", "model": model, "boundary_mode": boundary_mode, "engine": "dense",
+        "cells": min(cells.values()), "density": density, "generations": frames, "repeats": repeats,
+        "ms": statistics.median(times), "min_ms": min(times),
+    }
+
+
+def run_suite(models=tuple(MODELS), sizes=BENCH_SIZES, densities=BENCH_DENSITIES,
+              boundary_modes=BOUNDARY_MODES, engines=("dense", "packed"), draw=True,
+              repeats=BENCH_REPEATS, seed=0, cell_budget=CELL_BUDGET, draw_frames=DRAW_FRAMES,
+              on_result=None):
+    """Ejecutar toda la rejilla y devolver el documento de resultados.
+
+    Las configuraciones se ejecutan una tras otra en este proceso, para que
+    no compitan por los núcleos; on_result, si se da, recibe cada fila.
+    """
+    results = []
+    reference = reference_ms(repeats)
+
+    def add(row):
+        results.append(row)
+        if on_result is not None:
+            on_result(row)
+
+    for model in models:
+        available = MODELS[model][2]
+        grid = itertools.product([e for e in engines if e in available], sizes, densities, boundary_modes)
+        for engine, cells, density, boundary_mode in grid:
+            add(bench_update(model, boundary_mode, engine, cells, density, seed, repeats, cell_budget))
+        if draw:
+            for density, boundary_mode in itertools.product(densities, boundary_modes):
+                add(bench_draw(model, boundary_mode, density, seed, repeats, draw_frames))
+
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "machine": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        # Referencia antes y después de la rejilla; se usa la menor
+        "reference_ms": min(reference, reference_ms(repeats)),
+        "results": results,
+    }
+
+
+def _key(row):
+    return (row["kind"], row["model"], row["boundary_mode"], row["engine"], row["cells"], row["density"])
+
+
+def compare(baseline, current, threshold=REGRESSION_THRESHOLD, normalize=True):
+    """Comparar dos documentos de resultados.
+
+    Devuelve una lista de (fila actual, tiempo base, cociente, estado) para
+    las configuraciones presentes en ambos; el estado es "regresión" si el
+    tiempo creció más que threshold, "mejora" si bajó en la misma
+    proporción y "" si no. Con normalize, el cociente se divide entre el de
+    las mediciones de referencia de ambos documentos.
+    """
+    scale = 1.0
+    if normalize and baseline.get("reference_ms") and current.get("reference_ms"):
+        scale = current["reference_ms"] / baseline["reference_ms"]
+    previous = {_key(row): row for row in baseline["results"]}
+    rows = []
+    for row in current["results"]:
+        old = previous.get(_key(row))
+        if old is None:
+            continue
+        ratio = row["ms"] / old["ms"] / scale if old["ms"] else float("inf")
+        if ratio > 1 + threshold:
+            status = "regresión"
+        elif ratio < 1 / (1 + threshold):
+            status = "mejora"
+        else:
+            status = ""
+        rows.append((row, old["ms"], ratio, status))
+    return rows
+
+
+def _describe(row):
+    return (f"{row['kind']:<7}{row['model']:<14}{row['engine']:<8}{row['boundary_mode']:<8}"
+            f"{row['cells']:>10}{row['density']:>6.2f}")
+
+
+def _print_row(row):
+    print(f"{_describe(row)}{row['ms']:>12.4f} ms", flush=True)
+
+
+def _write(document, path):
+    with open(path, "w") as output:
+        json.dump(document, output, indent=2)
+
+
+def _read(path):
+    with open(path) as source:
+        return json.load(source)
+
+
+def _print_comparison(rows, threshold):
+    print(f"{'tipo':<7}{'modelo':<14}{'motor':<8}{'modo':<8}{'celdas':>10}{'dens.':>6}"
+          f"{'base ms':>12}{'actual ms':>12}{'cociente':>10}")
+    for row, old_ms, ratio, status in rows:
+        print(f"{_describe(row)}{old_ms:>12.4f}{row['ms']:>12.4f}{ratio:>10.2f}  {status}")
+    regressions = sum(1 for *_, status in rows if status == "regresión")
+    print(f"{regressions} regresiones de {len(rows)} configuraciones (umbral {threshold:.0%})")
+    return regressions
+
+
+def _int_list(text):
+    return [int(float(value)) for value in text.split(",")]
+
+
+def _float_list(text):
+    return [float(value) for value in text.split(",")]
+
+
+def _str_list(text):
+    return text.split(",")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mediciones de rendimiento de los simuladores")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Ejecutar la rejilla y guardar los resultados en JSON")
+    run.add_argument("--output", default="rendimiento.json", help="Archivo JSON de resultados")
+    run.add_argument("--models", type=_str_list, default=list(MODELS))
+    run.add_argument("--sizes", type=_int_list, default=None, help="Largos de carril, p. ej. 50,1e5,1e7")
+    run.add_argument("--densities", type=_float_list, default=None)
+    run.add_argument("--boundary-modes", type=_str_list, default=list(BOUNDARY_MODES))
+    run.add_argument("--engines", type=_str_list, default=["dense", "packed"])
+    run.add_argument("--repeats", type=int, default=BENCH_REPEATS)
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--no-draw", action="store_true", help="No medir draw()")
+    run.add_argument("--quick", action="store_true", help="Rejilla reducida")
+    run.add_argument("--compare", metavar="BASE", help="Comparar al terminar con este archivo")
+    run.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    run.add_argument("--no-normalize", action="store_true", help="No descontar la medición de referencia")
+
+    check = commands.add_parser("compare", help="Comparar dos archivos de resultados")
+    check.add_argument("baseline")
+    check.add_argument("current")
+    check.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    check.add_argument("--no-normalize", action="store_true", help="No descontar la medición de referencia")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        sizes = args.sizes or (QUICK_SIZES if args.quick else BENCH_SIZES)
+        densities = args.densities or (QUICK_DENSITIES if args.quick else BENCH_DENSITIES)
+        document = run_suite(args.models, sizes, densities, args.boundary_modes, args.engines,
+                             not args.no_draw, args.repeats, args.seed,
+                             QUICK_CELL_BUDGET if args.quick else CELL_BUDGET,
+                             QUICK_DRAW_FRAMES if args.quick else DRAW_FRAMES, _print_row)
+        _write(document, args.output)
+        print(f"Resultados en {args.output}")
+        current = document
+        baseline_path = args.compare
+    else:
+        current = _read(args.current)
+        baseline_path = args.baseline
+
+    if baseline_path is not None:
+        rows = compare(_read(baseline_path), current, args.threshold, not args.no_normalize)
+        if _print_comparison(rows, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+import importlib
+import os
+import sys
+import threading
+
+import numpy as np
+import pygame
+
+import visor
+from registro import open_recording
+from trayectoria import TrajectoryReader
+
+# Simuladores que se pueden reproducir: módulo -> clase
+MODELS = {
+    "carril": "TrafficSimulator",
+    "doble_carril": "DoubleRoadTrafficSimulator",
+    "cruce": "TrafficCrossSimulator",
+}
+
+# Generaciones que el hilo de fondo decodifica por adelantado
+PREFETCH_SIZE = 32
+# Velocidad inicial de reproducción (generaciones por segundo)
+REPLAY_SPEED = 10
+# Salto de Shift + flecha (generaciones)
+LONG_SEEK = 1000
+
+
+def open_source(path):
+    """Abrir una corrida grabada: carpeta de registro.py o archivo de trayectoria.py."""
+    if os.path.isdir(path):
+        return open_recording(path)
+    return TrajectoryReader(path)
+
+
+def find_model(source):
+    """Módulo y clase cuyo LANES tiene los mismos carriles que la grabación."""
+    recorded = set(source.state(0)) if len(source) else set()
+    for module_name, class_name in MODELS.items():
+        cls = getattr(importlib.import_module(module_name), class_name)
+        if {name for name, _, _ in cls.LANES} == recorded:
+            return sys.modules[module_name], class_name
+    raise ValueError("la grabación no corresponde a ningún simulador conocido")
+
+
+class PrefetchBuffer:
+    """Generaciones decodificadas en un hilo de fondo antes de mostrarse.
+
+    get() devuelve el estado pedido y deja planeadas las siguientes
+    generaciones en el sentido y al paso de la reproducción; el hilo las
+    decodifica mientras se dibuja el cuadro actual. Al saltar o cambiar de
+    sentido el plan se reemplaza y se descartan los estados que ya no
+    sirven, así que el búfer nunca pasa de unas cuantas generaciones.
+    """
+
+    def __init__(self, source, size=PREFETCH_SIZE):
+        self.source = source
+        self.size = size
+        self.frames = {}  # Generación -> estado decodificado
+        self.plan = []    # Generaciones pendientes, en el orden en que se mostrarán
+        self.condition = threading.Condition()
+        # Las fuentes guardan un archivo abierto y un bloque en caché:
+        # solo un hilo a la vez las lee
+        self.source_lock = threading.Lock()
+        self.running = True
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def _decode(self, generation):
+        with self.source_lock:
+            return self.source.state(generation)
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while self.running and not self.plan:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                generation = self.plan.pop(0)
+            state = self._decode(generation)
+            with self.condition:
+                if len(self.frames) <= 2 * self.size:
+                    self.frames[generation] = state
+
+    def get(self, generation, step=1):
+        """Estado de la generación; planear generation + step, + 2 * step, ..."""
+        upcoming = [generation + step * k for k in range(1, self.size + 1)]
+        upcoming = [g for g in upcoming if 0 <= g < len(self.source)]
+        with self.condition:
+            keep = set(upcoming)
+            keep.add(generation)
+            self.frames = {g: state for g, state in self.frames.items() if g in keep}
+            self.plan = [g for g in upcoming if g not in self.frames]
+            state = self.frames.get(generation)
+            self.condition.notify()
+        if state is None:
+            # El hilo aún no llegaba (primer cuadro o un salto): decodificar aquí
+            state = self._decode(generation)
+            with self.condition:
+                self.frames[generation] = state
+        return state
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+
+class ReplayPlayer:
+    """Posición, sentido y velocidad de la reproducción."""
+
+    def __init__(self, num_generations):
+        self.num_generations = num_generations
+        self.position = 0
+        self.direction = 1  # 1 = hacia adelante, -1 = en reversa
+        self.speed = REPLAY_SPEED
+        self.paused = False
+
+    def step(self):
+        """Avanzar una generación en el sentido actual; pausar al llegar a un extremo."""
+        target = self.position + self.direction
+        if 0 <= target < self.num_generations:
+            self.position = target
+        else:
+            self.paused = True
+
+    def seek(self, generation):
+        self.position = min(max(generation, 0), self.num_generations - 1)
+
+    def stride(self):
+        """Generaciones que avanza la reproducción entre cuadros (con signo)."""
+        return self.direction * max(1, round(self.speed / visor.FRAME_RATE))
+
+    def status(self):
+        direction = "adelante" if self.direction > 0 else "reversa"
+        state = "pausa" if self.paused else f"{self.speed} gen/s {direction}"
+        return f"Repetición: {self.position + 1}/{self.num_generations} | {state}"
+
+
+def load_state(simulator, state, generation):
+    """Copiar un estado grabado a los atributos que dibuja draw().
+
+    generation es la generación que había alcanzado el simulador al
+    grabarse el estado (source.generation(cuadro)), no el número de cuadro.
+    """
+    for name, broken_name, _ in simulator.LANES:
+        lane, broken = state[name]
+        setattr(simulator, name, np.asarray(lane, dtype=int))
+        setattr(simulator, broken_name, np.asarray(broken, dtype=np.int16))
+    simulator.generation = generation
+    if hasattr(simulator, "road_counts"):
+        # En cruce cada vialidad son dos carriles consecutivos de LANES
+        counts = [int(getattr(simulator, name).sum()) for name, _, _ in simulator.LANES]
+        simulator.road_counts = [counts[k] + counts[k + 1] for k in range(0, len(counts), 2)]
+
+
+def replay(path, module=None, class_name=None):
+    """Reproducir con la vista de pygame una corrida grabada en path.
+
+    module y class_name eligen el simulador que dibuja; si se omiten se
+    deduce de los carriles grabados.
+    """
+    source = open_source(path)
+    if len(source) == 0:
+        raise ValueError(f"{path} no tiene generaciones grabadas")
+    if module is None:
+        module, class_name = find_model(source)
+
+    module.init_viewer()
+    # El simulador solo se usa para dibujar: sus carriles se reemplazan en
+    # cada cuadro por los de la grabación
+    simulator = getattr(module, class_name)(source.metadata.get("boundary_mode", "toroid"))
+    player = ReplayPlayer(len(source))
+    buffer = PrefetchBuffer(source)
+    clock = pygame.time.Clock()
+    pacer = visor.GenerationPacer()
+    running = True
+
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEOEXPOSE:
+                module.renderer.invalidate()
+            elif event.type == pygame.KEYDOWN:
+                jump = LONG_SEEK if event.mod & pygame.KMOD_SHIFT else 1
+                if event.key == pygame.K_SPACE:
+                    player.paused = not player.paused
+                elif event.key == pygame.K_r:
+                    player.direction = -player.direction
+                elif event.key == pygame.K_RIGHT:
+                    player.seek(player.position + jump)
+                elif event.key == pygame.K_LEFT:
+                    player.seek(player.position - jump)
+                elif event.key == pygame.K_HOME:
+                    player.seek(0)
+                elif event.key == pygame.K_END:
+                    player.seek(player.num_generations - 1)
+                elif pygame.K_0 <= event.key <= pygame.K_9:
+                    # Saltar a una décima parte de la grabación
+                    player.seek((event.key - pygame.K_0) * player.num_generations // 10)
+                elif event.key == pygame.K_UP:
+                    player.speed = visor.speed_up(player.speed)
+                elif event.key == pygame.K_DOWN:
+                    player.speed = visor.slow_down(player.speed)
+
+        pacer.run(player.step, player.speed, player.paused)
+
+        load_state(simulator, buffer.get(player.position, player.stride()), source.generation(player.position))
+        pygame.display.update(simulator.draw(f"{player.status()} | {pacer.hud_text()}"))
+        clock.tick(visor.FRAME_RATE)
+
+    buffer.close()
+    source.close()
+    pygame.quit()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print("uso: python repeticion.py <grabación o trayectoria>")
+        sys.exit(1)
+    replay(sys.argv[1])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+
+# Mediciones que guarda cada fase (las más recientes)
+TIMING_HISTORY = 1024
+# Percentiles que resume stats()
+TIMING_PERCENTILES = (50, 90, 99)
+# Cada cuánto se recalcula el texto del panel en pantalla (segundos)
+OVERLAY_REFRESH = 0.5
+# Fases por renglón del panel
+OVERLAY_PHASES_PER_LINE = 4
+
+
+class PhaseTimings:
+    """Tiempo de cada fase de update() y draw(), medido como vueltas de cronómetro.
+
+    start() marca el inicio y cada lap(fase) guarda el tiempo transcurrido
+    desde la marca anterior, así que medir una fase cuesta una sola lectura
+    de time.perf_counter(). Cada fase guarda sus últimas mediciones en un
+    búfer circular y stats() resume media, percentiles y máximo en
+    milisegundos. Con enabled = False, start() y lap() no hacen nada: los
+    simuladores siempre llevan uno y la tecla P lo activa.
+    """
+
+    def __init__(self, capacity=TIMING_HISTORY, enabled=True):
+        self.capacity = capacity
+        self.enabled = enabled
+        self.samples = {}  # Fase -> búfer de segundos
+        self.counts = {}   # Fase -> mediciones registradas
+        self._last = 0.0
+        self._overlay = ([], 0.0, None)  # (renglones, momento en que se calcularon, fases por renglón)
+
+    @classmethod
+    def attach(cls, simulator, capacity=TIMING_HISTORY):
+        """Crear las mediciones activas y conectarlas al simulador."""
+        simulator.timings = cls(capacity)
+        return simulator.timings
+
+    def start(self):
+        """Marcar el inicio de la primera fase."""
+        if self.enabled:
+            self._last = time.perf_counter()
+
+    def lap(self, phase):
+        """Cerrar la fase: registrar el tiempo desde la marca anterior."""
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        self.record(phase, now - self._last)
+        self._last = now
+
+    def record(self, phase, seconds):
+        buffer = self.samples.get(phase)
+        if buffer is None:
+            buffer = self.samples[phase] = np.zeros(self.capacity)
+            self.counts[phase] = 0
+        buffer[self.counts[phase] % self.capacity] = seconds
+        self.counts[phase] += 1
+
+    def reset(self):
+        self.samples.clear()
+        self.counts.clear()
+        self._overlay = ([], 0.0, None)
+
+    def stats(self):
+        """Resumen por fase, en el orden en que se midieron por primera vez.
+
+        Diccionario fase -> {"count", "mean", "p50", "p90", "p99", "max"},
+        con los tiempos en milisegundos sobre las últimas mediciones.
+        """
+        summary = {}
+        for phase, buffer in self.samples.items():
+            values = buffer[:min(self.counts[phase], self.capacity)] * 1000
+            row = {"count": self.counts[phase], "mean": float(values.mean())}
+            for percentile, value in zip(TIMING_PERCENTILES, np.percentile(values, TIMING_PERCENTILES)):
+                row[f"p{percentile}"] = float(value)
+            row["max"] = float(values.max())
+            summary[phase] = row
+        return summary
+
+    def report(self):
+        """Tabla de stats() como texto, para imprimir en modo headless."""
+        header = f"{'fase':<20}{'n':>8}{'media':>10}" + "".join(f"{f'p{p}':>10}" for p in TIMING_PERCENTILES)
+        lines = [header + f"{'máx':>10}  (ms)"]
+        for phase, row in self.stats().items():
+            values = [row["mean"]] + [row[f"p{p}"] for p in TIMING_PERCENTILES] + [row["max"]]
+            lines.append(f"{phase:<20}{row['count']:>8}" + "".join(f"{value:>10.3f}" for value in values))
+        return "\n".join(lines)
+
+    def overlay_lines(self, per_line=OVERLAY_PHASES_PER_LINE):
+        """Renglones del panel en pantalla: p50/p99 de cada fase, per_line fases por renglón.
+
+        El texto se recalcula a lo más cada OVERLAY_REFRESH segundos para
+        que se pueda leer y el HUD no lo vuelva a renderizar en cada cuadro.
+        """
+        lines, computed, computed_per_line = self._overlay
+        now = time.perf_counter()
+        if now - computed < OVERLAY_REFRESH and per_line == computed_per_line:
+            return lines
+        entries = [f"{phase} {row['p50']:.2f}/{row['p99']:.2f}" for phase, row in self.stats().items()]
+        lines = ["p50/p99 ms: " + " | ".join(entries[k:k + per_line])
+                 for k in range(0, len(entries), per_line)]
+        self._overlay = (lines, now, per_line)
+        return lines
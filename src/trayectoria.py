@@ -0,0 +1,245 @@
+import json
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from regla184 import RULE_184, apply_rule
+
+# Formato del archivo:
+#   MAGIC | longitud de metadatos (uint32) | metadatos JSON
+#   bloques comprimidos con zlib, uno cada KEYFRAME_INTERVAL generaciones
+#   índice: (posición, longitud, generaciones) de cada bloque
+#   generación del simulador en cada cuadro: la primera y las diferencias
+#   (int64, comprimidas con zlib)
+#   posición del índice (uint64) | posición de las generaciones (uint64) | MAGIC
+#
+# Un bloque empieza con un cuadro clave (el estado completo, con los bits
+# empaquetados) y sigue con un residuo por generación: el XOR entre el estado
+# real y la predicción, que es aplicar la regla al estado anterior. Como la
+# regla explica casi todo el movimiento, los residuos solo tienen los eventos
+# aleatorios (averías, cambios de carril, inserciones, giros) y se comprimen
+# muy bien.
+MAGIC = b"R184TRJ2"
+# Formato anterior, sin las generaciones: el cuadro es la generación
+MAGIC_V1 = b"R184TRJ1"
+KEYFRAME_INTERVAL = 256
+_INDEX_ENTRY = struct.Struct("<QII")
+
+
+def _dense(lane):
+    """Carril como arreglo de un byte por celda (desempaqueta PackedLane)."""
+    if hasattr(lane, "to_array"):
+        return lane.to_array(np.uint8)
+    return np.asarray(lane, dtype=np.uint8)
+
+
+def simulator_metadata(simulator, seed=None):
+    """Metadatos de una corrida: modo de frontera, carriles, regla, constantes y semilla."""
+    module = sys.modules[type(simulator).__module__]
+    constants = {name: value for name, value in vars(module).items()
+                 if name.isupper() and isinstance(value, (int, float)) and not isinstance(value, bool)}
+    rule_output = getattr(module, "RULE_OUTPUT", RULE_184)
+    return {
+        "simulator": f"{module.__name__}.{type(simulator).__name__}",
+        "boundary_mode": simulator.boundary_mode,
+        "lanes": [[name, len(getattr(simulator, name)), direction] for name, _, direction in simulator.LANES],
+        "rule_output": [int(value) for value in rule_output],
+        "constants": constants,
+        "seed": seed if seed is not None else getattr(simulator, "seed", None),
+    }
+
+
+class _FrameCodec:
+    """Empaquetado de un estado completo y predicción del siguiente."""
+
+    def __init__(self, metadata):
+        self.boundary_mode = metadata["boundary_mode"]
+        self.lanes = metadata["lanes"]
+        self.rule_output = np.array(metadata["rule_output"], dtype=np.uint8)
+        self.lane_bytes = [(num_cells + 7) // 8 for _, num_cells, _ in self.lanes]
+        self.frame_size = 2 * sum(self.lane_bytes)
+
+    def pack(self, lanes, broken):
+        parts = [np.packbits(lane) for lane in lanes] + [np.packbits(mask) for mask in broken]
+        return np.concatenate(parts)
+
+    def unpack(self, frame):
+        lanes, broken = [], []
+        offset = 0
+        for target in (lanes, broken):
+            for (_, num_cells, _), size in zip(self.lanes, self.lane_bytes):
+                target.append(np.unpackbits(frame[offset:offset + size], count=num_cells))
+                offset += size
+        return lanes, broken
+
+    def predict(self, lanes, broken):
+        """Estado esperado en la siguiente generación: la regla aplicada a cada carril."""
+        predicted = [apply_rule(lane, self.rule_output, self.boundary_mode, direction)
+                     for lane, (_, _, direction) in zip(lanes, self.lanes)]
+        return self.pack(predicted, broken)
+
+
+class TrajectoryWriter:
+    """Escribe una corrida en el formato comprimido de trayectorias."""
+
+    def __init__(self, path, metadata, keyframe_interval=KEYFRAME_INTERVAL):
+        self.metadata = dict(metadata, keyframe_interval=keyframe_interval)
+        self.codec = _FrameCodec(self.metadata)
+        self.keyframe_interval = keyframe_interval
+        self.generations = 0
+        self.frame_generations = []
+        self.index = []
+        self._block = []
+        self._previous = None
+
+        self.file = open(path, "wb")
+        header = json.dumps(self.metadata).encode()
+        self.file.write(MAGIC + struct.pack("<I", len(header)) + header)
+
+    @classmethod
+    def for_simulator(cls, simulator, path, seed=None, keyframe_interval=KEYFRAME_INTERVAL):
+        return cls(path, simulator_metadata(simulator, seed), keyframe_interval)
+
+    def append(self, lanes, broken, generation=None):
+        """Agregar una generación (listas de carriles y de averías, en el orden de los metadatos).
+
+        generation es la generación del simulador en ese estado; si se omite
+        se usa el número de cuadro.
+        """
+        lanes = [_dense(lane) for lane in lanes]
+        broken = [(np.asarray(mask) > 0).astype(np.uint8) for mask in broken]
+        frame = self.codec.pack(lanes, broken)
+        if not self._block:
+            self._block.append(frame)
+        else:
+            self._block.append(frame ^ self.codec.predict(*self._previous))
+        self._previous = (lanes, broken)
+        self.frame_generations.append(self.generations if generation is None else generation)
+        self.generations += 1
+        if len(self._block) == self.keyframe_interval:
+            self._flush_block()
+
+    def record(self, simulator):
+        """Agregar el estado actual del simulador."""
+        self.append([getattr(simulator, name) for name, _, _ in simulator.LANES],
+                    [getattr(simulator, broken_name) for _, broken_name, _ in simulator.LANES],
+                    simulator.generation)
+
+    def _flush_block(self):
+        data = zlib.compress(np.concatenate(self._block).tobytes(), 9)
+        self.index.append((self.file.tell(), len(data), len(self._block)))
+        self.file.write(data)
+        self._block = []
+
+    def close(self):
+        if self._block:
+            self._flush_block()
+        index_offset = self.file.tell()
+        for entry in self.index:
+            self.file.write(_INDEX_ENTRY.pack(*entry))
+        generations_offset = self.file.tell()
+        # Casi siempre crecen de uno en uno: las diferencias se comprimen a casi nada
+        deltas = np.diff(np.array(self.frame_generations, dtype=np.int64), prepend=0)
+        self.file.write(zlib.compress(deltas.tobytes(), 9))
+        self.file.write(struct.pack("<QQ", index_offset, generations_offset) + MAGIC)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class TrajectoryReader:
+    """Lee una trayectoria con acceso aleatorio por generación.
+
+    Ir a una generación cuesta a lo más un intervalo entre cuadros clave:
+    se descomprime su bloque y se reconstruye desde el cuadro clave. El
+    último bloque reconstruido se guarda, así que leer en orden es barato.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        magic = self.file.read(len(MAGIC))
+        if magic not in (MAGIC, MAGIC_V1):
+            raise ValueError(f"{path} no es un archivo de trayectoria")
+        (header_size,) = struct.unpack("<I", self.file.read(4))
+        self.metadata = json.loads(self.file.read(header_size))
+        self.codec = _FrameCodec(self.metadata)
+        self.keyframe_interval = self.metadata["keyframe_interval"]
+        self.lane_names = [name for name, _, _ in self.metadata["lanes"]]
+
+        trailer_size = 8 if magic == MAGIC_V1 else 16
+        trailer_start = self.file.seek(0, 2) - trailer_size - len(MAGIC)
+        self.file.seek(trailer_start)
+        offsets = struct.unpack("<Q" if magic == MAGIC_V1 else "<QQ", self.file.read(trailer_size))
+        if self.file.read(len(MAGIC)) != magic:
+            raise ValueError(f"{path} está incompleto (no se cerró el escritor)")
+        index_offset = offsets[0]
+        index_end = offsets[1] if magic == MAGIC else trailer_start
+        self.file.seek(index_offset)
+        self.index = list(_INDEX_ENTRY.iter_unpack(self.file.read(index_end - index_offset)))
+        self.generations = sum(count for _, _, count in self.index)
+        if magic == MAGIC:
+            deltas = np.frombuffer(zlib.decompress(self.file.read(trailer_start - index_end)), dtype=np.int64)
+            self.frame_generations = np.cumsum(deltas)
+        else:
+            self.frame_generations = np.arange(self.generations, dtype=np.int64)
+
+        self._cached_block = None
+        self._cached_frames = None
+
+    def __len__(self):
+        return self.generations
+
+    def _block_frames(self, block):
+        """Estados empaquetados de todas las generaciones del bloque."""
+        if self._cached_block != block:
+            offset, size, count = self.index[block]
+            self.file.seek(offset)
+            raw = np.frombuffer(zlib.decompress(self.file.read(size)), dtype=np.uint8)
+            frames = raw.reshape(count, self.codec.frame_size).copy()
+            state = self.codec.unpack(frames[0])
+            for k in range(1, count):
+                frames[k] ^= self.codec.predict(*state)
+                state = self.codec.unpack(frames[k])
+            self._cached_block = block
+            self._cached_frames = frames
+        return self._cached_frames
+
+    def state(self, generation):
+        """Estado de la generación: diccionario carril -> (carril, máscara de averías)."""
+        if not 0 <= generation < self.generations:
+            raise IndexError("generación fuera de la trayectoria")
+        block, row = divmod(generation, self.keyframe_interval)
+        lanes, broken = self.codec.unpack(self._block_frames(block)[row])
+        return dict(zip(self.lane_names, zip(lanes, broken)))
+
+    def __getitem__(self, generation):
+        return self.state(generation)
+
+    def generation(self, frame):
+        """Generación del simulador en el cuadro frame de la trayectoria."""
+        if not 0 <= frame < self.generations:
+            raise IndexError("generación fuera de la trayectoria")
+        return int(self.frame_generations[frame])
+
+    def lane(self, name, start=0, stop=None):
+        """Diagrama espacio-tiempo (generaciones, celdas) de un carril en [start, stop)."""
+        start, stop, _ = slice(start, stop).indices(self.generations)
+        return np.array([self.state(g)[name][0] for g in range(start, stop)], dtype=np.uint8)
+
+    def compressed_size(self):
+        return sum(size for _, size, _ in self.index)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
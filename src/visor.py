@@ -0,0 +1,300 @@
+import os
+import random
+import time
+
+import pygame
+
+# Carpeta de imágenes del proyecto
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets")
+
+# Cuadros por segundo del visor, independientes de la velocidad de simulación
+FRAME_RATE = 60
+# Velocidad máxima de simulación (generaciones por segundo)
+MAX_SIMULATION_SPEED = 100000
+
+
+def open_screen(width, height, caption, surface=None):
+    """Inicializar pygame y devolver la superficie donde dibujar.
+
+    Si se pasa una superficie (por ejemplo, una fuera de pantalla) se usa
+    esa en lugar de abrir una ventana.
+    """
+    pygame.init()
+    if surface is None:
+        surface = pygame.display.set_mode((width, height))
+        pygame.display.set_caption(caption)
+    return surface
+
+
+def load_image(name, size):
+    """Cargar una imagen de assets/ y escalarla al tamaño indicado."""
+    image = pygame.image.load(os.path.join(ASSETS_DIR, name))
+    return pygame.transform.scale(image, size)
+
+
+def tint_broken(image):
+    """Copia de la imagen con un tinte rojo para autos descompuestos."""
+    # Copia profunda para no modificar el original
+    broken = image.copy()
+    red_overlay = pygame.Surface(image.get_size(), pygame.SRCALPHA)
+    red_overlay.fill((255, 0, 0, 100))
+    broken.blit(red_overlay, (0, 0))
+    return broken
+
+
+def create_font(size):
+    """Fuente para los textos del visor."""
+    # Intentar cargar una fuente que soporte Unicode
+    try:
+        return pygame.font.SysFont("Arial", size)  # Arial suele soportar más símbolos
+    except:
+        return pygame.font.SysFont(None, 24)  # Fuente por defecto si no se encuentra Arial
+
+
+def make_shadow(cell_size):
+    """Sombra semitransparente que se dibuja debajo de cada auto."""
+    shadow = pygame.Surface((cell_size - 10, 10))
+    shadow.fill((30, 30, 30))
+    shadow.set_alpha(100)
+    return shadow
+
+
+def make_smoke_puffs():
+    """Bocanadas de humo prearmadas, de 5 a 10 píxeles y alfa de 50 a 150."""
+    puffs = []
+    for size in range(5, 11):
+        for alpha in range(50, 151, 25):
+            puff = pygame.Surface((size, size))
+            puff.fill((255, 255, 255))
+            puff.set_alpha(alpha)
+            puffs.append(puff)
+    return puffs
+
+
+def smoke_layers(puffs, x_range, y_range, count=3):
+    """Capas de humo en posiciones al azar dentro de los rangos dados (inclusivos)."""
+    return [(random.choice(puffs), (random.randint(*x_range), random.randint(*y_range)))
+            for _ in range(count)]
+
+
+class DirtyRenderer:
+    """Dibuja solo las zonas de la pantalla que cambiaron desde el cuadro anterior.
+
+    Cada cuadro se describe como una lista ordenada de elementos (clave,
+    capas), donde capas es una secuencia de (superficie, posición). Un
+    elemento está sucio si es nuevo, desapareció o cambió alguna de sus
+    capas. En cada zona sucia se restaura el fondo y se vuelven a dibujar,
+    recortados a la zona y en su orden, todos los elementos que la tocan;
+    así las superficies semitransparentes nunca se mezclan dos veces.
+    """
+
+    def __init__(self, screen, background):
+        self.screen = screen
+        if pygame.display.get_surface() is screen:
+            # Mismo formato que la ventana para copiar el fondo más rápido
+            background = background.convert()
+        self.background = background
+        self.invalidate()
+
+    def invalidate(self):
+        """Forzar que el próximo cuadro se dibuje completo."""
+        self.previous = None
+
+    def render(self, items):
+        """Dibujar el cuadro y devolver los rectángulos de pantalla que cambiaron."""
+        current = {}
+        for key, layers in items:
+            layers = tuple(layers)
+            rect = pygame.Rect(layers[0][1], layers[0][0].get_size())
+            for surface, position in layers[1:]:
+                rect.union_ip(pygame.Rect(position, surface.get_size()))
+            current[key] = (layers, rect)
+
+        if self.previous is None:
+            self.screen.blit(self.background, (0, 0))
+            for layers, _ in current.values():
+                self.screen.blits(layers, doreturn=False)
+            self.previous = current
+            return [self.screen.get_rect()]
+
+        dirty = []
+        for key, (layers, rect) in current.items():
+            old = self.previous.get(key)
+            if old is None:
+                dirty.append(rect)
+            elif old[0] != layers:
+                dirty.append(rect.union(old[1]))
+        for key, (_, rect) in self.previous.items():
+            if key not in current:
+                dirty.append(rect)
+
+        rects = [rect for _, rect in current.values()]
+        all_layers = [layers for layers, _ in current.values()]
+        for area in dirty:
+            self.screen.set_clip(area)
+            self.screen.blit(self.background, area, area)
+            for index in area.collidelistall(rects):
+                self.screen.blits(all_layers[index], doreturn=False)
+        self.screen.set_clip(None)
+
+        self.previous = current
+        return dirty
+
+
+def speed_up(speed):
+    """Siguiente velocidad: de 2 en 2 hasta 30 y luego duplicando."""
+    if speed < 30:
+        return min(speed + 2, 30)
+    return min(speed * 2, MAX_SIMULATION_SPEED)
+
+
+def slow_down(speed):
+    """Velocidad anterior, inversa de speed_up (también desde el tope MAX_SIMULATION_SPEED)."""
+    if speed > 30:
+        # Mayor valor de la secuencia 30, 60, 120, ... que queda por debajo
+        previous = 30
+        while previous * 2 < speed:
+            previous *= 2
+        return previous
+    return max(speed - 2, 1)
+
+
+def timing_items(hud, timings, position, per_line=4, line_height=28):
+    """Elementos del panel de tiempos por fase (ninguno si las mediciones están apagadas)."""
+    if not timings.enabled:
+        return []
+    x, y = position
+    return [(("timings", k), hud.label(("timings", k), line, (x, y + k * line_height)))
+            for k, line in enumerate(timings.overlay_lines(per_line))]
+
+
+class GenerationPacer:
+    """Paso fijo: reparte las generaciones entre los cuadros del visor.
+
+    Cada cuadro acumula el tiempo transcurrido por la velocidad objetivo
+    (generaciones por segundo) y ejecuta las generaciones completas que
+    correspondan, así que a 10 gen/s avanza una generación cada pocos
+    cuadros y a 10^4 gen/s ejecuta cientos por cuadro. Si la simulación no
+    alcanza, se detiene al agotar el presupuesto del cuadro y descarta el
+    atraso en lugar de acumularlo.
+    """
+
+    def __init__(self, frame_rate=FRAME_RATE, budget=0.8):
+        self.budget = budget / frame_rate  # Segundos de simulación por cuadro
+        self.pending = 0.0
+        self.last = time.perf_counter()
+
+        # Mediciones para el HUD
+        self.generations_per_second = 0.0
+        self.frame_time = 0.0
+        self._window_generations = 0
+        self._window_time = 0.0
+
+    def run(self, update, speed, paused=False):
+        """Ejecutar las generaciones de este cuadro y devolver cuántas se ejecutaron."""
+        now = time.perf_counter()
+        elapsed = now - self.last
+        self.last = now
+
+        ran = 0
+        if not paused:
+            self.pending += elapsed * speed
+            deadline = now + self.budget
+            while self.pending >= 1:
+                update()
+                ran += 1
+                self.pending -= 1
+                if time.perf_counter() >= deadline:
+                    # No se alcanza la velocidad objetivo: descartar el atraso
+                    self.pending = 0.0
+                    break
+
+        # Promediar sobre ventanas de medio segundo para que el HUD sea legible
+        self._window_generations += ran
+        self._window_time += elapsed
+        if self._window_time >= 0.5:
+            self.generations_per_second = self._window_generations / self._window_time
+            self._window_generations = 0
+            self._window_time = 0.0
+        self.frame_time = 0.9 * self.frame_time + 0.1 * elapsed
+        return ran
+
+    def hud_text(self):
+        return f"Gen/s: {self.generations_per_second:.0f} | Cuadro: {self.frame_time * 1000:.1f} ms"
+
+
+class Hud:
+    """Etiquetas del HUD con el texto y los fondos semitransparentes en caché.
+
+    Cada etiqueta se identifica por una clave y solo se vuelve a renderizar
+    cuando cambia su texto; mientras no cambie devuelve las mismas capas,
+    de modo que DirtyRenderer no la vuelve a dibujar. Los textos sueltos
+    (por ejemplo, las instrucciones) se guardan por su contenido.
+    """
+
+    # Límite de textos guardados; al superarlo se vacía la caché
+    MAX_CACHED_TEXTS = 256
+
+    def __init__(self, font, color=(0, 0, 0)):
+        self.font = font
+        self.color = color
+        self._texts = {}   # Texto -> superficie renderizada
+        self._boxes = {}   # (ancho, alto, color, alfa) -> fondo
+        self._labels = {}  # Clave -> (contenido, capas)
+
+    def render(self, text):
+        """Superficie del texto, renderizada una sola vez."""
+        surface = self._texts.get(text)
+        if surface is None:
+            if len(self._texts) >= self.MAX_CACHED_TEXTS:
+                self._texts.clear()
+            surface = self.font.render(text, True, self.color)
+            self._texts[text] = surface
+        return surface
+
+    def box(self, width, height, color=(220, 220, 220), alpha=180):
+        """Fondo semitransparente del tamaño dado."""
+        key = (width, height, color, alpha)
+        surface = self._boxes.get(key)
+        if surface is None:
+            surface = pygame.Surface((width, height))
+            surface.fill(color)
+            surface.set_alpha(alpha)
+            self._boxes[key] = surface
+        return surface
+
+    def label(self, key, text, position, align="left"):
+        """Capas de una etiqueta con fondo.
+
+        position es la esquina superior izquierda del fondo o, con
+        align="right", su esquina superior derecha.
+        """
+        cached = self._labels.get(key)
+        if cached is not None and cached[0] == (text, position, align):
+            return cached[1]
+        rendered = self.render(text)
+        background = self.box(rendered.get_width() + 10, rendered.get_height() + 6)
+        x, y = position
+        if align == "right":
+            x -= background.get_width()
+        layers = ((background, (x, y)), (rendered, (x + 5, y + 3)))
+        self._labels[key] = ((text, position, align), layers)
+        return layers
+
+    def bar(self, key, texts, position):
+        """Capas de una fila de textos sobre un fondo común (las instrucciones)."""
+        texts = tuple(texts)
+        cached = self._labels.get(key)
+        if cached is not None and cached[0] == (texts, position):
+            return cached[1]
+        rendered = [self.render(text) for text in texts]
+        total_width = sum(surface.get_width() + 20 for surface in rendered)
+        x, y = position
+        layers = [(self.box(total_width, 30, (240, 240, 240)), (x, y))]
+        x_offset = x + 10
+        for surface in rendered:
+            layers.append((surface, (x_offset, y + 6)))
+            x_offset += surface.get_width() + 20  # Espacio entre textos
+        layers = tuple(layers)
+        self._labels[key] = ((texts, position), layers)
+        return layers
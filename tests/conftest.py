@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Los módulos viven en src/ como scripts sueltos; pygame sin mensaje de bienvenida
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
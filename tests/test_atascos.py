@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import carril
+import doble_carril
+from atascos import JamIndex, JamTracker
+
+GENERATIONS = 300
+
+
+@pytest.mark.parametrize("simulator_class", (carril.TrafficSimulator, doble_carril.DoubleRoadTrafficSimulator))
+@pytest.mark.parametrize("engine", ("dense", "packed"))
+@pytest.mark.parametrize("boundary_mode", ("toroid", "null"))
+def test_tracker_matches_a_fresh_index(simulator_class, engine, boundary_mode):
+    simulator = simulator_class(boundary_mode, engine=engine, seed=4)
+    tracker = JamTracker.attach(simulator)
+    for generation in range(GENERATIONS):
+        simulator.update()
+        for name, _, direction in simulator.LANES:
+            fresh = JamIndex(getattr(simulator, name), boundary_mode, direction)
+            got = [jam[:2] for jam in tracker.indexes[name].jams()]
+            assert got == [jam[:2] for jam in fresh.jams()], f"{name}, generación {generation + 1}"
+
+
+def test_update_without_changed_cells_compares_the_whole_lane():
+    index = JamIndex(np.array([1, 0, 1, 1, 0, 1, 1, 0, 1, 1]), "null", min_length=1)
+    index.update(np.array([1, 0, 1, 1, 1, 1, 1, 0, 1, 1]))
+    assert (2, 5) in [jam[:2] for jam in index.jams()]
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+import carril
+import doble_carril
+from empaquetado import PackedLane
+from regla184 import RULE_184, apply_rule, moving_cars
+
+MODES = ("toroid", "null")
+DIRECTIONS = ("left_to_right", "right_to_left")
+
+
+def lanes(count=20, size=130, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(rng.random(size) < rng.random()).astype(np.uint8) for _ in range(count)]
+
+
+def test_round_trip_and_cell_access():
+    for lane in lanes():
+        packed = PackedLane.from_array(lane)
+        np.testing.assert_array_equal(packed.to_array(np.uint8), lane)
+        assert packed.sum() == lane.sum()
+        np.testing.assert_array_equal(packed.flatnonzero(), np.flatnonzero(lane))
+        cells = np.array([0, 63, 64, 129])
+        np.testing.assert_array_equal(packed[cells], lane[cells])
+        assert packed[-1] == lane[-1]
+
+
+@pytest.mark.parametrize("boundary_mode", MODES)
+@pytest.mark.parametrize("direction", DIRECTIONS)
+def test_step_and_moving_cars_match_dense(boundary_mode, direction):
+    for rule_output in (RULE_184, carril.RULE_OUTPUT):
+        for lane in lanes():
+            packed = PackedLane.from_array(lane)
+            np.testing.assert_array_equal(packed.step(rule_output, boundary_mode, direction).to_array(np.uint8),
+                                          apply_rule(lane, rule_output, boundary_mode, direction))
+            np.testing.assert_array_equal(packed.moving_cars(boundary_mode, direction).to_array(bool),
+                                          moving_cars(lane, boundary_mode, direction))
+
+
+@pytest.mark.parametrize("cls", (carril.TrafficSimulator, doble_carril.DoubleRoadTrafficSimulator))
+@pytest.mark.parametrize("boundary_mode", MODES)
+def test_packed_engine_matches_dense(cls, boundary_mode):
+    dense = cls(boundary_mode, "dense", seed=11)
+    packed = cls(boundary_mode, "packed", seed=11)
+    for _ in range(300):
+        dense.update()
+        packed.update()
+    for name, broken_name, _ in cls.LANES:
+        np.testing.assert_array_equal(getattr(packed, name).to_array(), getattr(dense, name))
+        np.testing.assert_array_equal(getattr(packed, broken_name), getattr(dense, broken_name))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import carril
+import cruce
+import doble_carril
+from metricas import TrafficMetrics
+from regla184 import moving_cars
+
+GENERATIONS = 200
+
+
+def dense(lane):
+    return lane.to_array() if hasattr(lane, "to_array") else np.asarray(lane).copy()
+
+
+def simulators():
+    for boundary_mode in ("toroid", "null"):
+        for engine in ("dense", "packed"):
+            yield lambda mode=boundary_mode, engine=engine: carril.TrafficSimulator(mode, engine=engine, seed=3)
+            yield lambda mode=boundary_mode, engine=engine: doble_carril.DoubleRoadTrafficSimulator(
+                mode, engine=engine, seed=3)
+        yield lambda mode=boundary_mode: cruce.TrafficCrossSimulator(mode, seed=3)
+
+
+@pytest.mark.parametrize("make", list(simulators()))
+def test_totals_follow_the_lanes(make):
+    simulator = make()
+    metrics = TrafficMetrics.attach(simulator)
+    for generation in range(GENERATIONS):
+        before = {name: dense(getattr(simulator, name)) for name, _, _ in simulator.LANES}
+        simulator.update()
+        for name, _, _ in simulator.LANES:
+            changed = np.flatnonzero(before[name] != dense(getattr(simulator, name)))
+            np.testing.assert_array_equal(simulator.changes[name].changed, changed,
+                                          err_msg=f"{name}, generación {generation + 1}")
+        cars = sum(int(np.sum(dense(getattr(simulator, name)))) for name, _, _ in simulator.LANES)
+        broken = sum(int(np.count_nonzero(getattr(simulator, name))) for _, name, _ in simulator.LANES)
+        assert (metrics.cars, metrics.broken) == (cars, broken)
+        assert metrics.latest()["cars"] == cars
+
+
+def test_flow_is_the_moving_cars_under_rule_184(monkeypatch):
+    # Sin averías ni giros el cruce en toroide es la Regla 184 en cada carril
+    monkeypatch.setattr(cruce, "CAR_BREAKDOWN_PROB", 0.0)
+    monkeypatch.setattr(cruce, "CAR_TURN_PROB", 0.0)
+    simulator = cruce.TrafficCrossSimulator("toroid", seed=3)
+    metrics = TrafficMetrics.attach(simulator)
+    for _ in range(GENERATIONS):
+        expected = sum(int(np.count_nonzero(moving_cars(getattr(simulator, name), "toroid", direction)))
+                       for name, _, direction in simulator.LANES)
+        simulator.update()
+        assert metrics.latest()["flow"] == expected
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+import carril
+from particion import ShardedTrafficSimulator
+
+NUM_CELLS = 211
+GENERATIONS = 150
+
+
+def record(simulator):
+    """Carriles y averías del simulador en cada una de GENERATIONS generaciones."""
+    states = []
+    for _ in range(GENERATIONS):
+        simulator.update()
+        states.append([getattr(simulator, name).copy()
+                       for lane in ShardedTrafficSimulator.LANES for name in lane[:2]])
+    return states
+
+
+def assert_follows(simulator, states):
+    for generation, expected in enumerate(states):
+        simulator.update()
+        got = [getattr(simulator, name) for lane in ShardedTrafficSimulator.LANES for name in lane[:2]]
+        for array, reference in zip(got, expected):
+            np.testing.assert_array_equal(array, reference, err_msg=f"generación {generation + 1}")
+
+
+@pytest.fixture(autouse=True)
+def small_lane(monkeypatch):
+    monkeypatch.setattr(carril, "NUM_CELLS", NUM_CELLS)
+
+
+@pytest.mark.parametrize("boundary_mode", ("toroid", "null"))
+def test_one_shard_matches_traffic_simulator(boundary_mode):
+    states = record(carril.TrafficSimulator(boundary_mode, seed=7))
+    with ShardedTrafficSimulator(NUM_CELLS, 1, boundary_mode, seed=7) as simulator:
+        assert_follows(simulator, states)
+
+
+@pytest.mark.parametrize("boundary_mode", ("toroid", "null"))
+@pytest.mark.parametrize("num_shards", (2, 3, 7))
+def test_shards_match_one_shard_without_lane_changes_or_breakdowns(monkeypatch, boundary_mode, num_shards):
+    # Sin cambios de carril ni averías los generadores por fragmento no
+    # intervienen, así que cualquier número de fragmentos da la misma corrida
+    monkeypatch.setattr(carril, "CAR_CHANGE_LANE_PROB", 0.0)
+    monkeypatch.setattr(carril, "CAR_BREAKDOWN_PROB", 0.0)
+    with ShardedTrafficSimulator(NUM_CELLS, 1, boundary_mode, seed=3) as single:
+        states = record(single)
+    with ShardedTrafficSimulator(NUM_CELLS, num_shards, boundary_mode, seed=3) as simulator:
+        assert simulator.num_shards == num_shards
+        assert_follows(simulator, states)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import carril
+from regla184 import RULE_184, advance, apply_rule
+
+TABLES = {"rule_184": RULE_184, "carril": carril.RULE_OUTPUT}
+MODES = ("toroid", "null")
+DIRECTIONS = ("left_to_right", "right_to_left")
+
+
+def reference_rule(lane, rule_output, boundary_mode, direction):
+    """Los ciclos celda por celda originales: izquierda a derecha directo y
+    derecha a izquierda invirtiendo el carril, como en doble_carril."""
+    if direction == "right_to_left":
+        return np.flip(reference_rule(np.flip(lane), rule_output, boundary_mode, "left_to_right"))
+    new_lane = np.zeros_like(lane)
+    for i in range(len(lane)):
+        if boundary_mode == "toroid":
+            left = lane[(i - 1) % len(lane)]
+            right = lane[(i + 1) % len(lane)]
+        else:
+            left = lane[i - 1] if i > 0 else 0
+            right = lane[i + 1] if i < len(lane) - 1 else 0
+        pattern = (left << 2) | (lane[i] << 1) | right
+        new_lane[i] = rule_output[pattern]
+    return new_lane
+
+
+def random_lanes(count=30, size=37, seed=0):
+    rng = np.random.default_rng(seed)
+    lanes = [np.zeros(size, dtype=int), np.ones(size, dtype=int)]
+    lanes += [(rng.random(size) < rng.random()).astype(int) for _ in range(count)]
+    return lanes
+
+
+@pytest.mark.parametrize("table", TABLES)
+@pytest.mark.parametrize("boundary_mode", MODES)
+@pytest.mark.parametrize("direction", DIRECTIONS)
+def test_apply_rule_matches_cell_loop(table, boundary_mode, direction):
+    for lane in random_lanes():
+        expected = reference_rule(lane, TABLES[table], boundary_mode, direction)
+        np.testing.assert_array_equal(apply_rule(lane, TABLES[table], boundary_mode, direction), expected)
+
+
+def test_apply_rule_rule_184_moves_cars_forward():
+    # La tabla de la Regla 184 equivale al "avanza si adelante está libre" de cruce
+    lane = np.array([1, 1, 0, 1, 0, 0, 1])
+    np.testing.assert_array_equal(apply_rule(lane, RULE_184, "null"), [1, 0, 1, 0, 1, 0, 0])
+    np.testing.assert_array_equal(apply_rule(lane, RULE_184, "toroid"), [1, 0, 1, 0, 1, 0, 1])
+
+
+@pytest.mark.parametrize("boundary_mode", MODES)
+@pytest.mark.parametrize("direction", DIRECTIONS)
+def test_apply_rule_stacked_rows_match_single_lanes(boundary_mode, direction):
+    lanes = np.stack(random_lanes(count=6))
+    stacked = apply_rule(lanes, RULE_184, boundary_mode, direction)
+    for row, lane in zip(stacked, lanes):
+        np.testing.assert_array_equal(row, apply_rule(lane, RULE_184, boundary_mode, direction))
+
+
+@pytest.mark.parametrize("table", TABLES)
+@pytest.mark.parametrize("boundary_mode", MODES)
+@pytest.mark.parametrize("direction", DIRECTIONS)
+@pytest.mark.parametrize("generations", (0, 1, 2, 5, 36, 37, 80))
+def test_advance_matches_single_steps(table, boundary_mode, direction, generations):
+    for lane in random_lanes(count=12, seed=generations):
+        expected = lane.copy()
+        for _ in range(generations):
+            expected = apply_rule(expected, TABLES[table], boundary_mode, direction)
+        np.testing.assert_array_equal(advance(lane, generations, TABLES[table], boundary_mode, direction),
+                                      expected)